@@ -0,0 +1,210 @@
+"""Joint Depth-Anything / UniDepth prior sharing one DINOv2 ViT pass.
+
+Both priors read the same four layers of a ViT (the last four blocks after
+the final LayerNorm): Depth-Anything through `get_intermediate_layers(x, 4)`
+and UniDepthV2 through `output_idx=[21, 22, 23, 24]` with the "last" stacking
+function. `SharedDINOv2Prior` runs UniDepthV2 once per frame, grabs those
+tokens from its pixel encoder and feeds them to the Depth-Anything DPT head.
+
+The two backbones were fine-tuned separately, so UniDepth tokens are mapped
+to Depth-Anything token space by `TokenAdapters`, one affine layer per
+level, fitted in closed form (ridge regression) on a calibration clip where
+both backbones are run. `fit_adapters` also reports the resulting accuracy
+delta of the Depth-Anything output, on held-out frames.
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .dpt import DPTHead
+
+
+class TokenAdapters(nn.Module):
+  """Per-level affine maps from UniDepth tokens to Depth-Anything tokens."""
+
+  def __init__(self, dim, num_levels=4):
+    super(TokenAdapters, self).__init__()
+    self.layers = nn.ModuleList(
+        [nn.Linear(dim, dim) for _ in range(num_levels)]
+    )
+    for layer in self.layers:
+      nn.init.eye_(layer.weight)
+      nn.init.zeros_(layer.bias)
+
+  def forward(self, tokens):
+    return [layer(x) for layer, x in zip(self.layers, tokens)]
+
+
+class _RidgeAccumulator:
+  """Accumulates normal equations of an affine least-squares fit."""
+
+  def __init__(self, dim):
+    self.xtx = torch.zeros(dim + 1, dim + 1, dtype=torch.float64)
+    self.xty = torch.zeros(dim + 1, dim, dtype=torch.float64)
+
+  def add(self, src, tgt):
+    src = src.reshape(-1, src.shape[-1]).double().cpu()
+    tgt = tgt.reshape(-1, tgt.shape[-1]).double().cpu()
+    src = torch.cat([src, torch.ones_like(src[:, :1])], dim=-1)
+    self.xtx += src.T @ src
+    self.xty += src.T @ tgt
+
+  def solve(self, ridge):
+    reg = ridge * torch.eye(self.xtx.shape[0], dtype=torch.float64)
+    reg[-1, -1] = 0.0  # do not shrink the bias
+    sol = torch.linalg.solve(self.xtx + reg, self.xty)
+    return sol[:-1].T.float(), sol[-1].float()
+
+
+def make_depth_head(encoder='vitl'):
+  """Builds a DPT head with the Depth-Anything settings of `encoder`."""
+  configs = {
+      'vits': (384, 64, [48, 96, 192, 384]),
+      'vitb': (768, 128, [96, 192, 384, 768]),
+      'vitl': (1024, 256, [256, 512, 1024, 1024]),
+  }
+  dim, features, out_channels = configs[encoder]
+  return DPTHead(1, dim, features, False, out_channels=out_channels)
+
+
+def load_depth_head(depth_head, checkpoint):
+  """Loads only the `depth_head.*` weights of a Depth-Anything checkpoint."""
+  state_dict = torch.load(checkpoint, map_location='cpu')
+  head_state = {
+      k[len('depth_head.'):]: v
+      for k, v in state_dict.items()
+      if k.startswith('depth_head.')
+  }
+  depth_head.load_state_dict(head_state, strict=True)
+  return depth_head
+
+
+class SharedDINOv2Prior(nn.Module):
+  """UniDepthV2 and a Depth-Anything DPT head on a single ViT pass."""
+
+  def __init__(self, unidepth, depth_head, adapters=None, num_levels=4):
+    super(SharedDINOv2Prior, self).__init__()
+    self.unidepth = unidepth
+    self.depth_head = depth_head
+    self.num_levels = num_levels
+    if adapters is None:
+      adapters = TokenAdapters(unidepth.pixel_encoder.embed_dim, num_levels)
+    self.adapters = adapters
+
+    self._encoder_in = None
+    self._encoder_out = None
+    self.unidepth.pixel_encoder.register_forward_hook(self._grab_tokens)
+
+  def _grab_tokens(self, module, inputs, output):
+    del module
+    self._encoder_in = inputs[0]
+    self._encoder_out = output
+
+  def shared_tokens(self):
+    """Last `num_levels` patch tokens [B, h*w, C] of the latest pass."""
+    features, _ = self._encoder_out
+    tokens = [x.flatten(1, 2) for x in features[-self.num_levels:]]
+    patch_h, patch_w = features[-1].shape[1:3]
+    return tokens, patch_h, patch_w
+
+  def depth_anything_from_tokens(self, tokens, patch_h, patch_w):
+    """Same post-processing as DPT_DINOv2.forward."""
+    out_features = [(x, None) for x in tokens]
+    depth = self.depth_head(out_features, patch_h, patch_w)
+    depth = F.interpolate(
+        depth,
+        size=(patch_h * 14, patch_w * 14),
+        mode='bilinear',
+        align_corners=True,
+    )
+    return F.relu(depth).squeeze(1)
+
+  @torch.no_grad()
+  def forward(self, rgb, intrinsics=None):
+    """Returns UniDepthV2.infer predictions and Depth-Anything disparity.
+
+    Args:
+      rgb: [3, H, W] or [B, 3, H, W] uint8 image(s), as for UniDepthV2.infer.
+      intrinsics: optional intrinsics forwarded to UniDepthV2.infer.
+
+    Returns:
+      (predictions, disparity) where disparity is [B, h, w] at the shared
+      network resolution.
+    """
+    predictions = self.unidepth.infer(rgb, intrinsics)
+    tokens, patch_h, patch_w = self.shared_tokens()
+    tokens = self.adapters(tokens)
+    return predictions, self.depth_anything_from_tokens(
+        tokens, patch_h, patch_w
+    )
+
+  @torch.no_grad()
+  def _shared_and_reference(self, depth_anything, rgb):
+    """Shared tokens of a frame and the original backbone's tokens for it."""
+    self.unidepth.infer(rgb)
+    tokens, patch_h, patch_w = self.shared_tokens()
+    # Same normalized, resized image the shared backbone just saw.
+    target = depth_anything.pretrained.get_intermediate_layers(
+        self._encoder_in, self.num_levels, return_class_token=True
+    )
+    return tokens, [x[0] for x in target], patch_h, patch_w
+
+  @torch.no_grad()
+  def fit_adapters(self, depth_anything, frames, eval_frames, ridge=1e-2):
+    """Fits the token adapters to a Depth-Anything backbone.
+
+    Args:
+      depth_anything: full DPT_DINOv2 model whose backbone is the target.
+      frames: iterable of [3, H, W] uint8 calibration images to fit on.
+      eval_frames: iterable of [3, H, W] uint8 held-out images, not in
+        `frames`, on which the accuracy is reported.
+      ridge: ridge regularization of the least-squares fit.
+
+    Returns:
+      dict with the mean AbsRel on `eval_frames` of the Depth-Anything
+      disparity computed from shared tokens, before and after adaptation,
+      against the disparity of the original Depth-Anything backbone.
+    """
+    dim = self.unidepth.pixel_encoder.embed_dim
+    accumulators = [_RidgeAccumulator(dim) for _ in range(self.num_levels)]
+    num_fit = 0
+    for rgb in frames:
+      tokens, target, _, _ = self._shared_and_reference(depth_anything, rgb)
+      for acc, src, tgt in zip(accumulators, tokens, target):
+        acc.add(src, tgt)
+      num_fit += 1
+
+    for layer, acc in zip(self.adapters.layers, accumulators):
+      weight, bias = acc.solve(ridge)
+      layer.weight.copy_(weight)
+      layer.bias.copy_(bias)
+
+    num_eval = 0
+    abs_rel_raw, abs_rel_adapted = [], []
+    for rgb in eval_frames:
+      tokens, target, patch_h, patch_w = self._shared_and_reference(
+          depth_anything, rgb
+      )
+      num_eval += 1
+      ref = self.depth_anything_from_tokens(target, patch_h, patch_w)
+      raw = self.depth_anything_from_tokens(tokens, patch_h, patch_w)
+      adapted = self.depth_anything_from_tokens(
+          self.adapters(tokens), patch_h, patch_w
+      )
+      valid = ref > 1e-3
+      if not valid.any():
+        continue
+      abs_rel_raw.append(
+          ((raw - ref).abs()[valid] / ref[valid]).mean().item()
+      )
+      abs_rel_adapted.append(
+          ((adapted - ref).abs()[valid] / ref[valid]).mean().item()
+      )
+    num_valid = max(len(abs_rel_raw), 1)
+    return {
+        'num_fit_frames': num_fit,
+        'num_eval_frames': num_eval,
+        'abs_rel_shared_raw': sum(abs_rel_raw) / num_valid,
+        'abs_rel_shared_adapted': sum(abs_rel_adapted) / num_valid,
+    }
@@ -0,0 +1,107 @@
+"""Tiled Depth-Anything inference for high-resolution frames.
+
+DINOv2 attention memory grows quadratically with the number of patches, so
+large frames are processed as overlapping fixed-size tiles. Each tile
+predicts affine-invariant disparity on its own, so every tile is aligned
+(scale and shift, least squares) to one global low-resolution pass of the
+whole frame, then tiles are blended with linear ramps over the overlaps.
+Peak memory depends on the tile size, not on the frame size.
+"""
+
+import torch
+import torch.nn.functional as F
+
+
+def tile_starts(size, tile_size, overlap):
+  """Start offsets of tiles covering [0, size), the last one flush with it."""
+  if size <= tile_size:
+    return [0]
+  stride = tile_size - overlap
+  starts = list(range(0, size - tile_size, stride))
+  return starts + [size - tile_size]
+
+
+def ramp(size, overlap, ramp_start, ramp_end, device):
+  """1D blending weights rising over `overlap` pixels at the tile borders."""
+  weight = torch.ones(size, device=device)
+  if overlap <= 0:
+    return weight
+  ramp_values = (torch.arange(overlap, device=device) + 1.0) / (overlap + 1.0)
+  n = min(overlap, size)
+  if ramp_start:
+    weight[:n] = torch.minimum(weight[:n], ramp_values[:n])
+  if ramp_end:
+    weight[-n:] = torch.minimum(weight[-n:], ramp_values[:n].flip(0))
+  return weight
+
+
+def fit_scale_shift(pred, target):
+  """Least-squares scale and shift with scale * pred + shift ~ target."""
+  pred = pred.flatten(1)
+  target = target.flatten(1)
+  pred_mean = pred.mean(dim=1, keepdim=True)
+  target_mean = target.mean(dim=1, keepdim=True)
+  pred_c = pred - pred_mean
+  scale = (pred_c * (target - target_mean)).sum(dim=1, keepdim=True) / (
+      (pred_c * pred_c).sum(dim=1, keepdim=True) + 1e-8
+  )
+  shift = target_mean - scale * pred_mean
+  return scale[:, :, None], shift[:, :, None]
+
+
+@torch.no_grad()
+def tiled_inference(
+    model, image, global_image, tile_size=518, overlap=126, batch_size=4
+):
+  """Disparity of `image` from overlapping tiles anchored to a global pass.
+
+  Args:
+    model: DPT_DINOv2 model.
+    image: [1, 3, H, W] normalized image at the working resolution.
+    global_image: [1, 3, h, w] normalized low-resolution image of the same
+      frame (h and w multiples of 14), used to anchor scale and shift.
+    tile_size: tile side in pixels, a multiple of 14.
+    overlap: overlap between neighbouring tiles in pixels.
+    batch_size: number of tiles per forward pass.
+
+  Returns:
+    [1, H, W] disparity.
+  """
+  assert tile_size % 14 == 0, 'tile size must be a multiple of 14'
+  assert 0 <= overlap < tile_size, 'overlap must be smaller than the tile'
+  _, _, height, width = image.shape
+  tile_h = min(tile_size, height // 14 * 14)
+  tile_w = min(tile_size, width // 14 * 14)
+
+  anchor = model(global_image)
+  anchor = F.interpolate(
+      anchor[None], (height, width), mode='bilinear', align_corners=False
+  )[0]
+
+  windows = []
+  for y in tile_starts(height, tile_h, overlap):
+    for x in tile_starts(width, tile_w, overlap):
+      windows.append((y, x))
+
+  disparity = torch.zeros_like(anchor)
+  weight_sum = torch.zeros_like(anchor)
+  for i in range(0, len(windows), batch_size):
+    batch = windows[i : i + batch_size]
+    tiles = torch.cat(
+        [image[:, :, y : y + tile_h, x : x + tile_w] for y, x in batch]
+    )
+    pred = model(tiles)
+    target = torch.stack(
+        [anchor[0, y : y + tile_h, x : x + tile_w] for y, x in batch]
+    )
+    scale, shift = fit_scale_shift(pred, target)
+    pred = scale * pred + shift
+
+    for (y, x), tile in zip(batch, pred):
+      weight = ramp(
+          tile_h, overlap, y > 0, y + tile_h < height, image.device
+      )[:, None] * ramp(tile_w, overlap, x > 0, x + tile_w < width, image.device)
+      disparity[0, y : y + tile_h, x : x + tile_w] += weight * tile
+      weight_sum[0, y : y + tile_h, x : x + tile_w] += weight
+
+  return F.relu(disparity / weight_sum)
@@ -0,0 +1,180 @@
+"""Experimental joint mono-depth prior: one DINOv2 ViT-L pass per frame.
+
+Writes the same outputs as `run_videos.py` (Depth-Anything disparity .npy)
+and `UniDepth/scripts/demo_mega-sam.py` (UniDepth depth/fov .npz), but runs
+the ViT only once, inside UniDepthV2, and feeds its tokens to the
+Depth-Anything DPT head through fitted token adapters (see
+depth_anything/shared_backbone.py). Requires UniDepth on PYTHONPATH.
+
+Fit adapters once on a calibration clip (this also loads the original
+Depth-Anything backbone and writes an accuracy report next to the adapters).
+The report is computed on held-out frames: frames of the clip that were not
+fitted on, or frames of a separate clip given with --eval-img-path:
+
+  python Depth-Anything/run_joint_prior.py --img-path <clip> \
+      --load-from depth_anything_vitl14.pth --adapters adapters.pth \
+      --calibrate-frames 32 --eval-frames 8
+
+Then run the joint prior on any clip:
+
+  python Depth-Anything/run_joint_prior.py --img-path <frames> \
+      --load-from depth_anything_vitl14.pth --adapters adapters.pth \
+      --outdir <out>/depth_anything --unidepth-outdir <out>/unidepth
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+
+import cv2
+from depth_anything.dpt import DPT_DINOv2
+from depth_anything.shared_backbone import load_depth_head
+from depth_anything.shared_backbone import make_depth_head
+from depth_anything.shared_backbone import SharedDINOv2Prior
+import numpy as np
+import torch
+import torch.nn.functional as F
+from tqdm import tqdm
+from unidepth.models import UniDepthV2
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Same as UniDepth/scripts/demo_mega-sam.py
+LONG_DIM = 640
+
+
+def load_rgb(filename):
+  """Reads an image and resizes it like demo_mega-sam.py."""
+  raw_image = cv2.imread(filename)[..., :3]
+  rgb = cv2.cvtColor(raw_image, cv2.COLOR_BGR2RGB)
+  h, w = rgb.shape[:2]
+  if w > h:
+    final_w, final_h = LONG_DIM, int(round(LONG_DIM * h / w))
+  else:
+    final_w, final_h = int(round(LONG_DIM * w / h)), LONG_DIM
+  rgb = cv2.resize(rgb, (final_w, final_h), cv2.INTER_AREA)
+  return torch.from_numpy(rgb).permute(2, 0, 1), (h, w)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--img-path', type=str)
+  parser.add_argument('--outdir', type=str, default='./vis_depth')
+  parser.add_argument('--unidepth-outdir', type=str, default='./unidepth')
+  parser.add_argument('--encoder', type=str, default='vitl')
+  parser.add_argument('--load-from', type=str, required=True)
+  parser.add_argument(
+      '--adapters', type=str, required=True, help='token adapter weights'
+  )
+  parser.add_argument(
+      '--calibrate-frames',
+      type=int,
+      default=0,
+      help='fit the adapters on this many frames of --img-path and exit',
+  )
+  parser.add_argument(
+      '--eval-frames',
+      type=int,
+      default=8,
+      help='number of held-out frames the calibration report is computed on',
+  )
+  parser.add_argument(
+      '--eval-img-path',
+      type=str,
+      default=None,
+      help='clip to take the held-out frames from, instead of the frames of'
+      ' --img-path that are not fitted on',
+  )
+  parser.add_argument(
+      '--localhub', dest='localhub', action='store_true', default=False
+  )
+  args = parser.parse_args()
+
+  def list_images(img_path):
+    filenames = sorted(glob.glob(os.path.join(img_path, '*.png')))
+    filenames += sorted(glob.glob(os.path.join(img_path, '*.jpg')))
+    filenames += sorted(glob.glob(os.path.join(img_path, '*.jpeg')))
+    logging.info(f'Found {len(filenames)} images in {img_path}')
+    return filenames
+
+  filenames = list_images(args.img_path)
+
+  device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+  unidepth = UniDepthV2.from_pretrained(
+      'lpiccinelli/unidepth-v2-vitl14',
+      revision='1d0d3c52f60b5164629d279bb9a7546458e6dcc4',
+  ).to(device)
+  unidepth.eval()
+  depth_head = load_depth_head(make_depth_head(args.encoder), args.load_from)
+  prior = SharedDINOv2Prior(unidepth, depth_head.to(device)).to(device)
+  prior.eval()
+
+  if args.calibrate_frames > 0:
+    depth_anything = DPT_DINOv2(
+        encoder=args.encoder, localhub=args.localhub
+    ).to(device)
+    depth_anything.load_state_dict(
+        torch.load(args.load_from, map_location='cpu'), strict=True
+    )
+    depth_anything.eval()
+
+    stride = max(len(filenames) // args.calibrate_frames, 1)
+    calib_files = filenames[::stride][: args.calibrate_frames]
+    if args.eval_img_path is not None:
+      eval_candidates = list_images(args.eval_img_path)
+    else:
+      fitted = set(calib_files)
+      eval_candidates = [f for f in filenames if f not in fitted]
+    if args.eval_frames <= 0 or not eval_candidates:
+      parser.error(
+          'need held-out frames for the calibration report: pass'
+          ' --eval-frames > 0, and --eval-img-path if every frame of'
+          ' --img-path is used for fitting'
+      )
+    eval_stride = max(len(eval_candidates) // args.eval_frames, 1)
+    eval_files = eval_candidates[::eval_stride][: args.eval_frames]
+    report = prior.fit_adapters(
+        depth_anything,
+        (load_rgb(f)[0] for f in tqdm(calib_files)),
+        (load_rgb(f)[0] for f in tqdm(eval_files)),
+    )
+    torch.save(prior.adapters.state_dict(), args.adapters)
+    with open(os.path.splitext(args.adapters)[0] + '_report.json', 'w') as f:
+      json.dump(report, f, indent=2)
+    logging.info(f'Saved adapters to {args.adapters}: {report}')
+    raise SystemExit(0)
+
+  prior.adapters.load_state_dict(torch.load(args.adapters, map_location='cpu'))
+
+  os.makedirs(args.outdir, exist_ok=True)
+  os.makedirs(args.unidepth_outdir, exist_ok=True)
+  for filename in tqdm(filenames):
+    rgb, (h, w) = load_rgb(filename)
+    predictions, disparity = prior(rgb)
+
+    # Depth-Anything output, as in run_videos.py
+    disparity = F.interpolate(
+        disparity[None], (h, w), mode='bilinear', align_corners=False
+    )[0, 0]
+    np.save(
+        os.path.join(args.outdir, filename.split('/')[-1][:-4] + '.npy'),
+        np.float32(disparity.cpu().numpy()),
+    )
+
+    # UniDepth output, as in demo_mega-sam.py
+    fov_ = np.rad2deg(
+        2
+        * np.arctan(
+            predictions['depth'].shape[-1]
+            / (2 * predictions['intrinsics'][0, 0, 0].cpu().numpy())
+        )
+    )
+    np.savez(
+        os.path.join(
+            args.unidepth_outdir, filename.split('/')[-1][:-4] + '.npz'
+        ),
+        depth=np.float32(predictions['depth'][0, 0].cpu().numpy()),
+        fov=fov_,
+    )
@@ -1,10 +1,12 @@
 import argparse
 import glob
 import os
+import sys
 # import matplotlib.pyplot as plt
 from timeit import default_timer as timer
 import cv2
 from depth_anything.dpt import DPT_DINOv2
+from depth_anything.tiling import tiled_inference
 from depth_anything.util.transform import NormalizeImage, PrepareForNet, Resize
 import imageio
 import numpy as np
@@ -14,6 +16,9 @@ from torchvision.transforms import Compose
 from tqdm import tqdm
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from frame_reuse import FrameReuse  # pylint: disable=g-import-not-at-top
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 if __name__ == '__main__':
@@ -22,14 +27,71 @@ if __name__ == '__main__':
   parser.add_argument('--outdir', type=str, default='./vis_depth')
 
   parser.add_argument('--encoder', type=str, default='vitl')
-  parser.add_argument('--load-from', type=str, required=True)
+  parser.add_argument('--load-from', type=str)
+  parser.add_argument(
+      '--registry',
+      type=str,
+      default=None,
+      help='load the model from this offline registry (model_registry.py)',
+  )
   # parser.add_argument('--max_size', type=int, required=True)
 
   parser.add_argument(
       '--localhub', dest='localhub', action='store_true', default=False
   )
+  parser.add_argument(
+      '--quantize',
+      choices=['fp32', 'int8'],
+      default='fp32',
+      help='int8: quantized CPU inference profile (quantize_priors.py)',
+  )
+  parser.add_argument(
+      '--quantize-calib-frames',
+      type=int,
+      default=8,
+      help='frames of the clip used to calibrate the int8 DPT head',
+  )
+  parser.add_argument(
+      '--reuse-threshold',
+      type=float,
+      default=0.0,
+      help=(
+          'skip frames whose thumbnail differs from the last computed frame'
+          ' by less than this many gray levels (mean abs) and blend the'
+          ' neighbouring predictions instead (0: off)'
+      ),
+  )
+  parser.add_argument(
+      '--reuse-max-skip',
+      type=int,
+      default=8,
+      help='maximum number of consecutive skipped frames',
+  )
+  parser.add_argument(
+      '--tile-size',
+      type=int,
+      default=0,
+      help=(
+          'run overlapping tiles of this size (multiple of 14) on the full'
+          ' resolution frame, anchored to the usual 768 pass (0: off)'
+      ),
+  )
+  parser.add_argument(
+      '--tile-overlap', type=int, default=126, help='tile overlap in pixels'
+  )
+  parser.add_argument(
+      '--tile-max-size',
+      type=int,
+      default=0,
+      help='downscale frames to this long side before tiling (0: native)',
+  )
+  parser.add_argument(
+      '--tile-batch-size', type=int, default=4, help='tiles per forward pass'
+  )
 
   args = parser.parse_args()
+  if not args.registry and not args.load_from:
+    parser.error('one of --load-from or --registry is required')
 
   margin_width = 50
   caption_height = 60
@@ -39,34 +101,43 @@ if __name__ == '__main__':
   font_thickness = 2
 
   assert args.encoder in ['vits', 'vitb', 'vitl']
-  if args.encoder == 'vits':
+  # Quantized kernels only run on CPU.
+  device = 'cpu' if args.quantize == 'int8' else 'cuda'
+  if args.registry:
+    from model_registry import get_model  # pylint: disable=g-import-not-at-top
+
+    depth_anything = get_model(
+        f'depth_anything_{args.encoder}', args.registry, device=device
+    )
+  elif args.encoder == 'vits':
     depth_anything = DPT_DINOv2(
         encoder='vits',
         features=64,
         out_channels=[48, 96, 192, 384],
         localhub=args.localhub,
-    ).cuda()
+    ).to(device)
   elif args.encoder == 'vitb':
     depth_anything = DPT_DINOv2(
         encoder='vitb',
         features=128,
         out_channels=[96, 192, 384, 768],
         localhub=args.localhub,
-    ).cuda()
+    ).to(device)
   else:
     depth_anything = DPT_DINOv2(
         encoder='vitl',
         features=256,
         out_channels=[256, 512, 1024, 1024],
         localhub=args.localhub,
-    ).cuda()
+    ).to(device)
 
   total_params = sum(param.numel() for param in depth_anything.parameters())
   logging.info('Total parameters: {:.2f}M'.format(total_params / 1e6))
 
-  depth_anything.load_state_dict(
-      torch.load(args.load_from, map_location='cpu'), strict=True
-  )
+  if not args.registry:
+    depth_anything.load_state_dict(
+        torch.load(args.load_from, map_location='cpu'), strict=True
+    )
 
   depth_anything.eval()
 
@@ -83,6 +154,10 @@ if __name__ == '__main__':
       NormalizeImage(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
       PrepareForNet(),
   ])
+  tile_transform = Compose([
+      NormalizeImage(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+      PrepareForNet(),
+  ])
 
   if os.path.isfile(args.img_path):
     if args.img_path.endswith('txt'):
@@ -97,27 +172,61 @@ if __name__ == '__main__':
 
   logging.info(f'Found {len(filenames)} images in {args.img_path}')
 
-  final_results = []
-  for filename in tqdm(filenames):
-    raw_image = cv2.imread(filename)[..., :3]
-    image = cv2.cvtColor(raw_image, cv2.COLOR_BGR2RGB) / 255.0
+  if args.quantize == 'int8':
+    import quantize_priors  # pylint: disable=g-import-not-at-top
+
+    calib_files = quantize_priors.sample_frames(
+        filenames, args.quantize_calib_frames
+    )
+    depth_anything = quantize_priors.quantize_depth_anything(
+        depth_anything,
+        [quantize_priors.depth_anything_input(f) for f in calib_files],
+    )
+    logging.info(f'Quantized to int8, calibrated on {len(calib_files)} frames')
+
+  def predict(image):
+    """Disparity [h, w] of an RGB image in [0, 1]."""
     h, w = image.shape[:2]
 
-    image = transform({'image': image})['image']
-    image = torch.from_numpy(image).unsqueeze(0).cuda()
+    global_image = transform({'image': image})['image']
+    global_image = torch.from_numpy(global_image).unsqueeze(0).to(device)
 
     # start = timer()
-    with torch.no_grad():
-      depth = depth_anything(image)
+    if args.tile_size > 0:
+      tile_image = image
+      if args.tile_max_size > 0 and max(h, w) > args.tile_max_size:
+        resize_ratio = args.tile_max_size / max(h, w)
+        tile_image = cv2.resize(
+            image,
+            (round(w * resize_ratio), round(h * resize_ratio)),
+            interpolation=cv2.INTER_AREA,
+        )
+      tile_image = tile_transform({'image': tile_image})['image']
+      tile_image = torch.from_numpy(tile_image).unsqueeze(0).to(device)
+      depth = tiled_inference(
+          depth_anything,
+          tile_image,
+          global_image,
+          tile_size=args.tile_size,
+          overlap=args.tile_overlap,
+          batch_size=args.tile_batch_size,
+      )
+    else:
+      with torch.no_grad():
+        depth = depth_anything(global_image)
     # end = timer()
 
     depth = F.interpolate(
         depth[None], (h, w), mode='bilinear', align_corners=False
     )[0, 0]
-    depth_npy = np.float32(depth.cpu().numpy())
-    depth = (depth - depth.min()) / (depth.max() - depth.min()) * 255.0
+    return np.float32(depth.cpu().numpy())
 
-    depth = depth.cpu().numpy().astype(np.uint8)
+  def save(filename, raw_image, depth_npy):
+    depth = (depth_npy - depth_npy.min()) / (
+        depth_npy.max() - depth_npy.min()
+    ) * 255.0
+
+    depth = depth.astype(np.uint8)
     depth_color = cv2.applyColorMap(depth, cv2.COLORMAP_INFERNO)
 
     os.makedirs(os.path.join(args.outdir), exist_ok=True)
@@ -131,5 +240,18 @@ if __name__ == '__main__':
     )
     combined_results = cv2.hconcat([raw_image, split_region, depth_color])
 
+    final_results.append(combined_results[..., ::-1])
 
-    final_results.append(combined_results[..., ::-1])
\ No newline at end of file
+  reuse = FrameReuse(args.reuse_threshold, args.reuse_max_skip)
+  final_results = []
+  for filename in tqdm(filenames):
+    raw_image = cv2.imread(filename)[..., :3]
+    image = cv2.cvtColor(raw_image, cv2.COLOR_BGR2RGB) / 255.0
+    for name, raw, depth_npy in reuse.push(
+        filename, image, lambda: predict(image), payload=raw_image
+    ):
+      save(name, raw, depth_npy)
+  for name, raw, depth_npy in reuse.flush():
+    save(name, raw, depth_npy)
+  if args.reuse_threshold > 0:
+    logging.info(reuse.summary())
\ No newline at end of file
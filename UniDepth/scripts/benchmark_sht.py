@@ -0,0 +1,129 @@
+"""Micro-benchmark of the ray embedding paths in unidepth.utils.sht.
+
+Compares, per frame of a fixed camera:
+  - unrolled `rsh_cart_8` vs table-based `rsh_cart(xyz, 8)` at the three
+    UniDepthV1 decoder scales (plus the max abs difference),
+  - the full UniDepthV1 ray embedding (interpolate + normalize + SH) without
+    and with a warm `RayEmbeddingCache`,
+  - `SphHarm` Legendre recursion vs the Chebyshev table used by `forward`.
+
+Usage: python scripts/benchmark_sht.py [--device cuda] [--iters 50]
+"""
+
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from unidepth.utils.geometric import (RayEmbeddingCache, flat_interpolate,
+                                      generate_rays)
+from unidepth.utils.sht import SphHarm, _chebyshev, rsh_cart, rsh_cart_8
+
+
+def timeit(fn, device, iters):
+    fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / iters * 1000.0
+
+
+def embed(rays, original_shapes, shapes, sh_fn, cache_entry=None):
+    out = []
+    for scale in (1, 2, 4):
+        new = [x * scale for x in shapes]
+        key = ("rsh", tuple(new))
+        if cache_entry is not None and key in cache_entry:
+            out.append(cache_entry[key])
+            continue
+        rays_embedding = F.normalize(
+            flat_interpolate(rays, old=original_shapes, new=new), dim=-1
+        )
+        rays_embedding = sh_fn(rays_embedding)
+        if cache_entry is not None:
+            cache_entry[key] = rays_embedding
+        out.append(rays_embedding)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--height", type=int, default=462)
+    parser.add_argument("--width", type=int, default=616)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    H, W = args.height, args.width
+    shapes = (H // 14, W // 14)
+    intrinsics = torch.tensor(
+        [[[0.8 * W, 0.0, W / 2], [0.0, 0.8 * W, H / 2], [0.0, 0.0, 1.0]]],
+        device=device,
+    )
+    rays = generate_rays(intrinsics, (H, W))[0]
+
+    scales = [(s * shapes[0], s * shapes[1]) for s in (1, 2, 4)]
+    print(f"image {H}x{W}, decoder scales {scales}")
+    for scale in (1, 2, 4):
+        xyz = F.normalize(
+            flat_interpolate(rays, old=(H, W), new=[x * scale for x in shapes]),
+            dim=-1,
+        )
+        t_old = timeit(lambda: rsh_cart_8(xyz), device, args.iters)
+        t_new = timeit(lambda: rsh_cart(xyz, 8), device, args.iters)
+        err = (rsh_cart(xyz, 8) - rsh_cart_8(xyz.double())).abs().max().item()
+        err_old = (rsh_cart_8(xyz) - rsh_cart_8(xyz.double())).abs().max().item()
+        print(
+            f"x{scale} {xyz.shape[1]:7d} rays: rsh_cart_8 {t_old:7.2f} ms,"
+            f" rsh_cart {t_new:7.2f} ms ({t_old / t_new:.1f}x),"
+            f" max err vs float64 {err:.1e} (unrolled {err_old:.1e})"
+        )
+
+    cache = RayEmbeddingCache()
+    _, _, entry = cache.rays(intrinsics, (H, W))
+    embed(rays, (H, W), shapes, lambda x: rsh_cart(x, 8), entry)
+    t_old = timeit(lambda: embed(rays, (H, W), shapes, rsh_cart_8), device, args.iters)
+    t_new = timeit(
+        lambda: embed(rays, (H, W), shapes, lambda x: rsh_cart(x, 8)),
+        device,
+        args.iters,
+    )
+    t_cached = timeit(
+        lambda: embed(
+            cache.rays(intrinsics, (H, W))[0],
+            (H, W),
+            shapes,
+            lambda x: rsh_cart(x, 8),
+            cache.rays(intrinsics, (H, W))[2],
+        ),
+        device,
+        args.iters,
+    )
+    print(
+        f"per-frame ray embedding: unrolled {t_old:.2f} ms, table {t_new:.2f} ms,"
+        f" cached {t_cached:.3f} ms"
+    )
+
+    sph = SphHarm(9, 9).to(device)
+    phi = torch.rand(H * W, device=device) * torch.pi
+    x = torch.cos(phi)
+    t_old = timeit(lambda: sph._gen_associated_legendre(x), device, args.iters)
+    t_new = timeit(
+        lambda: _chebyshev(x, int(sph.l_max)) @ sph.legendre_table,
+        device,
+        args.iters,
+    )
+    print(
+        f"SphHarm Legendre ({H * W} points, l_max {int(sph.l_max)}):"
+        f" recursion {t_old:.2f} ms, table {t_new:.2f} ms ({t_old / t_new:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
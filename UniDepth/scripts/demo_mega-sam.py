@@ -1,6 +1,8 @@
 import argparse
 import glob
+import json
 import os
+import sys
 
 import cv2
 import imageio
@@ -11,8 +13,58 @@ import tqdm
 from unidepth.models import UniDepthV2
 from unidepth.utils import colorize, image_grid
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from frame_reuse import FrameReuse
+
 LONG_DIM = 640
 
+def load_rgb(img_path):
+  rgb = np.array(Image.open(img_path))[..., :3]
+  if rgb.shape[1] > rgb.shape[0]:
+    final_w, final_h = LONG_DIM, int(
+        round(LONG_DIM * rgb.shape[0] / rgb.shape[1])
+    )
+  else:
+    final_w, final_h = (
+        int(round(LONG_DIM * rgb.shape[1] / rgb.shape[0])),
+        LONG_DIM,
+    )
+  rgb = cv2.resize(
+      rgb, (final_w, final_h), cv2.INTER_AREA
+  )  # .transpose(2, 0, 1)
+  return torch.from_numpy(rgb).permute(2, 0, 1)
+
+
+def clip_intrinsics(model, img_path_list, args):
+  """Camera head on a few evenly spaced frames, fixed for the whole clip."""
+  sample_idx = np.linspace(0, len(img_path_list) - 1, args.clip_intrinsics)
+  sample_idx = sorted(set(np.round(sample_idx).astype(int).tolist()))
+  rgbs = [load_rgb(img_path_list[i]) for i in sample_idx]
+  if any(rgb.shape != rgbs[0].shape for rgb in rgbs):
+    raise ValueError("clip-level intrinsics need frames of a single size")
+  intrinsics = model.infer_clip_intrinsics(
+      rgbs, cache_rays=not args.no_ray_cache
+  )
+  width = rgbs[0].shape[-1]
+  fov = np.rad2deg(2 * np.arctan(width / (2 * intrinsics[0, 0].item())))
+  with open(os.path.join(args.outdir, "clip_intrinsics.json"), "w") as f:
+    json.dump(
+        {
+            "K": intrinsics.cpu().tolist(),
+            "fov": float(fov),
+            "height": rgbs[0].shape[-2],
+            "width": width,
+            "sampled_frames": [
+                os.path.basename(img_path_list[i]) for i in sample_idx
+            ],
+        },
+        f,
+        indent=2,
+    )
+  print(f"Clip intrinsics from {len(sample_idx)} frames: fov {fov:.2f}")
+  return intrinsics
+
+
 def demo(model, args):
   outdir = args.outdir  # "./outputs"
   # os.makedirs(outdir, exist_ok=True)
@@ -26,26 +78,25 @@ def demo(model, args):
   img_path_list += sorted(glob.glob(os.path.join(args.img_path, "*.png")))
   img_path_list += sorted(glob.glob(os.path.join(args.img_path, "*.jpeg")))
 
-  fovs = []
-  for img_path in tqdm.tqdm(img_path_list):
-    rgb = np.array(Image.open(img_path))[..., :3]
-    if rgb.shape[1] > rgb.shape[0]:
-      final_w, final_h = LONG_DIM, int(
-          round(LONG_DIM * rgb.shape[0] / rgb.shape[1])
-      )
-    else:
-      final_w, final_h = (
-          int(round(LONG_DIM * rgb.shape[1] / rgb.shape[0])),
-          LONG_DIM,
-      )
-    rgb = cv2.resize(
-        rgb, (final_w, final_h), cv2.INTER_AREA
-    )  # .transpose(2, 0, 1)
-
-    rgb_torch = torch.from_numpy(rgb).permute(2, 0, 1)
+  intrinsics = None
+  if args.clip_intrinsics > 0:
+    intrinsics = clip_intrinsics(model, img_path_list, args)
+  else:
+    # camera tracking prefers clip_intrinsics.json over the per-frame fovs, so
+    # drop one left over from an earlier run
+    stale_path = os.path.join(outdir_scene, "clip_intrinsics.json")
+    if os.path.exists(stale_path):
+      os.remove(stale_path)
+
+  def predict(rgb_torch):
     # intrinsics_torch = torch.from_numpy(np.load("assets/demo/intrinsics.npy"))
     # predict
-    predictions = model.infer(rgb_torch)
+    predictions = model.infer(
+        rgb_torch,
+        intrinsics,
+        cache_rays=not args.no_ray_cache,
+        skip_camera=intrinsics is not None,
+    )
     fov_ = np.rad2deg(
         2
         * np.arctan(
@@ -54,27 +105,106 @@ def demo(model, args):
         )
     )
     depth = predictions["depth"][0, 0].cpu().numpy()
-    fovs.append(fov_)
+    return {"depth": np.float32(depth), "fov": fov_}
+
+  def save(img_path, prediction):
+    fovs.append(prediction["fov"])
     # breakpoint()
     np.savez(
         os.path.join(outdir_scene, img_path.split("/")[-1][:-4] + ".npz"),
-        depth=np.float32(depth),
-        fov=fov_,
+        depth=prediction["depth"],
+        fov=prediction["fov"],
     )
 
+  reuse = FrameReuse(args.reuse_threshold, args.reuse_max_skip)
+  fovs = []
+  for img_path in tqdm.tqdm(img_path_list):
+    rgb_torch = load_rgb(img_path)
+    for name, _, prediction in reuse.push(
+        img_path, rgb_torch.permute(1, 2, 0).numpy(), lambda: predict(rgb_torch)
+    ):
+      save(name, prediction)
+  for name, _, prediction in reuse.flush():
+    save(name, prediction)
+  if args.reuse_threshold > 0:
+    print(reuse.summary())
+
 
 if __name__ == "__main__":
   parser = argparse.ArgumentParser()
   parser.add_argument("--img-path", type=str)
   parser.add_argument("--outdir", type=str, default="./vis_depth")
   parser.add_argument("--scene-name", type=str)
+  parser.add_argument(
+      "--clip-intrinsics",
+      type=int,
+      default=0,
+      help=(
+          "estimate intrinsics once from this many sampled frames and fix"
+          " them for the clip (0: per-frame intrinsics)"
+      ),
+  )
+  parser.add_argument(
+      "--no-ray-cache",
+      action="store_true",
+      help=(
+          "recompute camera rays and ray embeddings for every frame instead"
+          " of reusing them across frames with equal intrinsics"
+      ),
+  )
+  parser.add_argument(
+      "--registry",
+      type=str,
+      default=None,
+      help="load the model from this offline registry (model_registry.py)",
+  )
+
+  parser.add_argument(
+      "--reuse-threshold",
+      type=float,
+      default=0.0,
+      help=(
+          "skip frames whose thumbnail differs from the last computed frame"
+          " by less than this many gray levels (mean abs) and blend the"
+          " neighbouring predictions instead (0: off)"
+      ),
+  )
+  parser.add_argument(
+      "--reuse-max-skip",
+      type=int,
+      default=8,
+      help="maximum number of consecutive skipped frames",
+  )
+  parser.add_argument(
+      "--quantize",
+      choices=["fp32", "int8"],
+      default="fp32",
+      help="int8: quantized CPU inference profile (quantize_priors.py)",
+  )
 
   args = parser.parse_args()
 
   print("Torch version:", torch.__version__)
   # model = UniDepthV1.from_pretrained("lpiccinelli/unidepth-v1-vitl14")
   # model = UniDepthV2.from_pretrained("lpiccinelli/unidepth-v2-vitl14")
-  model = UniDepthV2.from_pretrained("lpiccinelli/unidepth-v2-vitl14", revision="1d0d3c52f60b5164629d279bb9a7546458e6dcc4")
   device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-  model = model.to(device)
+  if args.quantize == "int8":
+    # Quantized kernels only run on CPU.
+    device = torch.device("cpu")
+  if args.registry:
+    from model_registry import get_model
+
+    model = get_model("unidepth_v2_vitl14", args.registry, device=device)
+  else:
+    model = UniDepthV2.from_pretrained("lpiccinelli/unidepth-v2-vitl14", revision="1d0d3c52f60b5164629d279bb9a7546458e6dcc4")
+    model = model.to(device)
+  if args.quantize == "int8":
+    from quantize_priors import quantize_unidepth
+
+    model = quantize_unidepth(model)
   demo(model, args)
+  if not args.no_ray_cache:
+    print(
+        f"Ray cache: {model.ray_cache.hits} hits,"
+        f" {model.ray_cache.misses} misses"
+    )
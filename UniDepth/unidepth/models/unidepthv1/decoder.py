@@ -15,7 +15,7 @@ from unidepth.layers import (MLP, AttentionBlock, ConvUpsample, NystromBlock,
                              PositionEmbeddingSine)
 from unidepth.utils.geometric import flat_interpolate, generate_rays
 from unidepth.utils.misc import max_stack
-from unidepth.utils.sht import rsh_cart_8
+from unidepth.utils.sht import rsh_cart
 
 
 class ListAdapter(nn.Module):
@@ -192,6 +192,22 @@ class DepthHead(nn.Module):
     def set_shapes(self, shapes: Tuple[int, int]):
         self.shapes = shapes
 
+    def set_ray_cache_entry(self, entry):
+        self.ray_cache_entry = entry
+
+    def embed_rays(self, rays, shapes):
+        cache_entry = getattr(self, "ray_cache_entry", None)
+        key = ("rsh", tuple(shapes))
+        if cache_entry is not None and key in cache_entry:
+            return cache_entry[key]
+        rays_embedding = F.normalize(
+            flat_interpolate(rays, old=self.original_shapes, new=shapes), dim=-1
+        )
+        rays_embedding = rsh_cart(rays_embedding, 8)
+        if cache_entry is not None:
+            cache_entry[key] = rays_embedding
+        return rays_embedding
+
     def forward(
         self, features: torch.Tensor, rays_hr: torch.Tensor, pos_embed, level_embed
     ) -> torch.Tensor:
@@ -201,24 +217,13 @@ class DepthHead(nn.Module):
         # camera_embedding
         # torch.cuda.synchronize()
         # start = time()
-        rays_embedding_16 = F.normalize(
-            flat_interpolate(rays_hr, old=self.original_shapes, new=shapes), dim=-1
+        rays_embedding_16 = self.project_rays16(self.embed_rays(rays_hr, shapes))
+        rays_embedding_8 = self.project_rays8(
+            self.embed_rays(rays_hr, [x * 2 for x in shapes])
         )
-        rays_embedding_8 = F.normalize(
-            flat_interpolate(
-                rays_hr, old=self.original_shapes, new=[x * 2 for x in shapes]
-            ),
-            dim=-1,
+        rays_embedding_4 = self.project_rays4(
+            self.embed_rays(rays_hr, [x * 4 for x in shapes])
         )
-        rays_embedding_4 = F.normalize(
-            flat_interpolate(
-                rays_hr, old=self.original_shapes, new=[x * 4 for x in shapes]
-            ),
-            dim=-1,
-        )
-        rays_embedding_16 = self.project_rays16(rsh_cart_8(rays_embedding_16))
-        rays_embedding_8 = self.project_rays8(rsh_cart_8(rays_embedding_8))
-        rays_embedding_4 = self.project_rays4(rsh_cart_8(rays_embedding_4))
         # torch.cuda.synchronize()
         # print(f"camera_embedding took {time() - start} seconds")
         features_tokens = torch.cat(features, dim=1)
@@ -315,6 +320,11 @@ class Decoder(nn.Module):
         self.apply(self._init_weights)
         self.test_fixed_camera = False
         self.skip_camera = False
+        self.ray_cache = None
+        self.ray_cache_entry = None
+
+    def set_ray_cache(self, ray_cache):
+        self.ray_cache = ray_cache
 
     def _init_weights(self, m):
         if isinstance(m, nn.Linear):
@@ -360,7 +370,12 @@ class Decoder(nn.Module):
         intrinsics[:, 0, 2] = intrinsics[:, 0, 2] * original_shapes[1]
         intrinsics[:, 1, 2] = intrinsics[:, 1, 2] * original_shapes[0]
         if not self.test_fixed_camera:
-            rays, _ = generate_rays(intrinsics, original_shapes, noisy=False)
+            if self.ray_cache is not None:
+                rays, _, self.ray_cache_entry = self.ray_cache.rays(
+                    intrinsics, original_shapes
+                )
+            else:
+                rays, _ = generate_rays(intrinsics, original_shapes, noisy=False)
 
         return intrinsics, rays
 
@@ -438,6 +453,7 @@ class Decoder(nn.Module):
         )
 
         self.camera_layer.set_shapes(common_shape)
+        self.ray_cache_entry = None
         intrinsics, rays = (
             self.run_camera(
                 cls_tokens,
@@ -451,6 +467,9 @@ class Decoder(nn.Module):
         )
 
         # run bulk of the model
+        self.depth_layer.set_ray_cache_entry(
+            inputs.get("ray_cache_entry", self.ray_cache_entry)
+        )
         self.depth_layer.set_shapes(common_shape)
         self.depth_layer.set_original_shapes((H, W))
         out8, out4, out2, depth_features = self.depth_layer(
@@ -18,7 +18,7 @@ from unidepth.models.unidepthv1.decoder import Decoder
 from unidepth.utils.constants import (IMAGENET_DATASET_MEAN,
                                       IMAGENET_DATASET_STD)
 from unidepth.utils.distributed import is_main_process
-from unidepth.utils.geometric import (generate_rays,
+from unidepth.utils.geometric import (RayEmbeddingCache, generate_rays,
                                       spherical_zbuffer_to_euclidean)
 from unidepth.utils.misc import get_params
 
@@ -109,6 +109,7 @@ class UniDepthV1(
         super().__init__()
         self.build(config)
         self.eps = eps
+        self.ray_cache = RayEmbeddingCache()
 
     def forward(self, inputs, image_metas):
         rgbs = inputs["image"]
@@ -170,7 +171,17 @@ class UniDepthV1(
         return outputs
 
     @torch.no_grad()
-    def infer(self, rgbs: torch.Tensor, intrinsics=None, skip_camera=False):
+    def infer(
+        self,
+        rgbs: torch.Tensor,
+        intrinsics=None,
+        skip_camera=False,
+        cache_rays: bool = False,
+    ):
+        # reuse rays and spherical harmonics ray embeddings across frames of
+        # a video, keyed on image shape and intrinsics
+        ray_cache = self.ray_cache if cache_rays and not self.training else None
+        self.pixel_decoder.set_ray_cache(ray_cache)
         if rgbs.ndim == 3:
             rgbs = rgbs.unsqueeze(0)
         if intrinsics is not None and intrinsics.ndim == 2:
@@ -216,9 +227,14 @@ class UniDepthV1(
         inputs["cls_tokens"] = cls_tokens
         inputs["image"] = rgbs
         if gt_intrinsics is not None:
-            rays, angles = generate_rays(
-                gt_intrinsics, self.image_shape, noisy=self.training
-            )
+            if ray_cache is not None:
+                rays, angles, inputs["ray_cache_entry"] = ray_cache.rays(
+                    gt_intrinsics, self.image_shape
+                )
+            else:
+                rays, angles = generate_rays(
+                    gt_intrinsics, self.image_shape, noisy=self.training
+                )
             inputs["rays"] = rays
             inputs["angles"] = angles
             inputs["K"] = gt_intrinsics
@@ -240,7 +256,10 @@ class UniDepthV1(
 
         # final 3D points backprojection
         intrinsics = gt_intrinsics if gt_intrinsics is not None else pred_intrinsics
-        angles = generate_rays(intrinsics, (H, W), noisy=False)[-1]
+        if ray_cache is not None:
+            angles = ray_cache.rays(intrinsics, (H, W))[1]
+        else:
+            angles = generate_rays(intrinsics, (H, W), noisy=False)[-1]
         angles = rearrange(angles, "b (h w) c -> b c h w", h=H, w=W)
         points_3d = torch.cat((angles, predictions), dim=1)
         points_3d = spherical_zbuffer_to_euclidean(
@@ -255,6 +274,7 @@ class UniDepthV1(
         }
         self.pixel_decoder.test_fixed_camera = False
         self.pixel_decoder.skip_camera = False
+        self.pixel_decoder.set_ray_cache(None)
         return outputs
 
     def load_pretrained(self, model_file):
@@ -10,6 +10,24 @@ from unidepth.utils.geometric import flat_interpolate, generate_rays
 from unidepth.utils.positional_embedding import generate_fourier_features
 
 
+def embed_rays_cached(rays, original_shapes, shapes, camera_dim, cache_entry):
+    key = ("embedding", tuple(shapes), camera_dim)
+    if cache_entry is not None and key in cache_entry:
+        return cache_entry[key]
+    rays_embedding = flat_interpolate(rays, old=original_shapes, new=shapes)
+    rays_embedding = F.normalize(rays_embedding, dim=-1)
+    rays_embedding = generate_fourier_features(
+        rays_embedding,
+        dim=camera_dim,
+        max_freq=max(shapes) // 2,
+        use_log=True,
+        cat_orig=True,
+    )
+    if cache_entry is not None:
+        cache_entry[key] = rays_embedding
+    return rays_embedding
+
+
 class ListAdapter(nn.Module):
     def __init__(self, input_dims: list[int], hidden_dim: int):
         super().__init__()
@@ -109,16 +127,16 @@ class GlobalHead(nn.Module):
         self.out = MLP(hidden_dim, expansion=2, dropout=0.0, output_dim=1)
 
     def embed_rays(self, rays, shapes):
-        rays_embedding = flat_interpolate(rays, old=self.original_shapes, new=shapes)
-        rays_embedding = F.normalize(rays_embedding, dim=-1)
-        rays_embedding = generate_fourier_features(
-            rays_embedding,
-            dim=self.camera_dim,
-            max_freq=max(shapes) // 2,
-            use_log=True,
-            cat_orig=True,
+        return embed_rays_cached(
+            rays,
+            self.original_shapes,
+            shapes,
+            self.camera_dim,
+            getattr(self, "ray_cache_entry", None),
         )
-        return rays_embedding
+
+    def set_ray_cache_entry(self, entry):
+        self.ray_cache_entry = entry
 
     def set_original_shapes(self, shapes: tuple[int, int]):
         self.original_shapes = shapes
@@ -235,16 +253,16 @@ class DepthHead(nn.Module):
         self.shapes = shapes
 
     def embed_rays(self, rays, shapes):
-        rays_embedding = flat_interpolate(rays, old=self.original_shapes, new=shapes)
-        rays_embedding = F.normalize(rays_embedding, dim=-1)
-        rays_embedding = generate_fourier_features(
-            rays_embedding,
-            dim=self.camera_dim,
-            max_freq=max(shapes) // 2,
-            use_log=True,
-            cat_orig=True,
+        return embed_rays_cached(
+            rays,
+            self.original_shapes,
+            shapes,
+            self.camera_dim,
+            getattr(self, "ray_cache_entry", None),
         )
-        return rays_embedding
+
+    def set_ray_cache_entry(self, entry):
+        self.ray_cache_entry = entry
 
     def project_rays(self, rays, shapes):
         embedded_rays = []
@@ -351,6 +369,11 @@ class Decoder(nn.Module):
         super().__init__()
         self.build(config)
         self.apply(self._init_weights)
+        self.ray_cache = None
+        self.ray_cache_entry = None
+
+    def set_ray_cache(self, ray_cache):
+        self.ray_cache = ray_cache
 
     def _init_weights(self, m):
         if isinstance(m, nn.Linear):
@@ -398,11 +421,15 @@ class Decoder(nn.Module):
         intrinsics[:, 0, 2] = intrinsics[:, 0, 2] * original_shapes[1]
         intrinsics[:, 1, 2] = intrinsics[:, 1, 2] * original_shapes[0]
 
-        rays = (
-            rays_gt
-            if rays_gt is not None
-            else generate_rays(intrinsics, original_shapes)[0]
-        )
+        self.ray_cache_entry = None
+        if rays_gt is not None:
+            rays = rays_gt
+        elif self.ray_cache is not None:
+            rays, _, self.ray_cache_entry = self.ray_cache.rays(
+                intrinsics, original_shapes
+            )
+        else:
+            rays = generate_rays(intrinsics, original_shapes)[0]
         return intrinsics, rays
 
     def run_global(self, cls_tokens, features, rays):
@@ -479,13 +506,23 @@ class Decoder(nn.Module):
         )
 
         self.camera_layer.set_shapes(common_shape)
-        intrinsics, rays = self.run_camera(
-            inputs["camera_tokens"],
-            features=features,
-            pos_embed=pos_embed + level_embed,
-            original_shapes=(H, W),
-            rays_gt=inputs.get("rays"),
-        )
+        if inputs.get("skip_camera", False):
+            # intrinsics fixed for the whole clip: skip the camera head
+            intrinsics, rays = inputs["K"].clone(), inputs["rays"]
+            self.ray_cache_entry = None
+        else:
+            intrinsics, rays = self.run_camera(
+                inputs["camera_tokens"],
+                features=features,
+                pos_embed=pos_embed + level_embed,
+                original_shapes=(H, W),
+                rays_gt=inputs.get("rays"),
+            )
+
+        if inputs.get("ray_cache_entry") is not None:
+            self.ray_cache_entry = inputs["ray_cache_entry"]
+        self.global_layer.set_ray_cache_entry(self.ray_cache_entry)
+        self.depth_layer.set_ray_cache_entry(self.ray_cache_entry)
 
         self.global_layer.set_shapes(common_shape)
         self.global_layer.set_original_shapes((H, W))
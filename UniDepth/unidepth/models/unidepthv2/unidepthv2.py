@@ -14,7 +14,7 @@ from unidepth.models.unidepthv2.decoder import Decoder
 from unidepth.utils.constants import (IMAGENET_DATASET_MEAN,
                                       IMAGENET_DATASET_STD)
 from unidepth.utils.distributed import is_main_process
-from unidepth.utils.geometric import (generate_rays,
+from unidepth.utils.geometric import (RayEmbeddingCache, generate_rays,
                                       spherical_zbuffer_to_euclidean)
 from unidepth.utils.misc import (first_stack, last_stack, max_stack,
                                  mean_stack, softmax_stack)
@@ -134,6 +134,7 @@ class UniDepthV2(
         self.interpolation_mode = "bilinear"
         self.eps = eps
         self.resolution_level = None
+        self.ray_cache = RayEmbeddingCache()
 
     def forward(self, inputs, image_metas):
         H, W = inputs["depth"].shape[-2:]
@@ -199,8 +200,20 @@ class UniDepthV2(
         return outputs
 
     @torch.no_grad()
-    def infer(self, rgbs: torch.Tensor, intrinsics=None):
+    def infer(
+        self,
+        rgbs: torch.Tensor,
+        intrinsics=None,
+        cache_rays: bool = False,
+        skip_camera: bool = False,
+    ):
+        if skip_camera and intrinsics is None:
+            raise ValueError("skip_camera requires intrinsics")
         shape_constraints = self.shape_constraints
+        # reuse rays and ray embeddings across frames of a video, keyed on
+        # image shape and intrinsics
+        ray_cache = self.ray_cache if cache_rays else None
+        self.pixel_decoder.set_ray_cache(ray_cache)
         if rgbs.ndim == 3:
             rgbs = rgbs.unsqueeze(0)
         if intrinsics is not None and intrinsics.ndim == 2:
@@ -256,10 +269,16 @@ class UniDepthV2(
         inputs["camera_tokens"] = camera_tokens
         inputs["image"] = rgbs
         if gt_intrinsics is not None:
-            rays, angles = generate_rays(gt_intrinsics, (h, w))
+            if ray_cache is not None:
+                rays, angles, inputs["ray_cache_entry"] = ray_cache.rays(
+                    gt_intrinsics, (h, w)
+                )
+            else:
+                rays, angles = generate_rays(gt_intrinsics, (h, w))
             inputs["rays"] = rays
             inputs["angles"] = angles
             inputs["K"] = gt_intrinsics
+            inputs["skip_camera"] = skip_camera
 
         outs = self.pixel_decoder(inputs, {})
         # undo the reshaping and get original image size (slow)
@@ -269,8 +288,13 @@ class UniDepthV2(
         confidence = outs["confidence"]
 
         # final 3D points backprojection
-        intrinsics = intrinsics if intrinsics is not None else pred_intrinsics
-        angles = generate_rays(intrinsics, (H, W))[-1]
+        if ray_cache is not None:
+            angles = ray_cache.rays(
+                intrinsics if intrinsics is not None else pred_intrinsics, (H, W)
+            )[1]
+        else:
+            intrinsics = intrinsics if intrinsics is not None else pred_intrinsics
+            angles = generate_rays(intrinsics, (H, W))[-1]
         angles = rearrange(angles, "b (h w) c -> b c h w", h=H, w=W)
         points_3d = torch.cat((angles, depth), dim=1)
         points_3d = spherical_zbuffer_to_euclidean(
@@ -283,8 +307,17 @@ class UniDepthV2(
             "depth": depth,
             "confidence": confidence,
         }
+        self.pixel_decoder.set_ray_cache(None)
         return outputs
 
+    @torch.no_grad()
+    def infer_clip_intrinsics(self, rgbs, cache_rays: bool = False):
+        # camera head on a few frames of a clip, median per parameter
+        intrinsics = torch.cat(
+            [self.infer(rgb, cache_rays=cache_rays)["intrinsics"] for rgb in rgbs]
+        )
+        return intrinsics.median(dim=0).values
+
     def load_pretrained(self, model_file):
         device = (
             torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
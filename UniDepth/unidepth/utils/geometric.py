@@ -3,6 +3,7 @@ Author: Luigi Piccinelli
 Licensed under the CC-BY NC 4.0 license (http://creativecommons.org/licenses/by-nc/4.0/)
 """
 
+from collections import OrderedDict
 from typing import Tuple
 
 import torch
@@ -250,3 +251,49 @@ def flat_interpolate(
         0, 2, 1
     )  # b (h w) c
     return flat_tensor_interp.contiguous()
+
+
+class RayEmbeddingCache:
+    """LRU cache of camera rays and ray embeddings.
+
+    In a video the image shape is fixed and, with given or clip-level
+    intrinsics, so is the camera, so rays and anything derived from them
+    (Fourier or spherical harmonics embeddings) are cached per (shape,
+    intrinsics) entry. Entries only match exactly equal intrinsics, so cached
+    rays are always those of the intrinsics that are returned.
+    """
+
+    def __init__(self, max_size: int = 8):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, intrinsics, shapes):
+        key = (
+            tuple(shapes),
+            tuple(intrinsics[:, :2].flatten().tolist()),
+            intrinsics.dtype,
+            str(intrinsics.device),
+        )
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.entries[key] = {}
+            self.misses += 1
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return self.entries[key]
+
+    def rays(self, intrinsics, shapes):
+        """Cached `generate_rays`, returns (rays, angles, cache entry)."""
+        entry = self.lookup(intrinsics, shapes)
+        if "rays" not in entry:
+            entry["rays"], entry["angles"] = generate_rays(intrinsics, shapes)
+        return entry["rays"], entry["angles"], entry
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
@@ -5,6 +5,9 @@ https://github.com/cheind/torch-spherical-harmonics
 for more information.
 """
 
+from functools import lru_cache
+
+import numpy as np
 import torch
 
 
@@ -1393,6 +1396,98 @@ def rsh_cart_8(xyz: torch.Tensor):
     )
 
 
+RSH_CART_FNS = [
+    rsh_cart_0,
+    rsh_cart_1,
+    rsh_cart_2,
+    rsh_cart_3,
+    rsh_cart_4,
+    rsh_cart_5,
+    rsh_cart_6,
+    rsh_cart_7,
+    rsh_cart_8,
+]
+
+
+def _chebyshev(x: torch.Tensor, degree: int):
+    """Chebyshev polynomials T_0..T_degree of `x`, stacked on the last dim."""
+    cheb = [torch.ones_like(x), x]
+    for _ in range(degree - 1):
+        cheb.append(2.0 * x * cheb[-1] - cheb[-2])
+    return torch.stack(cheb[: degree + 1], -1)
+
+
+def _azimuthal(xyz: torch.Tensor, degree: int):
+    """Re and Im of (x + iy)^m for m = 0..degree, as [..., 2 * (degree + 1)]."""
+    x = xyz[..., 0]
+    y = xyz[..., 1]
+    cos, sin = [torch.ones_like(x)], [torch.zeros_like(x)]
+    for _ in range(degree):
+        c, s = cos[-1], sin[-1]
+        cos.append(c * x - s * y)
+        sin.append(s * x + c * y)
+    return torch.stack(cos + sin, -1)
+
+
+@lru_cache(maxsize=None)
+def _rsh_cart_table(degree: int):
+    """Coefficient table for `rsh_cart`.
+
+    On the unit sphere Y_n^m(x, y, z) = Q_n^m(z) * Re/Im((x + iy)^|m|), with
+    Q_n^m a polynomial of degree n - |m|. The Chebyshev coefficients of each
+    Q_n^m are fitted to `rsh_cart_<degree>` in float64 (the fit is exact up to
+    rounding); the Chebyshev basis keeps the float32 evaluation accurate.
+    """
+    generator = torch.Generator().manual_seed(0)
+    xyz = torch.nn.functional.normalize(
+        torch.randn(4096, 3, generator=generator, dtype=torch.float64), dim=-1
+    )
+    target = RSH_CART_FNS[degree](xyz)
+    cheb = _chebyshev(xyz[..., 2], degree)
+    azimuthal = _azimuthal(xyz, degree)
+
+    coeffs = torch.zeros(degree + 1, (degree + 1) ** 2, dtype=torch.float64)
+    select = torch.zeros((degree + 1) ** 2, dtype=torch.long)
+    for n in range(degree + 1):
+        for m in range(-n, n + 1):
+            idx = n * (n + 1) + m
+            select[idx] = m if m >= 0 else degree + 1 - m
+            basis = cheb[:, : n - abs(m) + 1] * azimuthal[:, select[idx], None]
+            coeffs[: n - abs(m) + 1, idx] = torch.linalg.lstsq(
+                basis, target[:, idx : idx + 1]
+            ).solution[:, 0]
+    return coeffs, select
+
+
+@lru_cache(maxsize=None)
+def _rsh_cart_table_on(degree: int, device: torch.device, dtype: torch.dtype):
+    coeffs, select = _rsh_cart_table(degree)
+    return coeffs.to(device=device, dtype=dtype), select.to(device)
+
+
+def rsh_cart(xyz: torch.Tensor, degree: int = 8):
+    """Computes all real spherical harmonics up to `degree` (at most 8).
+
+    Same output as `rsh_cart_<degree>` (same ordering and normalization), but
+    evaluated as one matmul of a Chebyshev basis in z with a precomputed
+    coefficient table, times the azimuthal factors (x + iy)^|m|, instead of
+    hundreds of unrolled elementwise expressions.
+
+    Params:
+        xyz: (N,...,3) tensor of points on the unit sphere
+
+    Returns:
+        rsh: (N,...,(degree+1)**2) real spherical harmonics
+            projections of input. Ynm is found at index
+            `n*(n+1) + m`, with `0 <= n <= degree` and
+            `-n <= m <= n`.
+    """
+    coeffs, select = _rsh_cart_table_on(degree, xyz.device, xyz.dtype)
+    return (_chebyshev(xyz[..., 2], degree) @ coeffs) * _azimuthal(xyz, degree)[
+        ..., select
+    ]
+
+
 __all__ = [
     "rsh_cart_0",
     "rsh_cart_1",
@@ -1403,6 +1498,7 @@ __all__ = [
     "rsh_cart_6",
     "rsh_cart_7",
     "rsh_cart_8",
+    "rsh_cart",
 ]
 
 
@@ -1432,6 +1528,9 @@ class SphHarm(torch.nn.Module):
         self.register_buffer("d0_mask_3d", tensor=d0_mask_3d)
         self.register_buffer("d1_mask_3d", tensor=d1_mask_3d)
         self.register_buffer("initial_value", tensor=initial_value)
+        self.register_buffer(
+            "legendre_table", tensor=self._init_legendre_table(), persistent=False
+        )
 
     @property
     def device(self):
@@ -1439,39 +1538,40 @@ class SphHarm(torch.nn.Module):
 
     def forward(self, points: torch.Tensor) -> torch.Tensor:
         """Computes the spherical harmonics."""
-        # Y_l^m = (-1) ^ m c_l^m P_l^m(cos(theta)) exp(i m phi)
+        # Y_l^m = (-1) ^ m c_l^m P_l^m(cos(theta)) exp(i m phi), real part
         B, N, D = points.shape
         dtype = points.dtype
         theta, phi = points.view(-1, D).to(self.dtype).unbind(-1)
         cos_colatitude = torch.cos(phi)
-        legendre = self._gen_associated_legendre(cos_colatitude)
-        vals = torch.stack([self.m.abs(), self.n], dim=0)
-        vals = torch.cat(
-            [
-                vals.repeat(1, theta.shape[0]),
-                torch.arange(theta.shape[0], device=theta.device)
-                .unsqueeze(0)
-                .repeat_interleave(vals.shape[1], dim=1),
-            ],
-            dim=0,
-        )
-        legendre_vals = legendre[vals[0], vals[1], vals[2]]
-        legendre_vals = legendre_vals.reshape(-1, theta.shape[0])
-        angle = torch.outer(self.m.abs(), theta)
-        vandermonde = torch.complex(torch.cos(angle), torch.sin(angle))
-        harmonics = torch.complex(
-            legendre_vals * torch.real(vandermonde),
-            legendre_vals * torch.imag(vandermonde),
-        )
+        m = self.m.abs()
 
-        # Negative order.
-        m = self.m.unsqueeze(-1)
-        harmonics = torch.where(
-            m < 0, (-1.0) ** m.abs() * torch.conj(harmonics), harmonics
-        )
-        harmonics = harmonics.permute(1, 0).reshape(B, N, -1).to(dtype)
+        # P_l^m(x) = (1 - x^2)^(m/2) Q_l^m(x), Q_l^m from the Chebyshev table
+        sin_colatitude = torch.sqrt(1.0 - cos_colatitude * cos_colatitude)
+        legendre_vals = _chebyshev(cos_colatitude, int(self.l_max)) @ self.legendre_table
+        legendre_vals = legendre_vals * sin_colatitude.unsqueeze(-1) ** m
+
+        # Negative order: (-1)^m conj(Y_l^|m|), same real part up to the sign.
+        sign = torch.where(self.m < 0, (-1.0) ** m, 1.0).to(self.dtype)
+        harmonics = sign * legendre_vals * torch.cos(theta.unsqueeze(-1) * m)
+        harmonics = harmonics.reshape(B, N, -1).to(dtype)
         return harmonics
 
+    def _init_legendre_table(self) -> torch.Tensor:
+        """Chebyshev coefficients of Q_l^m = P_l^m / (1 - x^2)^(m/2) per (m, l).
+
+        Q_l^m = (-1)^m d^m/dx^m P_l (Condon-Shortley phase, unnormalized, as in
+        `_gen_associated_legendre`), computed exactly in float64.
+        """
+        l_max = int(self.l_max)
+        table = torch.zeros(l_max + 1, self.m.shape[0], dtype=torch.float64)
+        for idx, (m, n) in enumerate(zip(self.m.abs().tolist(), self.n.tolist())):
+            coeffs = np.polynomial.legendre.legder(np.eye(n + 1)[n], m) * (-1.0) ** m
+            coeffs = np.polynomial.chebyshev.poly2cheb(
+                np.polynomial.legendre.leg2poly(coeffs)
+            )
+            table[: len(coeffs), idx] = torch.from_numpy(coeffs)
+        return table.to(self.dtype)
+
     def _gen_recurrence_mask(self) -> tuple[torch.Tensor, torch.Tensor]:
         """Generates mask for recurrence relation on the remaining entries.
 
@@ -33,6 +33,7 @@ import torch
 import cv2
 import os
 import glob
+import json
 import argparse
 from lietorch import SE3
 
@@ -266,6 +267,13 @@ if __name__ == "__main__":
     scales.append(scale)
     shifts.append(shift)
 
+  # clip-level intrinsics written by demo_mega-sam.py --clip-intrinsics
+  clip_intrinsics_path = os.path.join(
+      args.metric_depth_path, "clip_intrinsics.json"
+  )
+  if os.path.exists(clip_intrinsics_path):
+    with open(clip_intrinsics_path) as f:
+      fovs = [json.load(f)["fov"]]
   print("************** UNIDEPTH FOV ", np.median(fovs))
   ff = img_0.shape[1] / (2 * np.tan(np.radians(np.median(fovs) / 2.0)))
   K = np.eye(3)
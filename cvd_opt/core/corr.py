@@ -24,7 +24,7 @@ try:
   import alt_cuda_corr
 except:  # pylint: disable=bare-except
   # alt_cuda_corr is not compiled
-  pass
+  alt_cuda_corr = None
 
 
 class CorrBlock:
@@ -112,4 +112,56 @@ class AlternateCorrBlock:
 
     corr = torch.stack(corr_list, dim=1)
     corr = corr.reshape(B, -1, H, W)
-    return corr / torch.sqrt(torch.tensor(dim).float())
\ No newline at end of file
+    return corr / torch.sqrt(torch.tensor(dim).float())
+
+
+class OnDemandCorrBlock:
+  """Memory-lean correlation block in pure torch.
+
+  Average pooling the all-pairs volume over the second image and bilinearly
+  sampling it are both linear in fmap2, so the CorrBlock lookup equals the
+  dot product of fmap1 with fmap2 pooled and sampled at the same locations.
+  Only the (2r+1)^2 neighborhood of every query pixel is computed, in tiles
+  of tile_size query pixels, so memory stays bounded and no extension is
+  needed (unlike AlternateCorrBlock).
+  """
+
+  def __init__(self, fmap1, fmap2, num_levels=4, radius=4, tile_size=1024):
+    self.num_levels = num_levels
+    self.radius = radius
+    self.tile_size = tile_size
+
+    batch, dim, ht, wd = fmap1.shape
+    self.fmap1 = fmap1.reshape(batch, dim, ht * wd) / torch.sqrt(
+        torch.tensor(dim).float()
+    )
+
+    self.fmap2_pyramid = [fmap2]
+    for _ in range(self.num_levels - 1):
+      fmap2 = F.avg_pool2d(fmap2, 2, stride=2)
+      self.fmap2_pyramid.append(fmap2)
+
+  def __call__(self, coords):
+    r = self.radius
+    batch, _, h1, w1 = coords.shape
+    coords = coords.permute(0, 2, 3, 1).reshape(batch, h1 * w1, 1, 2)
+
+    dx = torch.linspace(-r, r, 2 * r + 1)
+    dy = torch.linspace(-r, r, 2 * r + 1)
+    delta = torch.stack(torch.meshgrid(dy, dx), axis=-1).to(coords.device)
+    delta = delta.view(1, 1, (2 * r + 1) ** 2, 2)
+    num_taps = delta.shape[2]
+
+    out = coords.new_empty(batch, h1 * w1, self.num_levels * num_taps)
+    for start in range(0, h1 * w1, self.tile_size):
+      end = min(start + self.tile_size, h1 * w1)
+      fmap1_tile = self.fmap1[:, :, start:end]
+      for i in range(self.num_levels):
+        coords_lvl = coords[:, start:end] / 2**i + delta
+        fmap2_tile = bilinear_sampler(self.fmap2_pyramid[i], coords_lvl)
+        out[:, start:end, i * num_taps : (i + 1) * num_taps] = torch.einsum(
+            'bct,bctk->btk', fmap1_tile, fmap2_tile
+        )
+
+    out = out.view(batch, h1, w1, -1)
+    return out.permute(0, 3, 1, 2).contiguous().float()
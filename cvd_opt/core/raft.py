@@ -15,8 +15,10 @@
 
 """RAFT network for MegaSaM."""
 
+from corr import alt_cuda_corr
 from corr import AlternateCorrBlock
 from corr import CorrBlock
+from corr import OnDemandCorrBlock
 from extractor import BasicEncoder
 from extractor import SmallEncoder
 import torch
@@ -68,6 +70,9 @@ class RAFT(nn.Module):
     if 'alternate_corr' not in self.args:
       self.args.alternate_corr = False
 
+    if 'corr_tile_size' not in self.args:
+      self.args.corr_tile_size = 1024
+
     # feature network, context network, and update block
     if args.small:
       self.fnet = SmallEncoder(
@@ -124,8 +129,15 @@ class RAFT(nn.Module):
       flow_init=None,
       upsample=True,
       test_mode=False,
+      flow_tol=None,
   ):
-    """Estimate optical flow between pair of frames."""
+    """Estimate optical flow between pair of frames.
+
+    In test_mode only the final flow is upsampled, and if flow_tol is given
+    the refinement stops early once the mean norm of the flow update of every
+    sample in the batch drops below flow_tol (in 1/8-resolution pixels). The
+    number of iterations actually run is stored in self.last_num_iters.
+    """
 
     image1 = 2 * (image1 / 255.0) - 1.0
     image2 = 2 * (image2 / 255.0) - 1.0
@@ -143,7 +155,19 @@ class RAFT(nn.Module):
     fmap1 = fmap1.float()
     fmap2 = fmap2.float()
     if self.args.alternate_corr:
-      corr_fn = AlternateCorrBlock(fmap1, fmap2, radius=self.args.corr_radius)
+      # The CUDA kernel is used when compiled; otherwise (e.g. on CPU) the
+      # pure-torch on-demand lookup gives the same memory-lean behaviour.
+      if alt_cuda_corr is not None and fmap1.is_cuda:
+        corr_fn = AlternateCorrBlock(
+            fmap1, fmap2, radius=self.args.corr_radius
+        )
+      else:
+        corr_fn = OnDemandCorrBlock(
+            fmap1,
+            fmap2,
+            radius=self.args.corr_radius,
+            tile_size=self.args.corr_tile_size,
+        )
     else:
       corr_fn = CorrBlock(fmap1, fmap2, radius=self.args.corr_radius)
 
@@ -161,7 +185,9 @@ class RAFT(nn.Module):
 
     flow_predictions = []
     flow_up = None
-    for _ in range(iters):
+    up_mask = None
+    self.last_num_iters = 0
+    for itr in range(iters):
       coords1 = coords1.detach()
       corr = corr_fn(coords1)  # index correlation volume
 
@@ -171,6 +197,15 @@ class RAFT(nn.Module):
 
       # F(t+1) = F(t) + \Delta(t)
       coords1 = coords1 + delta_flow
+      self.last_num_iters = itr + 1
+
+      if test_mode:
+        # Only the last prediction is returned, so skip upsampling until then.
+        if flow_tol is not None:
+          delta_norm = torch.norm(delta_flow.float(), dim=1).mean(dim=(1, 2))
+          if torch.all(delta_norm < flow_tol):
+            break
+        continue
 
       # upsample predictions
       if up_mask is None:
@@ -181,8 +216,12 @@ class RAFT(nn.Module):
       flow_predictions.append(flow_up)
 
     if test_mode:
-      if flow_up is None:
-        raise ValueError('flow_up is None')
+      if self.last_num_iters == 0:
+        raise ValueError('iters must be positive')
+      if up_mask is None:
+        flow_up = upflow8(coords1 - coords0)
+      else:
+        flow_up = self.upsample_flow(coords1 - coords0, up_mask)
       return coords1 - coords0, flow_up, net
 
     return flow_predictions
\ No newline at end of file
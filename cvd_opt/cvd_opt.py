@@ -24,6 +24,7 @@ import os
 from pathlib import Path
 
 from geometry_utils import NormalGenerator
+from geometry_utils import pose_distance
 import kornia
 from lietorch import SE3
 import numpy as np
@@ -197,9 +198,11 @@ def consistency_loss(
   pred_normal = compute_normals[0](
       1.0 / torch.clamp(disp_data_ds, 1e-3, 1e3), K_inv_rescale[None]
   )
-  init_normal = compute_normals[0](
-      1.0 / torch.clamp(init_disp_ds, 1e-3, 1e3), K_inv_rescale[None]
-  )
+  init_normal = compute_normals[0].reference_normals_b3hw
+  if init_normal is None:
+    init_normal = compute_normals[0](
+        1.0 / torch.clamp(init_disp_ds, 1e-3, 1e3), K_inv_rescale[None]
+    )
 
   loss_normal = torch.mean(
       fg_alpha * (1.0 - torch.sum(pred_normal * init_normal, dim=1))
@@ -235,66 +238,299 @@ def consistency_loss(
       + loss_grad * w_grad
   )
 
-if __name__ == "__main__":
-  parser = argparse.ArgumentParser()
-  parser.add_argument("--w_grad", type=float, default=2.0, help="w_grad")
-  parser.add_argument("--w_normal", type=float, default=6.0, help="w_normal")
-  parser.add_argument(
-      "--output_dir", type=str, default="outputs_cvd", help="outputs direcotry"
-  )
-  parser.add_argument("--scene_name", type=str, help="scene name")
+def scale_shift_gauss_newton(
+    cam_c2w,
+    K_inv,
+    disp_data,
+    flows,
+    flow_masks,
+    ii,
+    jj,
+    num_iters=5,
+    damping=1e-4,
+    prior_weight=1e-6,
+    huber_delta=0.1,
+):
+  """Per-frame scale and shift alignment from flow correspondences.
 
-  args = parser.parse_args()
+  Minimizes, with Levenberg-Marquardt, the robust per-pair mean of
 
-  cache_dir = Path(args.output_dir) / "raft_flow"
-  rootdir = Path(args.output_dir) / "reconstructions"
+    log(1 / z_tgt(s_i, t_i)) - log(exp(s_j) * disp_j(x + flow) + t_j)
 
-  output_dir = args.output_dir
-  scene_name = args.scene_name
-  print("***************************** ", scene_name)
-  img_data = np.load(rootdir / "images.npy")[
-      :, ::-1, ...
-  ]
-  disp_data = (
-      np.load(
-          rootdir / "disps.npy"
-      )
-      + 1e-6
-  )
-  intrinsics = np.load(rootdir / "intrinsics.npy")
-  poses = np.load(rootdir / "poses.npy")
-  mot_prob = np.load(rootdir / "motion_prob.npy")
+  over N log-scales s and N shifts t, where z_tgt is the depth of the
+  reference pixel after warping it into frame j with the known poses. Each
+  residual only touches four parameters, so the 2N x 2N normal equations are
+  assembled from per-pair 4x4 blocks and solved directly. A weak prior
+  towards the identity fixes the gauge when the baseline is too small to
+  observe scale.
+
+  Returns:
+    log_scale, shift: [N] tensors to be applied as
+    disp * exp(log_scale) + shift.
+  """
+  N, H, W = disp_data.shape
+  device = disp_data.device
+  disp_data = disp_data.float()
+
+  xx = torch.arange(0, W).view(1, -1).repeat(H, 1)
+  yy = torch.arange(0, H).view(-1, 1).repeat(1, W)
+  grid = torch.stack((xx, yy), -1).float().to(device)[None]
+
+  pixel_locations = grid + flows.permute(0, 2, 3, 1).float()
+  resize_factor = torch.tensor([W - 1.0, H - 1.0], device=device)
+  normalized_pixel_locations = 2 * (pixel_locations / resize_factor) - 1.0
+  in_bounds = (normalized_pixel_locations.abs() <= 1.0).all(-1)
+
+  d_ref = disp_data[ii]
+  d_tgt = torch.nn.functional.grid_sample(
+      disp_data[jj][:, None],
+      normalized_pixel_locations,
+      align_corners=True,
+  )[:, 0]
+  base_mask = flow_masks[:, 0].float() * in_bounds.float()
+
+  # Depth in the target view is z * (R_3 . K^-1 x) + t_3 with z = 1 / disp.
+  cam_1to2 = torch.bmm(torch.linalg.inv(cam_c2w[jj]), cam_c2w[ii])
+  rays = torch.cat([grid, torch.ones_like(grid[..., :1])], -1) @ K_inv.T
+  r3 = (cam_1to2[:, None, None, 2, :3] * rays).sum(-1)
+  t3 = cam_1to2[:, 2, 3][:, None, None]
+
+  idx = torch.stack([ii, ii + N, jj, jj + N], -1)
+  rows = idx[:, :, None].expand(-1, 4, 4)
+  cols = idx[:, None, :].expand(-1, 4, 4)
+  eye = torch.eye(2 * N, device=device)
+
+  log_scale = torch.zeros(N, device=device)
+  shift = torch.zeros(N, device=device)
+  for _ in range(num_iters):
+    scale = torch.exp(log_scale)
+    a = torch.clamp(scale[ii, None, None] * d_ref + shift[ii, None, None],
+                    1e-3, 1e3)
+    b = torch.clamp(scale[jj, None, None] * d_tgt + shift[jj, None, None],
+                    1e-3, 1e3)
+    z_tgt = r3 / a + t3
+    mask = base_mask * (z_tgt > 0.1).float()
+    z_tgt = torch.clamp(z_tgt, 0.1, 1e3)
+
+    res = -torch.log(z_tgt) - torch.log(b)
+    dres_da = r3 / (z_tgt * a**2)
+    J = torch.stack(
+        [
+            dres_da * scale[ii, None, None] * d_ref,
+            dres_da,
+            -scale[jj, None, None] * d_tgt / b,
+            -1.0 / b,
+        ],
+        -1,
+    )
+
+    # Pairs contribute equally up to their pair weight, which the mask values
+    # carry; Huber weights damp outlier pixels.
+    num_valid = (mask > 0).float().sum((1, 2), keepdim=True)
+    weight = mask / (num_valid + 1e-8)
+    weight = weight * torch.clamp(huber_delta / (res.abs() + 1e-8), max=1.0)
+
+    JtJ = torch.einsum("phwa,phwb,phw->pab", J, J, weight)
+    Jtr = torch.einsum("phwa,phw->pa", J, res * weight)
 
-  flows = np.load(
-      cache_dir / "flows.npy", allow_pickle=True
+    H_ = torch.zeros(2 * N, 2 * N, device=device)
+    H_.index_put_((rows, cols), JtJ, accumulate=True)
+    g = torch.zeros(2 * N, device=device)
+    g.index_add_(0, idx.flatten(), Jtr.flatten())
+
+    H_ = H_ + prior_weight * eye
+    g = g + prior_weight * torch.cat([log_scale, shift])
+    H_ = H_ + damping * torch.diag_embed(torch.diagonal(H_))
+
+    delta = torch.linalg.solve(H_, -g)
+    log_scale = log_scale + delta[:N]
+    shift = shift + delta[N:]
+
+  return log_scale, shift
+
+
+def load_flow_store(cache_dir):
+  """Memory-maps the RAFT flow store so pairs can be streamed on demand."""
+  flows = np.load(cache_dir / "flows.npy", mmap_mode="r")
+  flow_masks = np.load(cache_dir / "flows_masks.npy", mmap_mode="r")
+  iijj = np.load(cache_dir / "ii-jj.npy", allow_pickle=True)
+  return flows, flow_masks, iijj
+
+
+def score_pairs(flow_masks, ii, jj, cam_c2w, disp_data, batch_size=64):
+  """Scores flow pairs by valid-mask fraction and relative baseline.
+
+  Args:
+    flow_masks: [P, 1, H, W] (memory-mapped) flow validity masks.
+    ii: [P] reference frame indices.
+    jj: [P] target frame indices.
+    cam_c2w: [N, 4, 4] camera-to-world matrices.
+    disp_data: [N, H, W] mono disparities.
+    batch_size: number of masks read from the flow store at a time.
+
+  Returns:
+    valid_frac: [P] fraction of valid flow pixels of each pair.
+    baseline: [P] camera translation between the two frames divided by the
+      median depth of the reference frame, i.e. a scale-free parallax.
+  """
+  valid_frac = np.zeros((len(ii),), dtype=np.float32)
+  for k in range(0, len(ii), batch_size):
+    valid_frac[k : k + batch_size] = np.mean(
+        flow_masks[k : k + batch_size], axis=(1, 2, 3), dtype=np.float32
+    )
+
+  cam_c2w = torch.as_tensor(cam_c2w).float().cpu()
+  cam_1to2 = torch.bmm(
+      torch.linalg.inv(cam_c2w[jj]),
+      cam_c2w[ii],
   )
-  flow_masks = np.load(
-      cache_dir / "flows_masks.npy", allow_pickle=True
+  _, _, t_measure = pose_distance(cam_1to2)
+  median_depth = np.median(
+      1.0 / np.clip(disp_data.reshape(disp_data.shape[0], -1), 1e-3, 1e3),
+      axis=-1,
   )
-  flow_masks = np.float32(flow_masks)
-  iijj = np.load(cache_dir / "ii-jj.npy", allow_pickle=True)
+  baseline = t_measure.numpy() / median_depth[ii]
+  return valid_frac, baseline.astype(np.float32)
 
-  intrinsics = intrinsics[0]
-  poses_th = torch.as_tensor(poses, device="cpu").float().cuda()
 
-  K = np.eye(3)
-  K[0, 0] = intrinsics[0]
-  K[1, 1] = intrinsics[1]
-  K[0, 2] = intrinsics[2]
-  K[1, 2] = intrinsics[3]
+def pair_weights(
+    valid_frac, baseline, min_valid_frac, min_baseline, low_pair_weight
+):
+  """Per-pair loss weights; pairs below either threshold get low_pair_weight.
+
+  A weight of 0 means the pair is dropped and never moved to the device.
+  """
+  weak = (valid_frac < min_valid_frac) | (baseline < min_baseline)
+  return np.where(weak, low_pair_weight, 1.0).astype(np.float32)
+
+
+def print_pair_stats(ii, jj, valid_frac, baseline, weights):
+  """Reports pair statistics grouped by frame stride."""
+  strides = jj - ii
+  print("stride  pairs  kept  downweighted  valid_frac  baseline")
+  for stride in np.unique(strides):
+    sel = strides == stride
+    print(
+        f"{stride:6d} {np.sum(sel):6d} {np.sum(weights[sel] == 1.0):5d}"
+        f" {np.sum((weights[sel] > 0) & (weights[sel] < 1.0)):13d}"
+        f" {np.mean(valid_frac[sel]):11.3f} {np.mean(baseline[sel]):9.4f}"
+    )
+  print(
+      f"total {len(ii)} pairs, dropped {np.sum(weights == 0)},"
+      f" downweighted {np.sum((weights > 0) & (weights < 1.0))}"
+  )
+
 
-  img_data_pt = (
-      torch.from_numpy(np.ascontiguousarray(img_data)).half().cuda() / 255.0
+def temporal_windows(num_frames, chunk_size, chunk_overlap):
+  """Splits [0, num_frames) into overlapping windows of chunk_size frames."""
+  if chunk_size <= 0 or chunk_size >= num_frames:
+    return [(0, num_frames)]
+  if not 0 <= chunk_overlap < chunk_size:
+    raise ValueError(
+        f"chunk_overlap ({chunk_overlap}) must be in [0, chunk_size"
+        f" ({chunk_size}))"
+    )
+
+  windows = []
+  start = 0
+  while True:
+    end = min(start + chunk_size, num_frames)
+    windows.append((start, end))
+    if end == num_frames:
+      break
+    start = end - chunk_overlap
+  return windows
+
+
+def window_blend_weights(start, end, num_frames, chunk_overlap):
+  """Linear ramp weights so overlapping windows blend without seams."""
+  t = np.arange(start, end, dtype=np.float32)
+  ramp = float(chunk_overlap + 1)
+  w = np.ones_like(t)
+  if start > 0:
+    w = np.minimum(w, (t - start + 1.0) / ramp)
+  if end < num_frames:
+    w = np.minimum(w, (end - t) / ramp)
+  return w
+
+
+def fit_scale_shift(src_disp, dst_disp):
+  """Per-frame least-squares scale and shift mapping src_disp onto dst_disp."""
+  src = src_disp.float().flatten(1)
+  dst = dst_disp.float().flatten(1)
+  src_mean = src.mean(-1, keepdim=True)
+  dst_mean = dst.mean(-1, keepdim=True)
+  scale = ((src - src_mean) * (dst - dst_mean)).sum(-1) / (
+      ((src - src_mean) ** 2).sum(-1) + 1e-8
   )
-  flows = torch.from_numpy(np.ascontiguousarray(flows)).half().cuda()
-  flow_masks = (
-      torch.from_numpy(np.ascontiguousarray(flow_masks)).half().cuda()
-  )  # .unsqueeze(1)
-  iijj = torch.from_numpy(np.ascontiguousarray(iijj)).float().cuda()
-  ii = iijj[0, ...].long()
-  jj = iijj[1, ...].long()
-  K = torch.from_numpy(K).float().cuda()
+  scale = torch.clamp(scale, min=1e-3)
+  shift = dst_mean.squeeze(-1) - scale * src_mean.squeeze(-1)
+  return torch.log(scale), shift
 
+
+def save_checkpoint(path, state):
+  """Atomically writes an optimization checkpoint."""
+  tmp_path = str(path) + ".tmp"
+  torch.save(state, tmp_path)
+  os.replace(tmp_path, path)
+
+
+def optimize_cvd(
+    disp_data,
+    mot_prob,
+    poses_th,
+    K,
+    K_inv,
+    flows,
+    flow_masks,
+    ii,
+    jj,
+    w_grad=2.0,
+    w_normal=6.0,
+    scale_solver="adam",
+    scale_refine_steps=10,
+    fused_normals=False,
+    num_depth_steps=400,
+    warm_disp=None,
+    checkpoint_path=None,
+    checkpoint_every=0,
+    resume_state=None,
+    checkpoint_settings=None,
+):
+  """Runs scale-shift alignment followed by depth refinement on a clip.
+
+  Args:
+    disp_data: [N, H, W] numpy array of mono disparities at full resolution.
+    mot_prob: [N, h, w] numpy array of motion probabilities from tracking.
+    poses_th: [N, 7] tensor of camera poses.
+    K: 3x3 intrinsics rescaled to the optimization resolution.
+    K_inv: inverse of K.
+    flows: [P, 2, H', W'] half tensor of flows for pairs (ii, jj).
+    flow_masks: [P, 1, H', W'] half tensor of flow validity masks.
+    ii: [P] long tensor of reference frame indices into disp_data.
+    jj: [P] long tensor of target frame indices into disp_data.
+    w_grad: weight of the multi-scale gradient loss.
+    w_normal: weight of the normal loss.
+    scale_solver: "adam" runs 100 Adam steps over the full consistency loss
+      for the scale-shift stage; "gn" initializes scale and shift with
+      scale_shift_gauss_newton and only runs scale_refine_steps Adam steps.
+    scale_refine_steps: Adam refinement steps after the "gn" solver.
+    fused_normals: use NormalGenerator's fused separable-blur path.
+    num_depth_steps: number of depth refinement steps.
+    warm_disp: optional [N, H, W] numpy array of already optimized
+      disparities (e.g. from a previous sgd_cvd_hr.npz). The scale-shift
+      stage is then replaced by a least-squares fit of the mono prior to it
+      and depth refinement starts from warm_disp.
+    checkpoint_path: where periodic checkpoints are written.
+    checkpoint_every: write a checkpoint every this many steps; 0 disables.
+    resume_state: a checkpoint previously written to checkpoint_path to
+      continue from.
+    checkpoint_settings: dict of the settings the result depends on, stored
+      in every checkpoint so that resuming can check they did not change.
+
+  Returns:
+    [N, H, W] optimized disparities at full resolution as a numpy array.
+  """
   init_disp = torch.from_numpy(disp_data).half().cuda()
   disp_data = torch.from_numpy(disp_data).half().cuda()
 
@@ -322,19 +558,71 @@ if __name__ == "__main__":
   cvd_prob[cvd_prob > 0.5] = 0.5
   cvd_prob = torch.clamp(cvd_prob, 1e-3, 1.0)
 
-  # rescale intrinsic matrix to small resolution
-  K_o = K.clone()
-  K[0:2, ...] *= RESIZE_FACTOR
-  K_inv = torch.linalg.inv(K)
-
   disp_data.requires_grad = False
   poses_th.requires_grad = False
 
   uncertainty = cvd_prob
 
+  def maybe_checkpoint(stage, step, optim, **tensors):
+    if checkpoint_path is None or checkpoint_every <= 0:
+      return
+    if (step + 1) % checkpoint_every != 0:
+      return
+    state = {
+        "stage": stage,
+        "step": step,
+        "optim": optim.state_dict(),
+        "settings": checkpoint_settings,
+    }
+    state.update({k: v.detach().cpu() for k, v in tensors.items()})
+    save_checkpoint(checkpoint_path, state)
+
+  if warm_disp is not None:
+    warm_disp = torch.nn.functional.interpolate(
+        torch.from_numpy(warm_disp).float().cuda().unsqueeze(1),
+        size=disp_data.shape[-2:],
+        mode="bilinear",
+    ).squeeze(1)
+
+  resume_stage = None if resume_state is None else resume_state["stage"]
+
   # First optimize scale and shift to align them
-  log_scale_ = torch.log(torch.ones(init_disp.shape[0]).to(disp_data.device))
-  shift_ = torch.zeros(init_disp.shape[0]).to(disp_data.device)
+  scale_start_step = 0
+  if resume_stage == "scale":
+    log_scale_ = resume_state["log_scale"].cuda()
+    shift_ = resume_state["shift"].cuda()
+    uncertainty = resume_state["uncertainty"].cuda()
+    scale_start_step = resume_state["step"] + 1
+    num_scale_steps = (
+        scale_refine_steps if scale_solver == "gn" else 100
+    )
+  elif resume_stage == "depth" or warm_disp is not None:
+    # Only needed to rescale the prior; refinement starts from a later stage.
+    with torch.no_grad():
+      if resume_stage == "depth":
+        log_scale_ = resume_state["log_scale"].cuda()
+        shift_ = resume_state["shift"].cuda()
+      else:
+        log_scale_, shift_ = fit_scale_shift(disp_data, warm_disp)
+    num_scale_steps = 0
+  elif scale_solver == "gn":
+    with torch.no_grad():
+      log_scale_, shift_ = scale_shift_gauss_newton(
+          SE3(poses_th).inv().matrix(),
+          K_inv,
+          disp_data,
+          flows,
+          flow_masks,
+          ii,
+          jj,
+      )
+    num_scale_steps = scale_refine_steps
+  else:
+    log_scale_ = torch.log(
+        torch.ones(init_disp.shape[0]).to(disp_data.device)
+    )
+    shift_ = torch.zeros(init_disp.shape[0]).to(disp_data.device)
+    num_scale_steps = 100
   log_scale_.requires_grad = True
   shift_.requires_grad = True
   uncertainty.requires_grad = True
@@ -344,14 +632,23 @@ if __name__ == "__main__":
       {"params": shift_, "lr": 1e-2},
       {"params": uncertainty, "lr": 1e-2},
   ])
+  if resume_stage == "scale":
+    optim.load_state_dict(resume_state["optim"])
 
   compute_normals = []
   compute_normals.append(
-      NormalGenerator(disp_data.shape[-2], disp_data.shape[-1])
+      NormalGenerator(
+          disp_data.shape[-2], disp_data.shape[-1], fused=fused_normals
+      ).cuda()
   )
   init_disp = torch.clamp(init_disp, 1e-3, 1e3)
+  # init_disp is constant within a stage, so its normals are computed once.
+  if num_scale_steps > scale_start_step:
+    compute_normals[0].set_reference(
+        1.0 / torch.clamp(init_disp[:, None, ...], 1e-3, 1e3), K_inv[None]
+    )
 
-  for i in range(100):
+  for i in range(scale_start_step, num_scale_steps):
     optim.zero_grad()
     cam_c2w = SE3(poses_th).inv().matrix()
     scale_ = torch.exp(log_scale_)
@@ -382,18 +679,39 @@ if __name__ == "__main__":
 
     optim.step()
     print("step ", i, loss.item())
+    maybe_checkpoint(
+        "scale",
+        i,
+        optim,
+        log_scale=log_scale_,
+        shift=shift_,
+        uncertainty=uncertainty,
+    )
 
   # Then optimize depth and uncertainty
-  disp_data = (
-      disp_data * torch.exp(log_scale_)[..., None, None].detach()
-      + shift_[..., None, None].detach()
-  )
+  depth_start_step = 0
+  if resume_stage == "depth":
+    disp_data = resume_state["disp_data"].cuda()
+    uncertainty = resume_state["uncertainty"].cuda()
+    depth_start_step = resume_state["step"] + 1
+  elif warm_disp is not None:
+    disp_data = warm_disp.to(disp_data.dtype)
+  else:
+    disp_data = (
+        disp_data * torch.exp(log_scale_)[..., None, None].detach()
+        + shift_[..., None, None].detach()
+    )
   init_disp = (
       init_disp * torch.exp(log_scale_)[..., None, None].detach()
       + shift_[..., None, None].detach()
   )
   init_disp = torch.clamp(init_disp, 1e-3, 1e3)
+  compute_normals[0].set_reference(
+      1.0 / torch.clamp(init_disp[:, None, ...], 1e-3, 1e3), K_inv[None]
+  )
 
+  disp_data = disp_data.detach()
+  uncertainty = uncertainty.detach()
   disp_data.requires_grad = True
   uncertainty.requires_grad = True
   poses_th.requires_grad = False  # True
@@ -402,9 +720,10 @@ if __name__ == "__main__":
       {"params": disp_data, "lr": 5e-3},
       {"params": uncertainty, "lr": 5e-3},
   ])
+  if resume_stage == "depth":
+    optim.load_state_dict(resume_state["optim"])
 
-  losses = []
-  for i in range(400):
+  for i in range(depth_start_step, num_depth_steps):
     optim.zero_grad()
     cam_c2w = SE3(poses_th).inv().matrix()
     loss = consistency_loss(
@@ -423,8 +742,8 @@ if __name__ == "__main__":
         w_ratio=1.0,
         w_flow=0.2,
         w_si=1,
-        w_grad=args.w_grad,
-        w_normal=args.w_normal,
+        w_grad=w_grad,
+        w_normal=w_normal,
     )
 
     loss.backward()
@@ -433,25 +752,336 @@ if __name__ == "__main__":
 
     optim.step()
     print("step ", i, loss.item())
-    losses.append(loss)
+    maybe_checkpoint(
+        "depth",
+        i,
+        optim,
+        log_scale=log_scale_,
+        shift=shift_,
+        disp_data=disp_data,
+        uncertainty=uncertainty,
+    )
 
-  disp_data_opt = (
+  return (
       torch.nn.functional.interpolate(
           disp_data.unsqueeze(1), scale_factor=(2, 2), mode="bilinear"
       )
       .squeeze(1)
       .detach()
+      .float()
       .cpu()
       .numpy()
   )
 
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--w_grad", type=float, default=2.0, help="w_grad")
+  parser.add_argument("--w_normal", type=float, default=6.0, help="w_normal")
+  parser.add_argument(
+      "--output_dir", type=str, default="outputs_cvd", help="outputs direcotry"
+  )
+  parser.add_argument("--scene_name", type=str, help="scene name")
+  parser.add_argument(
+      "--scale_solver",
+      type=str,
+      default="adam",
+      choices=["adam", "gn"],
+      help=(
+          "scale-shift alignment: 100 Adam steps, or a Gauss-Newton solve on"
+          " flow correspondences followed by a short Adam refinement"
+      ),
+  )
+  parser.add_argument(
+      "--scale_refine_steps",
+      type=int,
+      default=10,
+      help="Adam refinement steps after the gn scale-shift solve",
+  )
+  parser.add_argument(
+      "--fused_normals",
+      action="store_true",
+      help="compute normals with the fused separable-blur path",
+  )
+  parser.add_argument(
+      "--min_pair_valid_frac",
+      type=float,
+      default=0.0,
+      help="pairs with a smaller fraction of valid flow pixels are pruned",
+  )
+  parser.add_argument(
+      "--min_pair_baseline",
+      type=float,
+      default=0.0,
+      help=(
+          "pairs whose camera baseline divided by the median scene depth is"
+          " smaller are pruned"
+      ),
+  )
+  parser.add_argument(
+      "--low_pair_weight",
+      type=float,
+      default=0.0,
+      help="loss weight of pruned pairs; 0 drops them entirely",
+  )
+  parser.add_argument(
+      "--num_depth_steps",
+      type=int,
+      default=400,
+      help="depth refinement steps (a warm start usually needs far fewer)",
+  )
+  parser.add_argument(
+      "--checkpoint_every",
+      type=int,
+      default=0,
+      help=(
+          "write optimizer checkpoints to <output_dir>/cvd_checkpoints every"
+          " this many steps; 0 disables checkpointing"
+      ),
+  )
+  parser.add_argument(
+      "--resume",
+      action="store_true",
+      help=(
+          "continue from the checkpoints in <output_dir>/cvd_checkpoints."
+          " Windows whose checkpoint was written with different settings are"
+          " optimized from scratch"
+      ),
+  )
+  parser.add_argument(
+      "--warm_start",
+      type=str,
+      default=None,
+      help=(
+          "sgd_cvd_hr.npz of a previous run to start depth refinement from,"
+          " e.g. when only --w_grad/--w_normal changed. Only depths are"
+          " restored: uncertainty restarts from the motion probabilities"
+      ),
+  )
+  parser.add_argument(
+      "--chunk_size",
+      type=int,
+      default=0,
+      help=(
+          "optimize overlapping temporal windows of this many frames; 0"
+          " optimizes the whole video at once. Should exceed the largest"
+          " flow stride (15) so every pair fits in some window."
+      ),
+  )
+  parser.add_argument(
+      "--chunk_overlap",
+      type=int,
+      default=16,
+      help="number of frames shared (and blended) by consecutive windows",
+  )
+
+  args = parser.parse_args()
+  if args.chunk_size < 0:
+    parser.error("--chunk_size must be >= 0")
+  if args.chunk_size > 0 and not 0 <= args.chunk_overlap < args.chunk_size:
+    parser.error(
+        f"--chunk_overlap ({args.chunk_overlap}) must be >= 0 and smaller than"
+        f" --chunk_size ({args.chunk_size}); pass a smaller --chunk_overlap"
+    )
+
+  cache_dir = Path(args.output_dir) / "raft_flow"
+  rootdir = Path(args.output_dir) / "reconstructions"
+
+  output_dir = args.output_dir
+  scene_name = args.scene_name
+  print("***************************** ", scene_name)
+  # Images are only needed for the final save, so they stay on the host.
+  img_data = np.load(rootdir / "images.npy")[
+      :, ::-1, ...
+  ]
+  disp_data = (
+      np.load(
+          rootdir / "disps.npy"
+      )
+      + 1e-6
+  )
+  intrinsics = np.load(rootdir / "intrinsics.npy")
+  poses = np.load(rootdir / "poses.npy")
+  mot_prob = np.load(rootdir / "motion_prob.npy")
+
+  flows, flow_masks, iijj = load_flow_store(cache_dir)
+  ii_all = iijj[0, ...].astype(np.int64)
+  jj_all = iijj[1, ...].astype(np.int64)
+
+  intrinsics = intrinsics[0]
+  poses_th = torch.as_tensor(poses, device="cpu").float().cuda()
+
+  K = np.eye(3)
+  K[0, 0] = intrinsics[0]
+  K[1, 1] = intrinsics[1]
+  K[0, 2] = intrinsics[2]
+  K[1, 2] = intrinsics[3]
+  K = torch.from_numpy(K).float().cuda()
+
+  # rescale intrinsic matrix to small resolution
+  K_o = K.clone()
+  K[0:2, ...] *= RESIZE_FACTOR
+  K_inv = torch.linalg.inv(K)
+
+  cam_c2w = SE3(poses_th).inv().matrix()
+
+  valid_frac, baseline = score_pairs(
+      flow_masks, ii_all, jj_all, cam_c2w, disp_data
+  )
+  pair_w = pair_weights(
+      valid_frac,
+      baseline,
+      args.min_pair_valid_frac,
+      args.min_pair_baseline,
+      args.low_pair_weight,
+  )
+  print_pair_stats(ii_all, jj_all, valid_frac, baseline, pair_w)
+  Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+  np.savez(
+      Path(args.output_dir) / "cvd_pair_stats.npz",
+      ii=ii_all,
+      jj=jj_all,
+      valid_frac=valid_frac,
+      baseline=baseline,
+      weight=pair_w,
+  )
+
+  warm_disp = None
+  if args.warm_start is not None:
+    warm_depths = np.load(args.warm_start)["depths"].astype(np.float32)
+    assert warm_depths.shape[0] == disp_data.shape[0]
+    warm_disp = 1.0 / np.clip(warm_depths, 1e-3, 1e3)
+
+  checkpoint_dir = Path(args.output_dir) / "cvd_checkpoints"
+  if args.checkpoint_every > 0:
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+  num_frames = disp_data.shape[0]
+  disp_acc = np.zeros(disp_data.shape, dtype=np.float32)
+  weight_acc = np.zeros((num_frames,), dtype=np.float32)
+
+  windows = temporal_windows(num_frames, args.chunk_size, args.chunk_overlap)
+  if len(windows) > 1:
+    # Pairs that don't fit in any window don't constrain the result at all.
+    covered = np.zeros(ii_all.shape, dtype=bool)
+    for start, end in windows:
+      covered |= (np.minimum(ii_all, jj_all) >= start) & (
+          np.maximum(ii_all, jj_all) < end
+      )
+    if not covered.all():
+      print(
+          f"warning: {np.sum(~covered)} of {len(ii_all)} flow pairs do not fit"
+          " in any window and are ignored; increase --chunk_size or"
+          " --chunk_overlap"
+      )
+  for start, end in windows:
+    print("***************************** window ", start, end)
+    checkpoint_path = checkpoint_dir / f"window_{start:05d}_{end:05d}.pt"
+    # Everything the optimized disparities of this window depend on.
+    settings = {
+        "window": (start, end),
+        "w_grad": args.w_grad,
+        "w_normal": args.w_normal,
+        "scale_solver": args.scale_solver,
+        "scale_refine_steps": args.scale_refine_steps,
+        "num_depth_steps": args.num_depth_steps,
+        "fused_normals": args.fused_normals,
+        "min_pair_valid_frac": args.min_pair_valid_frac,
+        "min_pair_baseline": args.min_pair_baseline,
+        "low_pair_weight": args.low_pair_weight,
+        "warm_start": args.warm_start,
+    }
+    resume_state = None
+    if args.resume and checkpoint_path.exists():
+      resume_state = torch.load(checkpoint_path, weights_only=False)
+      saved = resume_state.get("settings") or {}
+      changed = sorted(
+          k for k in set(settings) | set(saved) if saved.get(k) != settings.get(k)
+      )
+      if changed:
+        print(
+            "not resuming from ",
+            checkpoint_path,
+            ": settings changed (",
+            ", ".join(changed),
+            "), optimizing the window from scratch",
+        )
+        resume_state = None
+      else:
+        print("resuming from ", checkpoint_path, resume_state["stage"])
+
+    if resume_state is not None and resume_state["stage"] == "done":
+      disp_opt = resume_state["disp_opt"]
+    else:
+      # Only the flows of pairs fully inside the window are made resident.
+      in_window = (ii_all >= start) & (ii_all < end)
+      in_window &= (jj_all >= start) & (jj_all < end)
+      pair_idx = np.nonzero(in_window & (pair_w > 0))[0]
+      touches_window = ((ii_all >= start) & (ii_all < end)) | (
+          (jj_all >= start) & (jj_all < end)
+      )
+      num_crossing = np.sum(touches_window & ~in_window & (pair_w > 0))
+      if num_crossing > 0:
+        print(
+            f"window {start}-{end}: {len(pair_idx)} pairs, {num_crossing} pairs"
+            " crossing the window border excluded"
+        )
+      flows_w = (
+          torch.from_numpy(np.ascontiguousarray(flows[pair_idx])).half().cuda()
+      )
+      flow_masks_w = torch.from_numpy(
+          np.float32(flow_masks[pair_idx])
+          * pair_w[pair_idx][:, None, None, None]
+      ).half().cuda()  # .unsqueeze(1)
+      ii = torch.from_numpy(ii_all[pair_idx] - start).cuda()
+      jj = torch.from_numpy(jj_all[pair_idx] - start).cuda()
+
+      disp_opt = optimize_cvd(
+          np.ascontiguousarray(disp_data[start:end]),
+          np.ascontiguousarray(mot_prob[start:end]),
+          poses_th[start:end].clone(),
+          K,
+          K_inv,
+          flows_w,
+          flow_masks_w,
+          ii,
+          jj,
+          w_grad=args.w_grad,
+          w_normal=args.w_normal,
+          scale_solver=args.scale_solver,
+          scale_refine_steps=args.scale_refine_steps,
+          fused_normals=args.fused_normals,
+          num_depth_steps=args.num_depth_steps,
+          warm_disp=(
+              None
+              if warm_disp is None
+              else np.ascontiguousarray(warm_disp[start:end])
+          ),
+          checkpoint_path=checkpoint_path,
+          checkpoint_every=args.checkpoint_every,
+          resume_state=resume_state,
+          checkpoint_settings=settings,
+      )
+      del flows_w, flow_masks_w
+      if args.checkpoint_every > 0:
+        save_checkpoint(
+            checkpoint_path,
+            {"stage": "done", "disp_opt": disp_opt, "settings": settings},
+        )
+
+    w = window_blend_weights(start, end, num_frames, args.chunk_overlap)
+    disp_acc[start:end] += disp_opt * w[:, None, None]
+    weight_acc[start:end] += w
+
+  disp_data_opt = disp_acc / weight_acc[:, None, None]
+
   # poses_ = poses_th.detach().cpu().numpy()
   output_dir = Path(args.output_dir) 
   output_dir.mkdir(parents=True, exist_ok=True)
   np.savez(
       output_dir / "sgd_cvd_hr.npz",
-      images=np.uint8(img_data_pt.cpu().numpy().transpose(0, 2, 3, 1) * 255.0),
+      images=np.uint8(img_data.transpose(0, 2, 3, 1)),
       depths=np.clip(np.float16(1.0 / disp_data_opt), 1e-3, 1e2),
       intrinsic=K_o.detach().cpu().numpy(),
       cam_c2w=cam_c2w.detach().cpu().numpy(),
-  )
\ No newline at end of file
+  )
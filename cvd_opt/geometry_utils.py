@@ -66,13 +66,17 @@ class BackprojectDepth(nn.Module):
     # automatically
     self.register_buffer("pix_coords_13N", pix_coords_13N)
 
+  def rays(self, invK_b44: Tensor) -> Tensor:
+    """Unit-depth rays K^-1 [u, v, 1]^T for every pixel, shape b x 3 x N."""
+    if self.pix_coords_13N.device != invK_b44.device:
+      # Moves the buffer once instead of copying it to the device every call.
+      self.pix_coords_13N = self.pix_coords_13N.to(invK_b44.device)
+    return torch.matmul(invK_b44[:, :3, :3], self.pix_coords_13N)
+
   # @jit.script_method
   def forward(self, depth_b1hw: Tensor, invK_b44: Tensor) -> Tensor:
     """Backprojects spatial points in 2D image space to world space using invK_b44 at the depths defined in depth_b1hw."""
-    cam_points_b3N = torch.matmul(
-        invK_b44[:, :3, :3], self.pix_coords_13N.float().cuda()
-    )
-    cam_points_b3N = depth_b1hw.flatten(start_dim=2) * cam_points_b3N
+    cam_points_b3N = depth_b1hw.flatten(start_dim=2) * self.rays(invK_b44)
     cam_points_b4N = to_homogeneous(cam_points_b3N, dim=1)
     return cam_points_b4N
 
@@ -108,7 +112,12 @@ class Project3D(jit.ScriptModule):
 
 
 class NormalGenerator(nn.Module):
-  """Estimates normals from depth maps."""
+  """Estimates normals from depth maps.
+
+  Normals of a fixed reference depth (e.g. the mono-depth prior a loss
+  compares against) can be cached with set_reference so they are not
+  recomputed at every optimization step.
+  """
 
   def __init__(
       self,
@@ -116,8 +125,18 @@ class NormalGenerator(nn.Module):
       width: int,
       smoothing_kernel_size: int = 5,
       smoothing_kernel_std: float = 2.0,
+      fused: bool = False,
   ):
-    """Estimates normals from depth maps."""
+    """Estimates normals from depth maps.
+
+    Args:
+      height: depth map height.
+      width: depth map width.
+      smoothing_kernel_size: size of the gaussian blur applied to the depth.
+      smoothing_kernel_std: std of the gaussian blur applied to the depth.
+      fused: use the separable blur + direct cross-product path, which skips
+        kornia and the 4 x N homogeneous point tensor.
+    """
     super().__init__()
     self.height = height
     self.width = width
@@ -126,10 +145,76 @@ class NormalGenerator(nn.Module):
 
     self.kernel_size = smoothing_kernel_size
     self.std = smoothing_kernel_std
+    self.fused = fused
+
+    # Same kernels as kornia.filters.gaussian_blur2d / spatial_gradient, split
+    # into their separable 1D factors.
+    x = torch.arange(self.kernel_size, dtype=torch.float32)
+    x = x - self.kernel_size // 2
+    if self.kernel_size % 2 == 0:
+      x = x + 0.5
+    gauss = torch.exp(-(x**2) / (2.0 * self.std**2))
+    self.register_buffer("gauss_k", gauss / gauss.sum())
+    self.register_buffer("sobel_smooth_k", torch.tensor([1.0, 2.0, 1.0]) / 4.0)
+    self.register_buffer("sobel_diff_k", torch.tensor([-1.0, 0.0, 1.0]) / 2.0)
+
+    self.reference_normals_b3hw = None
+
+  def set_reference(self, depth_b1hw: Tensor, invK_b44: Tensor) -> Tensor:
+    """Computes and caches the normals of a constant reference depth."""
+    with torch.no_grad():
+      self.reference_normals_b3hw = self(depth_b1hw, invK_b44)
+    return self.reference_normals_b3hw
+
+  def _separable_conv(
+      self, x_b1hw: Tensor, k_h: Tensor, k_w: Tensor, border: str
+  ) -> Tensor:
+    """Correlates x with the outer product of k_h and k_w."""
+    pad_h = k_h.shape[0] // 2
+    pad_w = k_w.shape[0] // 2
+    x_b1hw = F.pad(x_b1hw, (pad_w, pad_w, pad_h, pad_h), mode=border)
+    k_h = k_h.to(x_b1hw.dtype)
+    k_w = k_w.to(x_b1hw.dtype)
+    x_b1hw = F.conv2d(x_b1hw, k_w.view(1, 1, 1, -1))
+    return F.conv2d(x_b1hw, k_h.view(1, 1, -1, 1))
+
+  def _fused_forward(self, depth_b1hw: Tensor, invK_b44: Tensor) -> Tensor:
+    """Separable blur, 3-channel backprojection and an explicit cross product."""
+    batch_size = depth_b1hw.shape[0]
+    depth_smooth_b1hw = self._separable_conv(
+        depth_b1hw, self.gauss_k, self.gauss_k, "reflect"
+    )
+    rays_b3N = self.backproject.rays(invK_b44).to(depth_b1hw.dtype)
+    cam_points_b3hw = depth_smooth_b1hw * rays_b3N.view(
+        -1, 3, self.height, self.width
+    )
+
+    cam_points_b1hw = cam_points_b3hw.reshape(
+        -1, 1, self.height, self.width
+    )
+    grad_x = self._separable_conv(
+        cam_points_b1hw, self.sobel_smooth_k, self.sobel_diff_k, "replicate"
+    ).view(batch_size, 3, self.height, self.width)
+    grad_y = self._separable_conv(
+        cam_points_b1hw, self.sobel_diff_k, self.sobel_smooth_k, "replicate"
+    ).view(batch_size, 3, self.height, self.width)
+
+    gx, gy = grad_x.unbind(1), grad_y.unbind(1)
+    normals_b3hw = torch.stack(
+        [
+            gx[1] * gy[2] - gx[2] * gy[1],
+            gx[2] * gy[0] - gx[0] * gy[2],
+            gx[0] * gy[1] - gx[1] * gy[0],
+        ],
+        dim=1,
+    )
+    return F.normalize(normals_b3hw, dim=1)
 
   # @jit.script_method
   def forward(self, depth_b1hw: Tensor, invK_b44: Tensor) -> Tensor:
     """Estimates a normal at each location in the depth map."""
+    if self.fused:
+      return self._fused_forward(depth_b1hw, invK_b44)
 
     # First smoothes incoming depth maps with a gaussian blur, backprojects
     # those depth points into world space (see BackprojectDepth), estimates
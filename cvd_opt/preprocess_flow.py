@@ -88,14 +88,71 @@ if __name__ == '__main__':
   parser.add_argument(
       '--mixed_precision', action='store_true', help='use mixed precision'
   )
+  parser.add_argument(
+      '--iters', default=22, type=int, help='maximum RAFT iterations'
+  )
+  parser.add_argument(
+      '--flow_tol',
+      default=None,
+      type=float,
+      help=(
+          'stop refining a pair once the mean flow update drops below this'
+          ' many 1/8-resolution pixels'
+      ),
+  )
+  parser.add_argument(
+      '--alternate_corr',
+      action='store_true',
+      help='look up correlations on demand instead of the all-pairs volume',
+  )
+  parser.add_argument(
+      '--corr_tile_size',
+      default=1024,
+      type=int,
+      help='query pixels per tile of the on-demand correlation lookup',
+  )
+  parser.add_argument(
+      '--registry',
+      default=None,
+      help='load RAFT from this offline registry (model_registry.py)',
+  )
+  parser.add_argument(
+      '--quantize',
+      choices=['fp32', 'int8'],
+      default='fp32',
+      help='int8: quantized CPU inference profile (quantize_priors.py)',
+  )
+  parser.add_argument(
+      '--quantize_calib_frames',
+      default=8,
+      type=int,
+      help='frames used to calibrate the int8 encoders',
+  )
   parser.add_argument("--outdir", default="outputs/")
   args = parser.parse_args()
-
-  model = torch.nn.DataParallel(RAFT(args))
-  model.load_state_dict(torch.load(args.model))
-  print(f'Loaded checkpoint at {args.model}')
-  flow_model = model.module
-  flow_model.cuda()  # .eval()
+  # Quantized kernels only run on CPU.
+  device = 'cpu' if args.quantize == 'int8' else 'cuda'
+
+  if args.registry:
+    sys.path.append('.')
+    from model_registry import get_model
+
+    flow_model = get_model(
+        'raft_small' if args.small else 'raft', args.registry, device=device
+    )
+    # Test-time options are read from args at every forward.
+    for key in ('alternate_corr', 'corr_tile_size'):
+      setattr(flow_model.args, key, getattr(args, key))
+    print(f'Loaded RAFT from registry {args.registry}')
+  else:
+    flow_model = RAFT(args)
+    # Checkpoints were saved from a DataParallel wrapper.
+    state_dict = torch.load(args.model, map_location='cpu')
+    flow_model.load_state_dict(
+        {k.replace('module.', '', 1): v for k, v in state_dict.items()}
+    )
+    print(f'Loaded checkpoint at {args.model}')
+  flow_model.to(device)  # .eval()
   flow_model.eval()
 
   scene_name = args.scene_name
@@ -121,6 +178,26 @@ if __name__ == '__main__':
 
   img_data = np.array(img_data)
 
+  if args.quantize == 'int8':
+    sys.path.append('.')
+    from quantize_priors import quantize_raft
+    from quantize_priors import sample_frames
+
+    calib_idx = sample_frames(
+        list(range(len(img_data) - 1)), args.quantize_calib_frames
+    )
+    flow_model = quantize_raft(
+        flow_model,
+        [
+            (
+                torch.as_tensor(img_data[i : i + 1]).float(),
+                torch.as_tensor(img_data[i + 1 : i + 2]).float(),
+            )
+            for i in calib_idx
+        ],
+    )
+    print(f'Quantized RAFT to int8, calibrated on {len(calib_idx)} pairs')
+
   flows_low = []
 
   flows_high = []
@@ -132,6 +209,7 @@ if __name__ == '__main__':
 
   ii = []
   jj = []
+  num_iters = []
   flows_arr_up = []
   masks_arr_up = []
 
@@ -141,14 +219,14 @@ if __name__ == '__main__':
       image1 = (
           torch.as_tensor(np.ascontiguousarray(img_data[i : i + 1]))
           .float()
-          .cuda()
+          .to(device)
       )
       image2 = (
           torch.as_tensor(
               np.ascontiguousarray(img_data[i + step : i + step + 1])
           )
           .float()
-          .cuda()
+          .to(device)
       )
 
       ii.append(i)
@@ -164,7 +242,7 @@ if __name__ == '__main__':
           flow_init = (
               torch.as_tensor(np.ascontiguousarray(flow_init))
               .float()
-              .cuda()
+              .to(device)
               .permute(0, 3, 1, 2)
           )
         else:
@@ -173,10 +251,12 @@ if __name__ == '__main__':
         flow_low, flow_up, _ = flow_model(
             torch.cat([image1, image2], dim=0),
             torch.cat([image2, image1], dim=0),
-            iters=22,
+            iters=args.iters,
             test_mode=True,
             flow_init=flow_init,
+            flow_tol=args.flow_tol,
         )
+        num_iters.append(flow_model.last_num_iters)
 
         flow_low_fwd = flow_low[0].cpu().numpy().transpose(1, 2, 0)
         flow_low_bwd = flow_low[1].cpu().numpy().transpose(1, 2, 0)
@@ -211,4 +291,9 @@ if __name__ == '__main__':
   out_dir.mkdir(parents=True, exist_ok=True)
   np.save(out_dir / 'flows.npy', np.float16(flows_high))
   np.save(out_dir / 'flows_masks.npy', flow_masks_high)
-  np.save(out_dir / 'ii-jj.npy', iijj)
\ No newline at end of file
+  np.save(out_dir / 'ii-jj.npy', iijj)
+  np.save(out_dir / 'num_iters.npy', np.array(num_iters))
+  print(f'RAFT iterations per pair: mean {np.mean(num_iters):.1f}')
+  for step in np.unique(iijj[1] - iijj[0]):
+    sel = (iijj[1] - iijj[0]) == step
+    print(f'  step {step}: {np.mean(np.array(num_iters)[sel]):.1f}')
\ No newline at end of file
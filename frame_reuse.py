@@ -0,0 +1,144 @@
+"""Temporal reuse of mono-depth predictions on near-duplicate frames.
+
+At 30-60 fps most adjacent frames differ by a few pixels, yet the depth
+priors run a full ViT-L on each of them. `FrameReuse` compares each frame
+with the last frame the network actually ran on (a keyframe), using the
+mean absolute difference of small grayscale thumbnails, which costs well
+under a millisecond. Frames below the threshold are not run: once the next
+keyframe is computed, their prediction is a linear blend of the two
+keyframes around them. The previous keyframe is held instead at the end
+of the clip and across cuts (keyframes differing by more than twice the
+threshold).
+
+Comparing against the keyframe rather than the previous frame bounds the
+drift of slow motion, and `max_skip` bounds the number of consecutive
+skipped frames (and so the number of frames buffered).
+"""
+
+import cv2
+import numpy as np
+
+
+def blend(a, b, weight):
+    """(1 - weight) * a + weight * b for arrays, scalars or dicts of them."""
+    if isinstance(a, dict):
+        return {k: blend(a[k], b[k], weight) for k in a}
+    return (1.0 - weight) * a + weight * b
+
+
+class FrameReuse:
+    """Skips near-duplicate frames and blends keyframe predictions instead.
+
+    Usage:
+
+        reuse = FrameReuse(threshold=1.0)
+        for name in frames:
+            image = load(name)
+            for name, payload, prediction in reuse.push(
+                name, image, lambda: model(image)
+            ):
+                save(name, prediction)
+        for name, payload, prediction in reuse.flush():
+            save(name, prediction)
+        print(reuse.summary())
+    """
+
+    def __init__(self, threshold, max_skip=8, size=64):
+        """Initializes an empty reuse state.
+
+        Args:
+            threshold: mean absolute thumbnail difference, in 0-255 gray
+                levels, below which a frame reuses the keyframe predictions
+                (0 disables reuse).
+            max_skip: maximum number of consecutive skipped frames.
+            size: long side of the comparison thumbnails.
+        """
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.size = size
+        self.key_thumbnail = None
+        self.key_prediction = None
+        self.pending = []
+        self.num_frames = 0
+        self.num_skipped = 0
+
+    def thumbnail(self, image):
+        """Grayscale [h, w] float32 thumbnail in 0-255 of an HxWx3 image."""
+        image = np.asarray(image)
+        if image.dtype != np.uint8:
+            image = np.clip(image * 255.0, 0, 255).astype(np.uint8)
+        h, w = image.shape[:2]
+        scale = self.size / max(h, w)
+        small = cv2.resize(
+            image,
+            (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)),
+            interpolation=cv2.INTER_AREA,
+        )
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY).astype(np.float32)
+
+    def difference(self, thumbnail):
+        """Mean absolute difference to the keyframe thumbnail."""
+        if self.key_thumbnail is None or thumbnail.shape != self.key_thumbnail.shape:
+            return float('inf')
+        return float(np.abs(thumbnail - self.key_thumbnail).mean())
+
+    def push(self, name, image, predict, payload=None):
+        """Adds one frame, in order.
+
+        Args:
+            name: frame identifier returned with its prediction.
+            image: HxWx3 RGB image, uint8 or float in [0, 1].
+            predict: callable returning the prediction of this frame; only
+                called for keyframes.
+            payload: anything to hand back with the frame (e.g. the image
+                for visualization).
+
+        Returns:
+            list of (name, payload, prediction) of frames whose prediction is
+            now final, in frame order.
+        """
+        self.num_frames += 1
+        if self.threshold <= 0:
+            return [(name, payload, predict())]
+        thumbnail = self.thumbnail(image)
+        difference = self.difference(thumbnail)
+        if difference < self.threshold and len(self.pending) < self.max_skip:
+            self.num_skipped += 1
+            self.pending.append((name, payload))
+            return []
+
+        prediction = predict()
+        ready = self._resolve(
+            prediction if difference < 2.0 * self.threshold else None
+        )
+        ready.append((name, payload, prediction))
+        self.key_thumbnail = thumbnail
+        self.key_prediction = prediction
+        return ready
+
+    def flush(self):
+        """Resolves the frames left after the last keyframe."""
+        return self._resolve(None)
+
+    def _resolve(self, next_prediction):
+        num = len(self.pending)
+        ready = []
+        for i, (name, payload) in enumerate(self.pending):
+            if next_prediction is None:
+                prediction = self.key_prediction
+            else:
+                weight = (i + 1) / (num + 1)
+                prediction = blend(self.key_prediction, next_prediction, weight)
+            ready.append((name, payload, prediction))
+        self.pending = []
+        return ready
+
+    @property
+    def skip_rate(self):
+        return self.num_skipped / max(self.num_frames, 1)
+
+    def summary(self):
+        return (
+            f'Frame reuse: skipped {self.num_skipped}/{self.num_frames} frames'
+            f' ({100.0 * self.skip_rate:.1f}%), threshold {self.threshold}'
+        )
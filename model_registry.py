@@ -0,0 +1,262 @@
+"""Offline registry of ready-to-run models for the MegaSaM pipeline.
+
+Each stage normally rebuilds its network on every launch: Depth-Anything goes
+through torch.hub, UniDepth through `from_pretrained` and RAFT through a
+DataParallel round trip. The registry stores each model once as a pickled,
+ready-to-run module together with a SHA-256 checksum and a snapshot of any
+torch.hub code it needs, so loading is a single `torch.load(mmap=True)` with
+no network access.
+
+Build the registry on a machine with network access (run from the repo root):
+
+  python model_registry.py build --registry checkpoints/registry \
+      --depth-anything pretrained/depth_anything_vitl14.pth \
+      --raft pretrained/raft-things.pth --unidepth
+
+then copy the directory to the offline nodes and pass `--registry` to
+run_videos.py, demo_mega-sam.py and preprocess_flow.py.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import torch
+
+REPO_ROOT = os.path.dirname(os.path.realpath(__file__))
+MANIFEST = 'registry.json'
+UNIDEPTH_REVISION = '1d0d3c52f60b5164629d279bb9a7546458e6dcc4'
+
+
+def sha256sum(path, chunk_size=1 << 24):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _code_roots(model):
+    """sys.path entries that provide the classes pickled inside `model`."""
+    site_dirs = [os.path.realpath(p) for p in sys.path if 'site-packages' in p]
+    roots = set()
+    for module in model.modules():
+        name = type(module).__module__
+        source = getattr(sys.modules.get(name), '__file__', None)
+        if source is None:
+            continue
+        # Walk up one directory per package level (works for namespace
+        # packages, which have no top-level __init__.py).
+        root = os.path.dirname(os.path.realpath(source))
+        depth = name.count('.')
+        if os.path.basename(source) == '__init__.py':
+            depth += 1
+        for _ in range(depth):
+            root = os.path.dirname(root)
+        if any(root.startswith(d) for d in site_dirs) or root.startswith(
+            os.path.realpath(sys.prefix)
+        ):
+            continue
+        roots.add(root)
+    return sorted(roots)
+
+
+class ModelRegistry:
+    """A directory of serialized modules described by `registry.json`."""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.manifest_path = os.path.join(self.root, MANIFEST)
+        self.models = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.models = json.load(f)['models']
+        self._verified = set()
+
+    def __contains__(self, name):
+        return name in self.models
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'models': self.models}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def register(self, name, model, source=None):
+        """Serializes `model` and records its checksum and code paths."""
+        os.makedirs(self.root, exist_ok=True)
+        model = model.cpu().eval()
+
+        repo_code, code = [], []
+        hub_dir = os.path.realpath(torch.hub.get_dir())
+        for root in _code_roots(model):
+            if root.startswith(hub_dir):
+                # torch.hub checkouts are not available offline: snapshot them.
+                snapshot = os.path.join('code', os.path.basename(root))
+                shutil.copytree(
+                    root,
+                    os.path.join(self.root, snapshot),
+                    dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns('.git', '__pycache__'),
+                )
+                code.append(snapshot)
+            elif root.startswith(REPO_ROOT):
+                repo_code.append(os.path.relpath(root, REPO_ROOT))
+            else:
+                raise ValueError(
+                    f'{name}: code outside the repo and torch.hub: {root}'
+                )
+
+        filename = name + '.pt'
+        path = os.path.join(self.root, filename)
+        torch.save(model, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+        self.models[name] = {
+            'file': filename,
+            'sha256': sha256sum(path),
+            'size': os.path.getsize(path),
+            'code': code,
+            'repo_code': repo_code,
+            'source': source,
+            'torch': torch.__version__,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self._save_manifest()
+        print(f'Registered {name} -> {path}')
+
+    def verify(self, name):
+        """Raises if the stored file of `name` does not match its checksum."""
+        entry = self.models[name]
+        path = os.path.join(self.root, entry['file'])
+        if os.path.getsize(path) != entry['size'] or (
+            sha256sum(path) != entry['sha256']
+        ):
+            raise RuntimeError(f'Checksum mismatch for {name} at {path}')
+        self._verified.add(name)
+
+    def load(self, name, device='cpu', verify=True):
+        """Loads `name` with memory-mapped weights and moves it to `device`."""
+        if name not in self.models:
+            raise KeyError(
+                f'{name} is not in {self.manifest_path};'
+                f' available: {sorted(self.models)}'
+            )
+        entry = self.models[name]
+        if verify and name not in self._verified:
+            self.verify(name)
+
+        paths = [os.path.join(self.root, p) for p in entry['code']]
+        paths += [os.path.join(REPO_ROOT, p) for p in entry['repo_code']]
+        for path in paths:
+            if path not in sys.path:
+                sys.path.append(path)
+
+        model = torch.load(
+            os.path.join(self.root, entry['file']),
+            map_location='cpu',
+            mmap=True,
+            weights_only=False,
+        )
+        return model.to(device).eval()
+
+
+def get_model(name, registry, device=None, verify=True):
+    """Loads `name` from `registry` (a ModelRegistry or its directory)."""
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if not isinstance(registry, ModelRegistry):
+        registry = ModelRegistry(registry)
+    return registry.load(name, device, verify=verify)
+
+
+def build_depth_anything(checkpoint, encoder='vitl', localhub=False):
+    sys.path.append(os.path.join(REPO_ROOT, 'Depth-Anything'))
+    from depth_anything.dpt import DPT_DINOv2  # pylint: disable=g-import-not-at-top
+
+    configs = {
+        'vits': (64, [48, 96, 192, 384]),
+        'vitb': (128, [96, 192, 384, 768]),
+        'vitl': (256, [256, 512, 1024, 1024]),
+    }
+    features, out_channels = configs[encoder]
+    model = DPT_DINOv2(
+        encoder=encoder,
+        features=features,
+        out_channels=out_channels,
+        localhub=localhub,
+    )
+    model.load_state_dict(torch.load(checkpoint, map_location='cpu'), strict=True)
+    return model
+
+
+def build_unidepth(name='lpiccinelli/unidepth-v2-vitl14', revision=UNIDEPTH_REVISION):
+    sys.path.append(os.path.join(REPO_ROOT, 'UniDepth'))
+    from unidepth.models import UniDepthV2  # pylint: disable=g-import-not-at-top
+
+    return UniDepthV2.from_pretrained(name, revision=revision)
+
+
+def build_raft(checkpoint, small=False):
+    sys.path.append(os.path.join(REPO_ROOT, 'cvd_opt', 'core'))
+    from raft import RAFT  # pylint: disable=g-import-not-at-top
+
+    model = RAFT(argparse.Namespace(small=small, mixed_precision=False))
+    state_dict = torch.load(checkpoint, map_location='cpu')
+    # Checkpoints were saved from a DataParallel wrapper.
+    state_dict = {k.replace('module.', '', 1): v for k, v in state_dict.items()}
+    model.load_state_dict(state_dict)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline MegaSaM model registry')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build = sub.add_parser('build', help='serialize models into a registry')
+    build.add_argument('--registry', default='checkpoints/registry')
+    build.add_argument('--depth-anything', help='Depth-Anything checkpoint')
+    build.add_argument('--encoder', default='vitl', choices=['vits', 'vitb', 'vitl'])
+    build.add_argument('--localhub', action='store_true', default=False)
+    build.add_argument('--raft', help='RAFT checkpoint')
+    build.add_argument('--small', action='store_true', help='small RAFT model')
+    build.add_argument('--unidepth', action='store_true', help='add UniDepthV2 ViT-L')
+
+    verify = sub.add_parser('verify', help='check the checksums of a registry')
+    verify.add_argument('--registry', default='checkpoints/registry')
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.registry)
+
+    if args.command == 'verify':
+        for name in sorted(registry.models):
+            registry.verify(name)
+            print(f'{name}: OK')
+        return
+
+    if args.depth_anything:
+        registry.register(
+            f'depth_anything_{args.encoder}',
+            build_depth_anything(args.depth_anything, args.encoder, args.localhub),
+            source=args.depth_anything,
+        )
+    if args.unidepth:
+        registry.register(
+            'unidepth_v2_vitl14',
+            build_unidepth(),
+            source=f'lpiccinelli/unidepth-v2-vitl14@{UNIDEPTH_REVISION}',
+        )
+    if args.raft:
+        registry.register(
+            'raft_small' if args.small else 'raft',
+            build_raft(args.raft, args.small),
+            source=args.raft,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""Int8 CPU inference profiles for the MegaSaM prior networks.
+
+On CPU-only nodes the priors are dominated by the ViT matmuls (DINOv2 in
+Depth-Anything and UniDepthV2) and by the convolutions of the DPT head and
+of the RAFT feature/context encoders. The `int8` profile quantizes:
+
+  - every `nn.Linear` of the ViT backbones (qkv, proj and MLP layers of the
+    blocks) with dynamic int8 quantization, which needs no calibration;
+  - the `nn.Conv2d` layers of the Depth-Anything DPT head and of RAFT's
+    `fnet`/`cnet` encoders with static int8 quantization. These modules
+    have no linear layers, so their activation ranges are calibrated on a
+    few frames of the clip instead.
+
+Quantized kernels only run on CPU. The `report` command compares both
+profiles on a held-out clip (depth AbsRel, fov and flow EPE against fp32,
+plus per-frame timings):
+
+  python quantize_priors.py report --calib-path <clip_a> --img-path <clip_b> \
+      --depth-anything pretrained/depth_anything_vitl14.pth \
+      --raft pretrained/raft-things.pth --unidepth --out int8_report.json
+"""
+
+import argparse
+import copy
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao import quantization
+
+PROFILES = ('fp32', 'int8')
+
+
+class _StaticConv(nn.Sequential):
+    """A conv whose input is quantized and output dequantized on the fly."""
+
+    def __init__(self, conv):
+        super().__init__(quantization.QuantStub(), conv, quantization.DeQuantStub())
+
+
+def quantize_linear(module):
+    """Dynamic int8 quantization of every nn.Linear inside `module`."""
+    return quantization.quantize_dynamic(
+        module, {nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def _wrap_convs(module, qconfig):
+    for name, child in module.named_children():
+        if type(child) is nn.Conv2d:
+            wrapped = _StaticConv(child)
+            wrapped.qconfig = qconfig
+            setattr(module, name, wrapped)
+        else:
+            _wrap_convs(child, qconfig)
+
+
+@torch.no_grad()
+def quantize_convs(modules, calibrate):
+    """Static int8 quantization of the nn.Conv2d layers of `modules`.
+
+    Args:
+        modules: modules to quantize in place.
+        calibrate: callable running the full model on calibration data, so
+            that observers inside `modules` record activation ranges.
+    """
+    qconfig = quantization.get_default_qconfig(torch.backends.quantized.engine)
+    for module in modules:
+        _wrap_convs(module, qconfig)
+        quantization.prepare(module, inplace=True)
+    calibrate()
+    for module in modules:
+        quantization.convert(module, inplace=True)
+
+
+def quantize_depth_anything(model, calib_images):
+    """int8 profile of DPT_DINOv2; `calib_images` are normalized [1,3,H,W]."""
+    model = model.cpu().eval()
+    quantize_linear(model.pretrained)
+    quantize_convs(
+        [model.depth_head], lambda: [model(x) for x in calib_images]
+    )
+    return model
+
+
+def quantize_unidepth(model):
+    """int8 profile of UniDepthV2: dynamic quantization of the ViT encoder."""
+    model = model.cpu().eval()
+    quantize_linear(model.pixel_encoder)
+    return model
+
+
+def quantize_raft(model, calib_pairs, iters=12):
+    """int8 profile of RAFT; `calib_pairs` are ([1,3,H,W], [1,3,H,W]) pairs."""
+    model = model.cpu().eval()
+    quantize_convs(
+        [model.fnet, model.cnet],
+        lambda: [model(a, b, iters=iters, test_mode=True) for a, b in calib_pairs],
+    )
+    return model
+
+
+def _list_images(path):
+    filenames = []
+    for ext in ('png', 'jpg', 'jpeg'):
+        filenames += sorted(glob.glob(os.path.join(path, f'*.{ext}')))
+    return filenames
+
+
+def sample_frames(filenames, num):
+    """`num` evenly spaced filenames (all of them if num <= 0)."""
+    if num <= 0 or num >= len(filenames):
+        return filenames
+    idx = np.linspace(0, len(filenames) - 1, num).round().astype(int)
+    return [filenames[i] for i in idx]
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, (time.perf_counter() - start) * 1000.0
+
+
+def depth_anything_input(filename):
+    """Same 768 preprocessing as Depth-Anything/run_videos.py."""
+    from depth_anything.util.transform import (  # pylint: disable=g-import-not-at-top
+        NormalizeImage,
+        PrepareForNet,
+        Resize,
+    )
+    from torchvision.transforms import Compose  # pylint: disable=g-import-not-at-top
+
+    transform = Compose(
+        [
+            Resize(
+                width=768,
+                height=768,
+                resize_target=False,
+                keep_aspect_ratio=True,
+                ensure_multiple_of=14,
+                resize_method='upper_bound',
+                image_interpolation_method=cv2.INTER_CUBIC,
+            ),
+            NormalizeImage(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+            PrepareForNet(),
+        ]
+    )
+    image = cv2.cvtColor(cv2.imread(filename), cv2.COLOR_BGR2RGB) / 255.0
+    return torch.from_numpy(transform({'image': image})['image'])[None]
+
+
+def unidepth_input(filename, long_dim=640):
+    """Same preprocessing as UniDepth/scripts/demo_mega-sam.py."""
+    rgb = cv2.cvtColor(cv2.imread(filename), cv2.COLOR_BGR2RGB)
+    h, w = rgb.shape[:2]
+    scale = long_dim / max(h, w)
+    rgb = cv2.resize(rgb, (int(round(w * scale)), int(round(h * scale))), cv2.INTER_AREA)
+    return torch.from_numpy(rgb).permute(2, 0, 1)
+
+
+def raft_input(filename):
+    """Same preprocessing as cvd_opt/preprocess_flow.py."""
+    image = cv2.imread(filename)[..., ::-1]
+    h0, w0, _ = image.shape
+    h1 = int(h0 * np.sqrt((384 * 512) / (h0 * w0)))
+    w1 = int(w0 * np.sqrt((384 * 512) / (h0 * w0)))
+    image = cv2.resize(image, (w1, h1))
+    image = image[: h1 - h1 % 8, : w1 - w1 % 8].transpose(2, 0, 1)
+    return torch.as_tensor(np.ascontiguousarray(image)).float()[None]
+
+
+def _abs_rel(pred, ref, min_value=1e-3):
+    valid = ref > min_value
+    return ((pred - ref).abs()[valid] / ref[valid]).mean().item()
+
+
+def _summary(fp32_ms, int8_ms, **metrics):
+    fp32_ms, int8_ms = float(np.mean(fp32_ms)), float(np.mean(int8_ms))
+    metrics = {k: float(np.mean(v)) for k, v in metrics.items()}
+    return {
+        **metrics,
+        'fp32_ms': fp32_ms,
+        'int8_ms': int8_ms,
+        'speedup': fp32_ms / int8_ms,
+    }
+
+
+@torch.no_grad()
+def report_depth_anything(model, calib_files, test_files):
+    model = model.cpu().eval()
+    quantized = quantize_depth_anything(
+        copy.deepcopy(model), [depth_anything_input(f) for f in calib_files]
+    )
+    abs_rel, fp32_ms, int8_ms = [], [], []
+    for filename in test_files:
+        image = depth_anything_input(filename)
+        ref, t_ref = _timed(model, image)
+        pred, t_pred = _timed(quantized, image)
+        abs_rel.append(_abs_rel(pred, ref))
+        fp32_ms.append(t_ref)
+        int8_ms.append(t_pred)
+    return _summary(fp32_ms, int8_ms, disparity_abs_rel=abs_rel)
+
+
+@torch.no_grad()
+def report_unidepth(model, test_files):
+    model = model.cpu().eval()
+    quantized = quantize_unidepth(copy.deepcopy(model))
+    abs_rel, fov_error, fp32_ms, int8_ms = [], [], [], []
+    for filename in test_files:
+        rgb = unidepth_input(filename)
+        ref, t_ref = _timed(model.infer, rgb)
+        pred, t_pred = _timed(quantized.infer, rgb)
+        abs_rel.append(_abs_rel(pred['depth'], ref['depth']))
+        width = rgb.shape[-1]
+        fov = [
+            np.rad2deg(2 * np.arctan(width / (2 * p['intrinsics'][0, 0, 0].item())))
+            for p in (ref, pred)
+        ]
+        fov_error.append(abs(fov[0] - fov[1]))
+        fp32_ms.append(t_ref)
+        int8_ms.append(t_pred)
+    return _summary(fp32_ms, int8_ms, depth_abs_rel=abs_rel, fov_abs_error_deg=fov_error)
+
+
+@torch.no_grad()
+def report_raft(model, calib_files, test_files, iters=22):
+    model = model.cpu().eval()
+    calib = [raft_input(f) for f in calib_files]
+    quantized = quantize_raft(copy.deepcopy(model), list(zip(calib[:-1], calib[1:])))
+    images = [raft_input(f) for f in test_files]
+    epe, fp32_ms, int8_ms = [], [], []
+    for image1, image2 in zip(images[:-1], images[1:]):
+        (_, ref, _), t_ref = _timed(model, image1, image2, iters=iters, test_mode=True)
+        (_, pred, _), t_pred = _timed(
+            quantized, image1, image2, iters=iters, test_mode=True
+        )
+        epe.append(torch.linalg.norm(pred - ref, dim=1).mean().item())
+        fp32_ms.append(t_ref)
+        int8_ms.append(t_pred)
+    return _summary(fp32_ms, int8_ms, flow_epe=epe)
+
+
+def main():
+    from model_registry import (  # pylint: disable=g-import-not-at-top
+        build_depth_anything,
+        build_raft,
+        build_unidepth,
+    )
+
+    parser = argparse.ArgumentParser(description='int8 vs fp32 prior report')
+    sub = parser.add_subparsers(dest='command', required=True)
+    report = sub.add_parser('report', help='compare int8 and fp32 on a clip')
+    report.add_argument('--calib-path', required=True, help='calibration clip')
+    report.add_argument('--img-path', required=True, help='held-out clip')
+    report.add_argument('--calib-frames', type=int, default=8)
+    report.add_argument('--frames', type=int, default=16)
+    report.add_argument('--depth-anything', help='Depth-Anything checkpoint')
+    report.add_argument('--encoder', default='vitl', choices=['vits', 'vitb', 'vitl'])
+    report.add_argument('--localhub', action='store_true', default=False)
+    report.add_argument('--raft', help='RAFT checkpoint')
+    report.add_argument('--small', action='store_true', help='small RAFT model')
+    report.add_argument('--unidepth', action='store_true', help='UniDepthV2 ViT-L')
+    report.add_argument('--out', default='int8_report.json')
+    args = parser.parse_args()
+
+    calib_files = sample_frames(_list_images(args.calib_path), args.calib_frames)
+    test_files = sample_frames(_list_images(args.img_path), args.frames)
+    results = {
+        'calib_path': args.calib_path,
+        'img_path': args.img_path,
+        'calib_frames': len(calib_files),
+        'frames': len(test_files),
+        'num_threads': torch.get_num_threads(),
+        'engine': torch.backends.quantized.engine,
+    }
+    if args.depth_anything:
+        model = build_depth_anything(args.depth_anything, args.encoder, args.localhub)
+        results['depth_anything'] = report_depth_anything(model, calib_files, test_files)
+    if args.unidepth:
+        results['unidepth'] = report_unidepth(build_unidepth(), test_files)
+    if args.raft:
+        model = build_raft(args.raft, args.small)
+        results['raft'] = report_raft(model, calib_files, test_files)
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
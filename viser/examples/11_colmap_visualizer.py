@@ -25,6 +25,7 @@ def main(
     colmap_path: Path = Path(__file__).parent / "assets/colmap_garden/sparse/0",
     images_path: Path = Path(__file__).parent / "assets/colmap_garden/images_8",
     downsample_factor: int = 2,
+    lod: bool = False,
 ) -> None:
     """Visualize COLMAP sparse reconstruction outputs.
 
@@ -32,6 +33,8 @@ def main(
         colmap_path: Path to the COLMAP reconstruction directory.
         images_path: Path to the COLMAP images directory.
         downsample_factor: Downsample factor for the images.
+        lod: Send all points as a level-of-detail point cloud, which streams octree
+            nodes to the browser as the camera moves. "Max points" is then ignored.
     """
     server = viser.ViserServer()
     server.gui.configure_theme(titlebar_content=None, control_layout="collapsible")
@@ -59,6 +62,7 @@ def main(
         max=len(points3d),
         step=1,
         initial_value=min(len(points3d), 50_000),
+        disabled=lod,
     )
     gui_frames = server.gui.add_slider(
         "Max frames",
@@ -75,18 +79,23 @@ def main(
         # Set the point cloud.
         points = onp.array([points3d[p_id].xyz for p_id in points3d])
         colors = onp.array([points3d[p_id].rgb for p_id in points3d])
-        points_selection = onp.random.choice(
-            points.shape[0], gui_points.value, replace=False
-        )
-        points = points[points_selection]
-        colors = colors[points_selection]
-
-        server.scene.add_point_cloud(
-            name="/colmap/pcd",
-            points=points,
-            colors=colors,
-            point_size=gui_point_size.value,
-        )
+        if lod:
+            server.scene.add_point_cloud_lod(
+                name="/colmap/pcd",
+                points=points,
+                colors=colors,
+                point_size=gui_point_size.value,
+            )
+        else:
+            points_selection = onp.random.choice(
+                points.shape[0], gui_points.value, replace=False
+            )
+            server.scene.add_point_cloud(
+                name="/colmap/pcd",
+                points=points[points_selection],
+                colors=colors[points_selection],
+                point_size=gui_point_size.value,
+            )
 
         # Interpret the images and cameras.
         img_ids = [im.id for im in images.values()]
@@ -1,12 +1,16 @@
 """Record3D visualizer
 
 Batch process Record3D captures to generate recordings for multiple data folders.
+
+Recordings are built with `viser.SceneRecorder`, which doesn't start a server, and
+folders are processed in parallel: one recording per worker process.
 """
 
-import time
-import sys
 import os
 import argparse
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import numpy as onp
@@ -30,11 +34,16 @@ def process_folder(
     axes_scale: float,
     bg_downsample_factor: int,
     output_dir: Path,
-) -> None:
+    show_progress: bool = True,
+) -> Path:
     print(f"Processing folder: {data_path}")
 
-    server = viser.ViserServer()
-    server.scene.set_up_direction('-z')
+    # Record straight to the output file, without starting a server
+    output_path = output_dir / f"recording_{data_path.name}.viser"
+    # Ensure the output directory exists
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    recorder = viser.SceneRecorder(output_path)
+    recorder.scene.set_up_direction('-z')
 
     loader = viser.extras.Record3dLoader_Customized(
         data_path,
@@ -47,7 +56,7 @@ def process_folder(
     num_frames = min(max_frames, loader.num_frames())
 
     # Load frames
-    server.scene.add_frame(
+    recorder.scene.add_frame(
         "/frames",
         wxyz=tf.SO3.exp(onp.array([onp.pi / 2.0, 0.0, 0.0])).wxyz,
         position=(0, 0, 0),
@@ -56,7 +65,7 @@ def process_folder(
     frame_nodes: list[viser.FrameHandle] = []
     bg_positions = []
     bg_colors = []
-    for i in tqdm(range(num_frames)):
+    for i in tqdm(range(num_frames), disable=not show_progress):
         frame = loader.get_frame(i)
         position, color, bg_position, bg_color = frame.get_point_cloud(downsample_factor, bg_downsample_factor)
 
@@ -64,10 +73,10 @@ def process_folder(
         bg_colors.append(bg_color)
 
         # Add base frame
-        frame_nodes.append(server.scene.add_frame(f"/frames/t{i}", show_axes=False))
+        frame_nodes.append(recorder.scene.add_frame(f"/frames/t{i}", show_axes=False))
 
         # Place the point cloud in the frame
-        server.scene.add_point_cloud(
+        recorder.scene.add_point_cloud(
             name=f"/frames/t{i}/point_cloud",
             points=position,
             colors=color,
@@ -83,7 +92,7 @@ def process_folder(
         # Place the frustum with the computed color
         fov = 2 * onp.arctan2(frame.rgb.shape[0] / 2, frame.K[0, 0])
         aspect = frame.rgb.shape[1] / frame.rgb.shape[0]
-        server.scene.add_camera_frustum(
+        recorder.scene.add_camera_frustum(
             f"/frames/t{i}/frustum",
             fov=fov,
             aspect=aspect,
@@ -95,7 +104,7 @@ def process_folder(
         )
 
         # Add axes
-        server.scene.add_frame(
+        recorder.scene.add_frame(
             f"/frames/t{i}/frustum/axes",
             axes_length=camera_frustum_scale * axes_scale * 10,
             axes_radius=camera_frustum_scale * axes_scale,
@@ -104,7 +113,7 @@ def process_folder(
     # Add background frame
     bg_positions = onp.concatenate(bg_positions, axis=0)
     bg_colors = onp.concatenate(bg_colors, axis=0)
-    server.scene.add_point_cloud(
+    recorder.scene.add_point_cloud(
         name=f"/frames/background",
         points=bg_positions,
         colors=bg_colors,
@@ -113,34 +122,33 @@ def process_folder(
     )
 
     # Automatically play through frames and record the scene
-    rec = server._start_scene_recording()
-    rec.set_loop_start()
+    recorder.set_loop_start()
 
     sleep_duration = 1.0 / loader.fps if loader.fps > 0 else 0.033  # Default to ~30 FPS
 
     for t in range(num_frames):
         # Update the scene to show frame t
-        with server.atomic():
+        with recorder.atomic():
             for i, frame_node in enumerate(frame_nodes):
                 frame_node.visible = (i == t)
-        server.flush()
-        rec.insert_sleep(sleep_duration)
+        recorder.flush()
+        recorder.insert_sleep(sleep_duration)
 
     # Set all frames invisible
-    with server.atomic():
+    with recorder.atomic():
         for frame_node in frame_nodes:
             frame_node.visible = False
-    server.flush()
+    recorder.flush()
 
     # Finish recording
-    bs = rec.end_and_serialize()
-
-    # Save the recording to a file
-    output_path = output_dir / f"recording_{data_path.name}.viser"
-    # Ensure the output directory exists
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    output_path.write_bytes(bs)
+    recorder.end()
     print(f"Recording saved to {output_path.resolve()}")
+    return output_path
+
+def _report_failures(failed: list[Path], num_folders: int) -> None:
+    if len(failed) > 0:
+        print(f"{len(failed)} of {num_folders} folders failed: {[str(p) for p in failed]}")
+
 
 def main(
     data_paths: list[Path],
@@ -155,29 +163,62 @@ def main(
     xyzw: bool = True,
     axes_scale: float = 0.25,
     bg_downsample_factor: int = 1,
+    num_workers: int = 4,
 ) -> None:
     # if data_path[0] has subfolders, process each subfolder
+    new_data_paths = []
     if data_paths[0].is_dir():
         new_data_paths = sorted([subfolder for subfolder in data_paths[0].iterdir() if subfolder.is_dir()])
     
     if len(new_data_paths) > 0:
         data_paths = new_data_paths
 
-    for data_path in data_paths:
-        process_folder(
-            data_path,
-            downsample_factor,
-            max_frames,
-            conf_threshold,
-            foreground_conf_threshold,
-            point_size,
-            camera_frustum_scale,
-            no_mask,
-            xyzw,
-            axes_scale,
-            bg_downsample_factor,
-            output_dir,
-        )
+    args = (
+        downsample_factor,
+        max_frames,
+        conf_threshold,
+        foreground_conf_threshold,
+        point_size,
+        camera_frustum_scale,
+        no_mask,
+        xyzw,
+        axes_scale,
+        bg_downsample_factor,
+        output_dir,
+    )
+    num_workers = max(1, min(num_workers, len(data_paths)))
+    failed = []
+    if num_workers == 1:
+        for data_path in data_paths:
+            try:
+                process_folder(data_path, *args)
+            except Exception:
+                # Keep exporting the other folders
+                failed.append(data_path)
+                print(f"Failed to process {data_path}:")
+                traceback.print_exc()
+        _report_failures(failed, len(data_paths))
+        return
+
+    # One folder, and one recording, per task. Spawn fresh workers rather than
+    # forking a process that may already have threads running.
+    with ProcessPoolExecutor(
+        max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {
+            executor.submit(process_folder, data_path, *args, show_progress=False): data_path
+            for data_path in data_paths
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Recordings"):
+            try:
+                future.result()
+            except Exception:
+                # Keep exporting the other folders
+                failed.append(futures[future])
+                print(f"Failed to process {futures[future]}:")
+                traceback.print_exc()
+
+    _report_failures(failed, len(data_paths))
 
 if __name__ == "__main__":
     # Initialize parser
@@ -255,6 +296,12 @@ if __name__ == "__main__":
         default=100,
         help="Maximum number of frames to process",
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=min(4, os.cpu_count() or 1),
+        help="Number of folders to process in parallel, default is min(4, CPU count)",
+    )
 
     # Parse arguments
     args = parser.parse_args()
@@ -273,4 +320,5 @@ if __name__ == "__main__":
         bg_downsample_factor=args.bg_downsample,
         downsample_factor=args.downsample,
         max_frames=args.max_frames,
+        num_workers=args.num_workers,
     )
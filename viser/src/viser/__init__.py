@@ -21,6 +21,7 @@ from ._scene_handles import GlbHandle as GlbHandle
 from ._scene_handles import Gui3dContainerHandle as Gui3dContainerHandle
 from ._scene_handles import ImageHandle as ImageHandle
 from ._scene_handles import LabelHandle as LabelHandle
+from ._scene_handles import LodPointCloudHandle as LodPointCloudHandle
 from ._scene_handles import MeshHandle as MeshHandle
 from ._scene_handles import MeshSkinnedBoneHandle as MeshSkinnedBoneHandle
 from ._scene_handles import MeshSkinnedHandle as MeshSkinnedHandle
@@ -31,4 +32,5 @@ from ._scene_handles import ScenePointerEvent as ScenePointerEvent
 from ._scene_handles import TransformControlsHandle as TransformControlsHandle
 from ._viser import CameraHandle as CameraHandle
 from ._viser import ClientHandle as ClientHandle
+from ._viser import SceneRecorder as SceneRecorder
 from ._viser import ViserServer as ViserServer
@@ -6,10 +6,12 @@ from __future__ import annotations
 import dataclasses
 import uuid
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     ClassVar,
     Dict,
+    List,
     Optional,
     Tuple,
     Type,
@@ -23,6 +25,9 @@ from typing_extensions import Annotated, Literal, NotRequired, TypedDict, overri
 
 from . import infra, theme
 
+if TYPE_CHECKING:
+    from ._point_cloud_lod import PointCloudOctree
+
 GuiSliderMark = TypedDict("GuiSliderMark", {"value": float, "label": NotRequired[str]})
 Color = Literal[
     "dark",
@@ -67,6 +72,11 @@ class Message(infra.Message):
 
         return "_".join(parts)
 
+    @override
+    def purge_key(self) -> Optional[str]:
+        # Scene node messages are purged when their node is removed.
+        return getattr(self, "name", None)
+
 
 T = TypeVar("T", bound=Type[Message])
 
@@ -275,6 +285,236 @@ class PointCloudMessage(Message):
         assert self.colors.dtype == onp.uint8
 
 
+@dataclasses.dataclass
+class CompactPointCloudMessage(Message):
+    """Point cloud message with quantized positions and compact colors.
+
+    Positions are int16, relative to the center of the cloud's bounding box:
+    `point = center + points * scale`. Colors depend on `color_encoding`: a single
+    RGB triplet (`uniform`), per-point RGB (`rgb`), per-point uint8 indices into
+    `palette` (`palette`), or per-point uint16 RGB565 (`rgb565`).
+
+    Sent instead of `PointCloudMessage` to clients with `client_api_version >= 2`;
+    older clients receive the decoded `PointCloudMessage`."""
+
+    name: str
+    points: onpt.NDArray[onp.int16]
+    center: Tuple[float, float, float]
+    scale: Tuple[float, float, float]
+    color_encoding: Literal["uniform", "rgb", "palette", "rgb565"]
+    colors: onpt.NDArray[onp.uint8]
+    palette: Optional[onpt.NDArray[onp.uint8]]
+    point_size: float
+    point_ball_norm: float
+
+    @staticmethod
+    def encode(
+        name: str,
+        points: onpt.NDArray[onp.float32],
+        colors: onpt.NDArray[onp.uint8],
+        point_size: float,
+        point_ball_norm: float,
+        rgb565: bool = False,
+    ) -> CompactPointCloudMessage:
+        """Quantize a point cloud. `colors` has shape (N, 3) or (3,).
+
+        Uniform colors and clouds with at most 256 distinct colors are encoded
+        losslessly; other colors are sent as RGB, or RGB565 if `rgb565` is set."""
+        assert len(points.shape) == 2 and points.shape[-1] == 3
+        lower = points.min(axis=0) if len(points) > 0 else onp.zeros(3)
+        upper = points.max(axis=0) if len(points) > 0 else onp.zeros(3)
+        center = (lower + upper) / 2.0
+        scale = onp.maximum((upper - lower) / 2.0, 1e-12) / 32767.0
+        quantized = onp.round((points - center) / scale)
+        quantized = onp.clip(quantized, -32767, 32767).astype(onp.int16)
+
+        palette = None
+        if colors.shape == (3,) or (len(colors) > 0 and (colors == colors[0]).all()):
+            color_encoding = "uniform"
+            colors = colors.reshape(-1, 3)[:1].reshape(3)
+        else:
+            packed = (
+                colors[:, 0].astype(onp.uint32) << 16
+                | colors[:, 1].astype(onp.uint32) << 8
+                | colors[:, 2].astype(onp.uint32)
+            )
+            unique, indices = onp.unique(packed, return_inverse=True)
+            if len(unique) <= 256:
+                color_encoding = "palette"
+                palette = onp.stack(
+                    [unique >> 16, (unique >> 8) & 0xFF, unique & 0xFF], axis=-1
+                ).astype(onp.uint8)
+                colors = indices.reshape(-1).astype(onp.uint8)
+            elif rgb565:
+                color_encoding = "rgb565"
+                colors = (
+                    (colors[:, 0].astype(onp.uint16) >> 3) << 11
+                    | (colors[:, 1].astype(onp.uint16) >> 2) << 5
+                    | colors[:, 2].astype(onp.uint16) >> 3
+                ).view(onp.uint8)
+            else:
+                color_encoding = "rgb"
+
+        return CompactPointCloudMessage(
+            name=name,
+            points=quantized,
+            center=tuple(center.tolist()),  # type: ignore
+            scale=tuple(scale.tolist()),  # type: ignore
+            color_encoding=color_encoding,
+            colors=colors,
+            palette=palette,
+            point_size=point_size,
+            point_ball_norm=point_ball_norm,
+        )
+
+    def decode(self) -> PointCloudMessage:
+        """Equivalent float32 message, for clients without compact decoding."""
+        points = (
+            onp.asarray(self.center, dtype=onp.float32)
+            + self.points.astype(onp.float32) * onp.asarray(self.scale, onp.float32)
+        ).astype(onp.float32)
+        num_points = points.shape[0]
+        if self.color_encoding == "uniform":
+            colors = onp.tile(self.colors.reshape(1, 3), (num_points, 1))
+        elif self.color_encoding == "palette":
+            assert self.palette is not None
+            colors = self.palette[self.colors]
+        elif self.color_encoding == "rgb565":
+            packed = self.colors.view(onp.uint16)
+            colors = onp.stack(
+                [
+                    (packed >> 11) * 255 // 31,
+                    ((packed >> 5) & 0x3F) * 255 // 63,
+                    (packed & 0x1F) * 255 // 31,
+                ],
+                axis=-1,
+            ).astype(onp.uint8)
+        else:
+            colors = self.colors
+        return PointCloudMessage(
+            name=self.name,
+            points=points,
+            colors=colors,
+            point_size=self.point_size,
+            point_ball_norm=self.point_ball_norm,
+        )
+
+    @override
+    def redundancy_key(self) -> str:
+        # Replaces (and is replaced by) a float32 cloud with the same name.
+        return "PointCloudMessage_" + self.name
+
+    @override
+    def for_client_api_version(self, client_api_version: int) -> Message:
+        return self if client_api_version >= 2 else self.decode()
+
+
+@dataclasses.dataclass
+class LodPointCloudMessage(Message):
+    """Point cloud drawn with octree level-of-detail.
+
+    Carries the octree hierarchy (see `PointCloudOctree`) and the points of the
+    root node. The client draws the nodes that are in view and whose point
+    spacing projects to more than `error_threshold` pixels, up to
+    `point_budget` points, and requests the points of other nodes with
+    `LodPointCloudRequestMessage`.
+
+    Sent to clients with `client_api_version >= 3`; older clients receive the
+    full point cloud as a `PointCloudMessage`. Recordings, which are played back
+    without a server to request nodes from, include the points of every node."""
+
+    name: str
+    centers: onpt.NDArray[onp.float32]
+    half_sizes: onpt.NDArray[onp.float32]
+    parents: onpt.NDArray[onp.int32]
+    errors: onpt.NDArray[onp.float32]
+    num_points: onpt.NDArray[onp.uint32]
+    root_points: onpt.NDArray[onp.int16]
+    """Root node points; decoded like `LodPointCloudChunkMessage.points`."""
+    root_colors: onpt.NDArray[onp.uint8]
+    point_size: float
+    point_ball_norm: float
+    error_threshold: float
+    point_budget: int
+
+    def __post_init__(self) -> None:
+        self._octree: Optional[PointCloudOctree] = None
+        """Octree of the full point cloud, for fallbacks. Set by the server;
+        not serialized."""
+
+    @override
+    def for_client_api_version(self, client_api_version: int) -> Message:
+        if client_api_version >= 3:
+            return self
+        if self._octree is not None:
+            return PointCloudMessage(
+                name=self.name,
+                points=self._octree.points,
+                colors=self._octree.colors,
+                point_size=self.point_size,
+                point_ball_norm=self.point_ball_norm,
+            )
+        points = (
+            self.centers[0]
+            + self.root_points.astype(onp.float32) * (self.half_sizes[0] / 32767.0)
+        ).astype(onp.float32)
+        return PointCloudMessage(
+            name=self.name,
+            points=points.reshape(-1, 3),
+            colors=self.root_colors.reshape(-1, 3),
+            point_size=self.point_size,
+            point_ball_norm=self.point_ball_norm,
+        )
+
+    @override
+    def buffered_nbytes(self) -> int:
+        nbytes = super().buffered_nbytes()
+        if self._octree is not None:
+            nbytes += self._octree.points.nbytes + self._octree.colors.nbytes
+        return nbytes
+
+    @override
+    def for_recording(self) -> List[Message]:
+        out: List[Message] = [self]
+        if self._octree is None:
+            return out
+        for node in range(1, self._octree.num_nodes()):
+            points, colors = self._octree.chunk(node)
+            if len(points) > 0:
+                out.append(
+                    LodPointCloudChunkMessage(
+                        name=self.name, node=node, points=points, colors=colors
+                    )
+                )
+        return out
+
+
+@dataclasses.dataclass
+class LodPointCloudChunkMessage(Message):
+    """Points of one octree node of a level-of-detail point cloud.
+
+    Positions are int16 within the node's cube:
+    `point = centers[node] + points * half_sizes[node] / 32767`."""
+
+    name: str
+    node: int
+    points: onpt.NDArray[onp.int16]
+    colors: onpt.NDArray[onp.uint8]
+
+    @override
+    def redundancy_key(self) -> str:
+        return f"{type(self).__name__}_{self.name}_{self.node}"
+
+
+@dataclasses.dataclass
+class LodPointCloudRequestMessage(Message):
+    """Message from client->server requesting octree nodes of a level-of-detail
+    point cloud."""
+
+    name: str
+    nodes: Tuple[int, ...]
+
+
 @dataclasses.dataclass
 class MeshBoneMessage(Message):
     """Message for a bone of a skinned mesh."""
@@ -468,6 +708,12 @@ class RemoveSceneNodeMessage(Message):
 
     name: str
 
+    @override
+    def purged_keys(self) -> Optional[Callable[[str], bool]]:
+        # Clients remove a node together with its descendants.
+        prefix = self.name + "/"
+        return lambda key: key == self.name or key.startswith(prefix)
+
 
 @dataclasses.dataclass
 class SetSceneNodeVisibilityMessage(Message):
@@ -501,6 +747,10 @@ class SceneNodeClickMessage(Message):
 class ResetSceneMessage(Message):
     """Reset scene."""
 
+    @override
+    def purged_keys(self) -> Optional[Callable[[str], bool]]:
+        return lambda key: True
+
 
 @dataclasses.dataclass
 class ResetGuiMessage(Message):
@@ -0,0 +1,156 @@
+"""Octree level-of-detail hierarchy for large point clouds."""
+
+from __future__ import annotations
+
+import collections
+import dataclasses
+
+import numpy as onp
+import numpy.typing as onpt
+
+
+@dataclasses.dataclass(frozen=True)
+class PointCloudOctree:
+    """Octree over a point cloud, with additive level-of-detail.
+
+    Each node owns a random subset of the points inside its cube, at most
+    `max_points_per_node` of them; the remaining points are split among its
+    eight children. Drawing a node and all of its ancestors therefore gives a
+    uniformly subsampled view of the node's cube, and every input point is
+    owned by exactly one node.
+
+    Nodes are stored in breadth-first order, with the root at index 0. The
+    points owned by node `i` are `points[offsets[i]:offsets[i + 1]]`."""
+
+    centers: onpt.NDArray[onp.float32]
+    """Cube centers. Shape (M, 3)."""
+    half_sizes: onpt.NDArray[onp.float32]
+    """Cube half side lengths. Shape (M,)."""
+    parents: onpt.NDArray[onp.int32]
+    """Parent node indices, -1 for the root. Shape (M,)."""
+    errors: onpt.NDArray[onp.float32]
+    """Approximate point spacing of each node, i.e. the geometric error of
+    drawing a node without its descendants. Shape (M,)."""
+    offsets: onpt.NDArray[onp.int64]
+    """Point ranges of each node. Shape (M + 1,)."""
+    points: onpt.NDArray[onp.float32]
+    """Points, grouped by node. Shape (N, 3)."""
+    colors: onpt.NDArray[onp.uint8]
+    """Colors, grouped by node. Shape (N, 3)."""
+
+    @staticmethod
+    def build(
+        points: onpt.NDArray[onp.float32],
+        colors: onpt.NDArray[onp.uint8],
+        max_points_per_node: int = 32768,
+        max_depth: int = 16,
+        seed: int = 0,
+    ) -> PointCloudOctree:
+        """Build an octree over (N, 3) points and (N, 3) uint8 colors.
+
+        Nodes at `max_depth` own all of their points, which bounds the depth
+        for clusters of (nearly) duplicate points."""
+        assert len(points.shape) == 2 and points.shape[-1] == 3
+        assert colors.shape == points.shape
+        assert max_points_per_node > 0
+        points = points.astype(onp.float32)
+
+        if len(points) > 0:
+            lower = points.min(axis=0)
+            upper = points.max(axis=0)
+        else:
+            lower = upper = onp.zeros(3, dtype=onp.float32)
+        root_center = (lower + upper) / 2.0
+        root_half_size = max(float((upper - lower).max()) / 2.0, 1e-6) * (1.0 + 1e-6)
+
+        # Randomly ordered indices: the first points of any node's index list
+        # are then a uniform sample of the points inside it.
+        order = onp.random.default_rng(seed).permutation(len(points))
+
+        centers: list[onpt.NDArray[onp.float32]] = []
+        half_sizes: list[float] = []
+        parents: list[int] = []
+        owned: list[onpt.NDArray[onp.int64]] = []
+        queue = collections.deque([(order, root_center, root_half_size, -1, 0)])
+        while len(queue) > 0:
+            indices, center, half_size, parent, depth = queue.popleft()
+            node = len(centers)
+            centers.append(center)
+            half_sizes.append(half_size)
+            parents.append(parent)
+            if depth == max_depth:
+                owned.append(indices)
+                continue
+            owned.append(indices[:max_points_per_node])
+
+            rest = indices[max_points_per_node:]
+            if len(rest) == 0:
+                continue
+            octants = (
+                (points[rest, 0] > center[0]).astype(onp.int64)
+                | (points[rest, 1] > center[1]).astype(onp.int64) << 1
+                | (points[rest, 2] > center[2]).astype(onp.int64) << 2
+            )
+            # A stable sort keeps the random order inside each child.
+            sort = onp.argsort(octants, kind="stable")
+            rest = rest[sort]
+            bounds = onp.searchsorted(octants[sort], onp.arange(9))
+            for octant in range(8):
+                child = rest[bounds[octant] : bounds[octant + 1]]
+                if len(child) == 0:
+                    continue
+                sign = onp.array(
+                    [1.0 if octant & (1 << axis) else -1.0 for axis in range(3)],
+                    dtype=onp.float32,
+                )
+                queue.append(
+                    (
+                        child,
+                        center + sign * half_size / 2.0,
+                        half_size / 2.0,
+                        node,
+                        depth + 1,
+                    )
+                )
+
+        counts = onp.array([len(i) for i in owned], dtype=onp.int64)
+        offsets = onp.concatenate([[0], onp.cumsum(counts)]).astype(onp.int64)
+        grouped = onp.concatenate(owned) if len(owned) > 0 else order
+        half_sizes_arr = onp.array(half_sizes, dtype=onp.float32)
+        return PointCloudOctree(
+            centers=onp.array(centers, dtype=onp.float32).reshape(-1, 3),
+            half_sizes=half_sizes_arr,
+            parents=onp.array(parents, dtype=onp.int32),
+            # Points are mostly samples of surfaces, so spacing goes with the
+            # square root of the point count.
+            errors=(2.0 * half_sizes_arr / onp.sqrt(onp.maximum(counts, 1))).astype(
+                onp.float32
+            ),
+            offsets=offsets,
+            points=points[grouped],
+            colors=colors[grouped],
+        )
+
+    def num_nodes(self) -> int:
+        return len(self.parents)
+
+    def num_points(self) -> onpt.NDArray[onp.int64]:
+        """Number of points owned by each node. Shape (M,)."""
+        return onp.diff(self.offsets)
+
+    def chunk(
+        self, node: int
+    ) -> tuple[onpt.NDArray[onp.int16], onpt.NDArray[onp.uint8]]:
+        """Points of a node quantized to int16 within its cube, with their colors.
+
+        Points are decoded as `center + quantized * half_size / 32767`."""
+        start, end = self.offsets[node], self.offsets[node + 1]
+        quantized = onp.round(
+            (self.points[start:end] - self.centers[node])
+            / self.half_sizes[node]
+            * 32767.0
+        )
+        return (
+            onp.clip(quantized, -32767, 32767).astype(onp.int16),
+            self.colors[start:end],
+        )
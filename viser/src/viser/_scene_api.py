@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import hashlib
 import io
+import threading
 import time
 import warnings
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import TYPE_CHECKING, Callable, Tuple, TypeVar, Union, cast, get_args
 
 import imageio.v3 as iio
@@ -13,6 +16,7 @@ from typing_extensions import Literal, ParamSpec, TypeAlias, assert_never
 
 from . import _messages
 from . import transforms as tf
+from ._point_cloud_lod import PointCloudOctree
 from ._scene_handles import (
     BatchedAxesHandle,
     BoneState,
@@ -23,6 +27,7 @@ from ._scene_handles import (
     Gui3dContainerHandle,
     ImageHandle,
     LabelHandle,
+    LodPointCloudHandle,
     MeshHandle,
     MeshSkinnedBoneHandle,
     MeshSkinnedHandle,
@@ -34,11 +39,12 @@ from ._scene_handles import (
     _SceneNodeHandleState,
     _TransformControlsState,
 )
+from .infra._messages import DeferredBytes
 
 if TYPE_CHECKING:
     import trimesh
 
-    from ._viser import ClientHandle, ViserServer
+    from ._viser import ClientHandle, SceneRecorder, ViserServer
     from .infra import ClientId
 
 
@@ -72,13 +78,31 @@ def _encode_rgb(rgb: RgbTupleOrArray) -> int:
     return int(rgb_fixed[0] * (256**2) + rgb_fixed[1] * 256 + rgb_fixed[2])
 
 
-def _encode_image_binary(
+def _downscale_image(image: onp.ndarray, max_size: int) -> onp.ndarray:
+    """Downscale a uint8 image by an integer factor, averaging blocks of pixels, so
+    that its longest side is at most `max_size`."""
+    assert max_size > 0
+    height, width = image.shape[:2]
+    factor = -(-max(height, width) // max_size)
+    if factor <= 1:
+        return image
+    out_height, out_width = height // factor, width // factor
+    blocks = image[: out_height * factor, : out_width * factor].reshape(
+        (out_height, factor, out_width, factor, *image.shape[2:])
+    )
+    return (blocks.mean(axis=(1, 3)) + 0.5).astype(onp.uint8)
+
+
+def _encode_image_binary_uncached(
     image: onp.ndarray,
     format: Literal["png", "jpeg"],
-    jpeg_quality: int | None = None,
+    jpeg_quality: int | None,
+    max_size: int | None,
 ) -> tuple[Literal["image/png", "image/jpeg"], bytes]:
     media_type: Literal["image/png", "image/jpeg"]
     image = _colors_to_uint8(image)
+    if max_size is not None:
+        image = _downscale_image(image, max_size)
     with io.BytesIO() as data_buffer:
         if format == "png":
             media_type = "image/png"
@@ -97,6 +121,135 @@ def _encode_image_binary(
     return media_type, binary
 
 
+class _EncodedImageCache:
+    """LRU cache of encoded images, keyed by a hash of the image contents and the
+    encoding options. Shared by every scene API, because the same frames are
+    often sent to each client and again on every playback loop.
+
+    The first caller to request an image encodes it on its own thread; for scene
+    messages, that's a serialization thread (see `_deferred_image_binary()`).
+    Concurrent requests for the same image wait for that result instead of
+    encoding it again."""
+
+    def __init__(self, max_nbytes: int) -> None:
+        self._max_nbytes = max_nbytes
+        self._lock = threading.Lock()
+        self._future_from_key: OrderedDict[
+            bytes, Future[tuple[Literal["image/png", "image/jpeg"], bytes]]
+        ] = OrderedDict()
+        self._nbytes_from_key: dict[bytes, int] = {}
+        self._nbytes = 0
+
+    def encode(
+        self,
+        image: onp.ndarray,
+        format: Literal["png", "jpeg"],
+        jpeg_quality: int | None,
+        max_size: int | None,
+    ) -> tuple[Literal["image/png", "image/jpeg"], bytes]:
+        image = onp.ascontiguousarray(image)
+        # Used as a fast content hash, not for security.
+        hasher = hashlib.sha1(image)
+        hasher.update(
+            repr(
+                (image.shape, image.dtype.str, format, jpeg_quality, max_size)
+            ).encode()
+        )
+        key = hasher.digest()
+
+        with self._lock:
+            future = self._future_from_key.get(key, None)
+            is_owner = future is None
+            if future is None:
+                future = Future()
+                self._future_from_key[key] = future
+            else:
+                self._future_from_key.move_to_end(key)
+
+        try:
+            if is_owner:
+                try:
+                    future.set_result(
+                        _encode_image_binary_uncached(
+                            image, format, jpeg_quality, max_size
+                        )
+                    )
+                except BaseException as e:
+                    future.set_exception(e)
+            media_type, binary = future.result()
+        except BaseException:
+            with self._lock:
+                if self._future_from_key.get(key, None) is future:
+                    self._future_from_key.pop(key)
+            raise
+
+        with self._lock:
+            if (
+                self._future_from_key.get(key, None) is future
+                and key not in self._nbytes_from_key
+            ):
+                self._nbytes_from_key[key] = len(binary)
+                self._nbytes += len(binary)
+                # Evict the least recently used images. Images that are still
+                # being encoded have no size yet, and are skipped.
+                for old_key in tuple(self._future_from_key.keys()):
+                    if self._nbytes <= self._max_nbytes:
+                        break
+                    if old_key == key or old_key not in self._nbytes_from_key:
+                        continue
+                    self._future_from_key.pop(old_key)
+                    self._nbytes -= self._nbytes_from_key.pop(old_key)
+        return media_type, binary
+
+
+_encoded_image_cache = _EncodedImageCache(max_nbytes=128 * 1024 * 1024)
+
+
+def _encode_image_binary(
+    image: onp.ndarray,
+    format: Literal["png", "jpeg"],
+    jpeg_quality: int | None = None,
+    max_size: int | None = None,
+) -> tuple[Literal["image/png", "image/jpeg"], bytes]:
+    """Encode an image as PNG or JPEG. Results are cached, so sending the same
+    image again doesn't encode it again.
+
+    If `max_size` is set, the image is first downscaled so its longest side is at
+    most `max_size` pixels."""
+    return _encoded_image_cache.encode(image, format, jpeg_quality, max_size)
+
+
+def _deferred_image_binary(
+    image: onp.ndarray,
+    format: Literal["png", "jpeg"],
+    jpeg_quality: int | None = None,
+    max_size: int | None = None,
+) -> tuple[Literal["image/png", "image/jpeg"], bytes]:
+    """Like `_encode_image_binary()`, but the image is hashed and encoded when the
+    message carrying it is serialized, on the server's thread executor, instead of
+    on the calling thread. The image is copied, so callers can reuse their array.
+
+    The returned bytes are a `DeferredBytes`, which messages serialize in place of
+    a `bytes` field."""
+    media_type: Literal["image/png", "image/jpeg"]
+    if format == "png":
+        media_type = "image/png"
+    elif format == "jpeg":
+        media_type = "image/jpeg"
+    else:
+        assert_never(format)
+
+    image = onp.array(image)
+    assert image.ndim == 2 or (
+        image.ndim == 3 and image.shape[2] in (1, 3, 4)
+    ), "Images should have shape (H, W), (H, W, 1), (H, W, 3), or (H, W, 4)."
+
+    def encode() -> bytes:
+        return _encode_image_binary(image, format, jpeg_quality, max_size)[1]
+
+    return media_type, cast(bytes, DeferredBytes(encode, nbytes=image.nbytes))
+
+
 TVector = TypeVar("TVector", bound=tuple)
 
 
@@ -116,17 +269,17 @@ class SceneApi:
 
     def __init__(
         self,
-        owner: ViserServer | ClientHandle,  # Who do I belong to?
+        owner: ViserServer | ClientHandle | SceneRecorder,  # Who do I belong to?
         thread_executor: ThreadPoolExecutor,
     ) -> None:
-        from ._viser import ViserServer
+        from ._viser import SceneRecorder, ViserServer
 
         self._owner = owner
         """Entity that owns this API."""
 
         self._websock_interface = (
             owner._websock_server
-            if isinstance(owner, ViserServer)
+            if isinstance(owner, (ViserServer, SceneRecorder))
             else owner._websock_connection
         )
         """Interface for sending and listening to messages."""
@@ -142,13 +295,14 @@ class SceneApi:
         """Handle for the world axes, which are created by default."""
 
         # Hide world axes on initialization.
-        if isinstance(owner, ViserServer):
+        if isinstance(owner, (ViserServer, SceneRecorder)):
             self.world_axes.visible = False
 
         self._handle_from_transform_controls_name: dict[
             str, TransformControlsHandle
         ] = {}
         self._handle_from_node_name: dict[str, SceneNodeHandle] = {}
+        self._lod_octree_from_name: dict[str, PointCloudOctree] = {}
 
         self._scene_pointer_cb: Callable[[ScenePointerEvent], None] | None = None
         self._scene_pointer_done_cb: Callable[[], None] = lambda: None
@@ -166,6 +320,10 @@ class SceneApi:
             _messages.ScenePointerMessage,
             self._handle_scene_pointer_updates,
         )
+        self._websock_interface.register_handler(
+            _messages.LodPointCloudRequestMessage,
+            self._handle_lod_point_cloud_requests,
+        )
 
         self._thread_executor = thread_executor
 
@@ -413,6 +571,7 @@ class SceneApi:
         position: tuple[float, float, float] | onp.ndarray = (0.0, 0.0, 0.0),
         visible: bool = True,
         thickness: float = 1.0,
+        max_image_size: int | None = None,
     ) -> CameraFrustumHandle:
         """Add a camera frustum to the scene for visualization.
 
@@ -436,14 +595,17 @@ class SceneApi:
             wxyz: Quaternion rotation to parent frame from local frame (R_pl).
             position: Translation to parent frame from local frame (t_pl).
             visible: Whether or not this scene node is initially visible.
+            thickness: Thickness of the frustum lines.
+            max_image_size: If set, the image is downscaled before it's sent, so
+                its longest side is at most this many pixels.
 
         Returns:
             Handle for manipulating scene node.
         """
 
         if image is not None:
-            media_type, binary = _encode_image_binary(
-                image, format, jpeg_quality=jpeg_quality
+            media_type, binary = _deferred_image_binary(
+                image, format, jpeg_quality=jpeg_quality, max_size=max_image_size
             )
         else:
             media_type = None
@@ -667,6 +829,8 @@ class SceneApi:
         wxyz: tuple[float, float, float, float] | onp.ndarray = (1.0, 0.0, 0.0, 0.0),
         position: tuple[float, float, float] | onp.ndarray = (0.0, 0.0, 0.0),
         visible: bool = True,
+        precision: Literal["float32", "int16"] = "float32",
+        color_precision: Literal["rgb888", "rgb565"] = "rgb888",
     ) -> PointCloudHandle:
         """Add a point cloud to the scene.
 
@@ -679,6 +843,12 @@ class SceneApi:
             wxyz: Quaternion rotation to parent frame from local frame (R_pl).
             position: Translation to parent frame from local frame (t_pl).
             visible: Whether or not this scene node is initially visible.
+            precision: "int16" sends positions quantized to 16 bits within the
+                cloud's bounding box, and uniform or palettized colors as a
+                single color or a palette. Roughly halves the payload of large
+                clouds; the error is at most 1/65534 of the bounding box extent.
+            color_precision: With `precision="int16"`, "rgb565" sends colors that
+                can't be palettized as 16-bit RGB565 instead of 24-bit RGB.
 
         Returns:
             Handle for manipulating scene node.
@@ -692,6 +862,27 @@ class SceneApi:
             (3,),
         }, "Shape of colors should be (N, 3) or (3,)."
 
+        point_ball_norm = {
+            "square": float("inf"),
+            "diamond": 1.0,
+            "circle": 2.0,
+            "rounded": 3.0,
+            "sparkle": 0.6,
+        }[point_shape]
+
+        if precision == "int16":
+            self._websock_interface.queue_message(
+                _messages.CompactPointCloudMessage.encode(
+                    name=name,
+                    points=points.astype(onp.float32),
+                    colors=colors_cast,
+                    point_size=point_size,
+                    point_ball_norm=point_ball_norm,
+                    rgb565=color_precision == "rgb565",
+                )
+            )
+            return PointCloudHandle._make(self, name, wxyz, position, visible)
+
         if colors_cast.shape == (3,):
             colors_cast = onp.tile(colors_cast[None, :], reps=(points.shape[0], 1))
 
@@ -701,17 +892,99 @@ class SceneApi:
                 points=points.astype(onp.float32),
                 colors=colors_cast,
                 point_size=point_size,
-                point_ball_norm={
-                    "square": float("inf"),
-                    "diamond": 1.0,
-                    "circle": 2.0,
-                    "rounded": 3.0,
-                    "sparkle": 0.6,
-                }[point_shape],
+                point_ball_norm=point_ball_norm,
             )
         )
         return PointCloudHandle._make(self, name, wxyz, position, visible)
 
+    def add_point_cloud_lod(
+        self,
+        name: str,
+        points: onp.ndarray,
+        colors: onp.ndarray | tuple[float, float, float],
+        point_size: float = 0.1,
+        point_shape: Literal[
+            "square", "diamond", "circle", "rounded", "sparkle"
+        ] = "square",
+        max_points_per_node: int = 32768,
+        error_threshold: float = 1.5,
+        point_budget: int = 2_000_000,
+        wxyz: tuple[float, float, float, float] | onp.ndarray = (1.0, 0.0, 0.0, 0.0),
+        position: tuple[float, float, float] | onp.ndarray = (0.0, 0.0, 0.0),
+        visible: bool = True,
+    ) -> LodPointCloudHandle:
+        """Add a large point cloud to the scene, drawn with level-of-detail.
+
+        An octree is built over the points on the server. Clients first receive
+        its hierarchy and a subsample of the cloud, then request the points of
+        the octree nodes they need, based on the view frustum and on the
+        projected point spacing. This keeps multi-million point clouds
+        interactive: only the visible detail is sent and drawn.
+
+        Clients that don't support level-of-detail (older client API versions)
+        receive the full point cloud instead. Recordings, which are played back
+        without a server, include the points of every octree node, so they are
+        about as large as a recording of :meth:`add_point_cloud()`.
+
+        Args:
+            name: Name of scene node. Determines location in kinematic tree.
+            points: Location of points. Should have shape (N, 3).
+            colors: Colors of points. Should have shape (N, 3) or (3,).
+            point_size: Size of each point.
+            point_shape: Shape to draw each point.
+            max_points_per_node: Maximum number of points sent per octree node.
+            error_threshold: Nodes are refined while their point spacing
+                projects to more than this many pixels.
+            point_budget: Maximum number of points drawn by each client.
+            wxyz: Quaternion rotation to parent frame from local frame (R_pl).
+            position: Translation to parent frame from local frame (t_pl).
+            visible: Whether or not this scene node is initially visible.
+
+        Returns:
+            Handle for manipulating scene node.
+        """
+        colors_cast = _colors_to_uint8(onp.asarray(colors))
+        assert (
+            len(points.shape) == 2 and points.shape[-1] == 3
+        ), "Shape of points should be (N, 3)."
+        assert colors_cast.shape in {
+            points.shape,
+            (3,),
+        }, "Shape of colors should be (N, 3) or (3,)."
+        if colors_cast.shape == (3,):
+            colors_cast = onp.tile(colors_cast[None, :], reps=(points.shape[0], 1))
+
+        point_ball_norm = {
+            "square": float("inf"),
+            "diamond": 1.0,
+            "circle": 2.0,
+            "rounded": 3.0,
+            "sparkle": 0.6,
+        }[point_shape]
+
+        octree = PointCloudOctree.build(
+            points.astype(onp.float32), colors_cast, max_points_per_node
+        )
+        self._lod_octree_from_name[name] = octree
+        root_points, root_colors = octree.chunk(0)
+        message = _messages.LodPointCloudMessage(
+            name=name,
+            centers=octree.centers,
+            half_sizes=octree.half_sizes,
+            parents=octree.parents,
+            errors=octree.errors,
+            num_points=octree.num_points().astype(onp.uint32),
+            root_points=root_points,
+            root_colors=root_colors,
+            point_size=point_size,
+            point_ball_norm=point_ball_norm,
+            error_threshold=error_threshold,
+            point_budget=point_budget,
+        )
+        message._octree = octree
+        self._websock_interface.queue_message(message)
+        return LodPointCloudHandle._make(self, name, wxyz, position, visible)
+
     def add_mesh_skinned(
         self,
         name: str,
@@ -1090,6 +1363,7 @@ class SceneApi:
         format: Literal["png", "jpeg"] = "jpeg",
         jpeg_quality: int | None = None,
         depth: onp.ndarray | None = None,
+        max_image_size: int | None = None,
     ) -> None:
         """Set a background image for the scene, optionally with depth compositing.
 
@@ -1098,9 +1372,12 @@ class SceneApi:
             format: Format to transport and display the image using ('png' or 'jpeg').
             jpeg_quality: Quality of the jpeg image (if jpeg format is used).
             depth: Optional depth image to use to composite background with scene elements.
+            max_image_size: If set, the image is downscaled before it's sent, so
+                its longest side is at most this many pixels. The depth image is
+                sent as is.
         """
-        media_type, rgb_bytes = _encode_image_binary(
-            image, format, jpeg_quality=jpeg_quality
+        media_type, rgb_bytes = _deferred_image_binary(
+            image, format, jpeg_quality=jpeg_quality, max_size=max_image_size
         )
 
         # Encode depth if provided. We use a 3-channel PNG to represent a fixed point
@@ -1118,9 +1395,16 @@ class SceneApi:
             assert depth is not None  # Appease mypy.
             intdepth: onp.ndarray = depth.reshape((*depth.shape[:2], 1)).view(onp.uint8)
             assert intdepth.shape == (*depth.shape[:2], 4)
-            with io.BytesIO() as data_buffer:
-                iio.imwrite(data_buffer, intdepth[:, :, :3], extension=".png")
-                depth_bytes = data_buffer.getvalue()
+
+            # Encoded when the message is serialized, like the image.
+            def encode_depth() -> bytes:
+                with io.BytesIO() as data_buffer:
+                    iio.imwrite(data_buffer, intdepth[:, :, :3], extension=".png")
+                    return data_buffer.getvalue()
+
+            depth_bytes = cast(
+                bytes, DeferredBytes(encode_depth, nbytes=intdepth.nbytes)
+            )
 
         self._websock_interface.queue_message(
             _messages.BackgroundImageMessage(
@@ -1141,6 +1425,7 @@ class SceneApi:
         wxyz: tuple[float, float, float, float] | onp.ndarray = (1.0, 0.0, 0.0, 0.0),
         position: tuple[float, float, float] | onp.ndarray = (0.0, 0.0, 0.0),
         visible: bool = True,
+        max_image_size: int | None = None,
     ) -> ImageHandle:
         """Add a 2D image to the scene.
 
@@ -1155,13 +1440,16 @@ class SceneApi:
             wxyz: Quaternion rotation to parent frame from local frame (R_pl).
             position: Translation from parent frame to local frame (t_pl).
             visible: Whether or not this image is initially visible.
+            max_image_size: If set, the image is downscaled before it's sent, so
+                its longest side is at most this many pixels. Useful for
+                thumbnails.
 
         Returns:
             Handle for manipulating scene node.
         """
 
-        media_type, binary = _encode_image_binary(
-            image, format, jpeg_quality=jpeg_quality
+        media_type, binary = _deferred_image_binary(
+            image, format, jpeg_quality=jpeg_quality, max_size=max_image_size
         )
         self._websock_interface.queue_message(
             _messages.ImageMessage(
@@ -1269,12 +1557,13 @@ class SceneApi:
 
     def reset(self) -> None:
         """Reset the scene."""
+        self._lod_octree_from_name.clear()
         self._websock_interface.queue_message(_messages.ResetSceneMessage())
 
     def _get_client_handle(self, client_id: ClientId) -> ClientHandle:
         """Private helper for getting a client handle from its ID."""
         # Avoid circular imports.
-        from ._viser import ViserServer
+        from ._viser import ClientHandle, ViserServer
 
         # Implementation-wise, note that MessageApi is never directly instantiated.
         # Instead, it serves as a mixin/base class for either ViserServer, which
@@ -1286,6 +1575,7 @@ class SceneApi:
             # revisit all of the cases where we index into connected_clients.
             return self._owner._connected_clients[client_id]
         else:
+            assert isinstance(self._owner, ClientHandle)
             assert client_id == self._owner.client_id
             return self._owner
 
@@ -1331,6 +1621,29 @@ class SceneApi:
             )
             cb(event)  # type: ignore
 
+    def _handle_lod_point_cloud_requests(
+        self, client_id: ClientId, message: _messages.LodPointCloudRequestMessage
+    ) -> None:
+        """Callback for handling octree node requests of level-of-detail point
+        clouds. Chunks are only sent to the requesting client, and never enter
+        the persistent scene state."""
+        octree = self._lod_octree_from_name.get(message.name, None)
+        if octree is None:
+            return
+        try:
+            connection = self._get_client_handle(client_id)._websock_connection
+        except KeyError:
+            return  # The client disconnected.
+        for node in message.nodes:
+            if not 0 <= node < octree.num_nodes():
+                continue
+            points, colors = octree.chunk(node)
+            connection.queue_message(
+                _messages.LodPointCloudChunkMessage(
+                    name=message.name, node=node, points=points, colors=colors
+                )
+            )
+
     def _handle_scene_pointer_updates(
         self, client_id: ClientId, message: _messages.ScenePointerMessage
     ):
@@ -1363,7 +1676,9 @@ class SceneApi:
 
         from ._viser import ClientHandle, ViserServer
 
-        def cleanup_previous_event(target: ViserServer | ClientHandle):
+        def cleanup_previous_event(
+            target: ViserServer | ClientHandle | SceneRecorder,
+        ) -> None:
             # If the server or client does not have a scene pointer callback, return.
             if target.scene._scene_pointer_cb is None:
                 return
@@ -1468,6 +1783,11 @@ class SceneApi:
 
         # Avoids circular import.
         from ._gui_api import _make_unique_id
+        from ._viser import SceneRecorder
+
+        assert not isinstance(
+            self._owner, SceneRecorder
+        ), "3D GUI containers can't be recorded."
 
         # New name to make the type checker happy; ViserServer and ClientHandle inherit
         # from both GuiApi and MessageApi. The pattern below is unideal.
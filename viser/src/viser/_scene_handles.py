@@ -192,6 +192,16 @@ class PointCloudHandle(SceneNodeHandle):
     """Handle for point clouds. Does not support click events."""
 
 
+@dataclasses.dataclass
+class LodPointCloudHandle(SceneNodeHandle):
+    """Handle for level-of-detail point clouds. Does not support click events."""
+
+    def remove(self) -> None:
+        """Remove the node from the scene, and drop its octree."""
+        self._impl.api._lod_octree_from_name.pop(self._impl.name, None)
+        super().remove()
+
+
 @dataclasses.dataclass
 class BatchedAxesHandle(_ClickableSceneNodeHandle):
     """Handle for batched coordinate frames."""
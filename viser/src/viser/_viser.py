@@ -27,6 +27,11 @@ from ._tunnel import ViserTunnel
 from .infra._infra import RecordHandle
 
 
+def _is_scene_message(message: infra.Message) -> bool:
+    """Filter for scene recordings. Excludes GUI messages; this feels brittle."""
+    return "Gui" not in type(message).__name__
+
+
 class _BackwardsCompatibilityShim:
     """Shims for backward compatibility with viser API from version
     `<=0.1.30`."""
@@ -334,6 +339,11 @@ class ClientHandle(_BackwardsCompatibilityShim if not TYPE_CHECKING else object)
         sent. (by default they are windowed)"""
         self._viser_server._websock_server.flush_client(self.client_id)
 
+    def get_send_metrics(self) -> infra.ClientSendMetrics:
+        """Returns a snapshot of outgoing traffic to this client: bytes queued and
+        sent, and time spent waiting for a slow connection to catch up."""
+        return self._websock_connection.get_send_metrics()
+
     def atomic(self) -> ContextManager[None]:
         """Returns a context where: all outgoing messages are grouped and applied by
         clients atomically.
@@ -451,6 +461,9 @@ class ViserServer(_BackwardsCompatibilityShim if not TYPE_CHECKING else object):
         host: Host to bind server to.
         port: Port to bind server to.
         label: Label shown at the top of the GUI panel.
+        max_persistent_bytes: Approximate memory budget for scene state kept for
+            clients that connect later. When exceeded, the oldest large messages
+            (point clouds, images, meshes) are dropped. None for no limit.
     """
 
     # Hide deprecated arguments from docstring and type checkers.
@@ -460,6 +473,7 @@ class ViserServer(_BackwardsCompatibilityShim if not TYPE_CHECKING else object):
         port: int = 8080,
         label: str | None = None,
         verbose: bool = True,
+        max_persistent_bytes: int | None = None,
         **_deprecated_kwargs,
     ):
         # Create server.
@@ -469,7 +483,8 @@ class ViserServer(_BackwardsCompatibilityShim if not TYPE_CHECKING else object):
             message_class=_messages.Message,
             http_server_root=Path(__file__).absolute().parent / "client" / "build",
             verbose=verbose,
-            client_api_version=1,
+            client_api_version=3,
+            max_persistent_bytes=max_persistent_bytes,
         )
         self._websock_server = server
 
@@ -706,6 +721,12 @@ class ViserServer(_BackwardsCompatibilityShim if not TYPE_CHECKING else object):
         sent. (by default they are windowed)"""
         self._websock_server.flush()
 
+    def get_persistent_buffer_size(self) -> tuple[int, int]:
+        """Returns the number of messages kept to bring newly connected clients up
+        to date, and their approximate size in bytes. Messages of removed scene
+        nodes are not kept."""
+        return self._websock_server.get_persistent_buffer_size()
+
     def atomic(self) -> ContextManager[None]:
         """Returns a context where: all outgoing messages are grouped and applied by
         clients atomically.
@@ -732,17 +753,79 @@ class ViserServer(_BackwardsCompatibilityShim if not TYPE_CHECKING else object):
         for client in self.get_clients().values():
             client.send_file_download(filename, content, chunk_size)
 
-    def _start_scene_recording(self) -> RecordHandle:
+    def _start_scene_recording(self, path: Path | None = None) -> RecordHandle:
         """Start recording outgoing messages for playback or
         embedding. Includes only the scene.
 
+        If `path` is set, the recording is streamed to that `.viser` file as it
+        goes; finish it with `RecordHandle.end()`.
+
         **Work-in-progress.** This API may be changed or removed.
         """
         recorder = self._websock_server.start_recording(
-            # Don't record GUI messages. This feels brittle.
-            filter=lambda message: "Gui" not in type(message).__name__
+            filter=_is_scene_message, path=path
         )
         # Insert current scene state.
-        for message in self._websock_server._broadcast_buffer.message_from_id.values():
+        broadcast_buffer = self._websock_server._broadcast_buffer
+        with broadcast_buffer.buffer_lock:
+            messages = list(broadcast_buffer.message_from_id.values())
+        for message in messages:
             recorder._insert_message(message)
         return recorder
+
+
+class SceneRecorder:
+    """Builds a 3D scene and records it for playback, without starting a server.
+
+    :attr:`SceneRecorder.scene` has the same API as :attr:`ViserServer.scene`,
+    but no port is bound and no websocket thread is started: messages go
+    straight to the recording. This makes it cheap to export many recordings in
+    parallel, for example from a process pool.
+
+    Only the scene is recorded; there is no GUI.
+
+    Args:
+        path: `.viser` file to stream the recording to. If None, the recording
+            is kept in memory; see :meth:`SceneRecorder.end_and_serialize()`.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self._websock_server = infra.HeadlessMessageHandler()
+        self._record_handle = self._websock_server.start_recording(
+            filter=_is_scene_message, path=path
+        )
+
+        self.scene: SceneApi = SceneApi(
+            self, thread_executor=self._websock_server._thread_executor
+        )
+        """Handle for building the 3D scene."""
+        self.scene.reset()
+
+    def flush(self) -> None:
+        """No-op, for scripts written against :class:`ViserServer`."""
+
+    def atomic(self) -> ContextManager[None]:
+        """Returns a context where: all outgoing messages are grouped and applied
+        atomically. See :meth:`ViserServer.atomic()`."""
+        return self._websock_server.atomic()
+
+    def insert_sleep(self, duration: float) -> None:
+        """Advance the time of the recording by `duration` seconds. Messages sent
+        after this are played back later."""
+        self._record_handle.insert_sleep(duration)
+
+    def set_loop_start(self) -> None:
+        """Mark the start of the loop. Messages sent after this point will be
+        looped during playback. Should only be called once."""
+        self._record_handle.set_loop_start()
+
+    def end(self) -> None:
+        """End the recording, and finish writing it."""
+        self._record_handle.end()
+        self._websock_server._thread_executor.shutdown(wait=True)
+
+    def end_and_serialize(self) -> bytes:
+        """End the recording, and return it as bytes."""
+        out = self._record_handle.end_and_serialize()
+        self._websock_server._thread_executor.shutdown(wait=True)
+        return out
@@ -49,6 +49,7 @@ import { FrameSynchronizedMessageHandler } from "./MessageHandler";
 import { PlaybackFromFile } from "./FilePlayback";
 import { SplatRenderContext } from "./Splatting/GaussianSplats";
 import { BrowserWarning } from "./BrowserWarning";
+import { LodPointCloudState } from "./LodPointCloud";
 
 export type ViewerContextContents = {
   messageSource: "websocket" | "file_playback";
@@ -107,6 +108,10 @@ export type ViewerContextContents = {
       }[];
     };
   }>;
+  // Octree nodes of level-of-detail point clouds.
+  lodPointCloudState: React.MutableRefObject<{
+    [name: string]: LodPointCloudState;
+  }>;
 };
 export const ViewerContext = React.createContext<null | ViewerContextContents>(
   null,
@@ -184,6 +189,7 @@ function ViewerRoot() {
     }),
     canvas2dRef: React.useRef(null),
     skinnedMeshState: React.useRef({}),
+    lodPointCloudState: React.useRef({}),
   };
 
   // Set dark default if specified in URL.
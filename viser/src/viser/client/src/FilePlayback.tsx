@@ -1,6 +1,6 @@
-import { decodeAsync, decode } from "@msgpack/msgpack";
+import { decode, ExtensionCodec } from "@msgpack/msgpack";
 import { Message } from "./WebsocketMessages";
-import { decompress } from "fflate";
+import { decompress, unzlibSync } from "fflate";
 
 import { useCallback, useContext, useEffect, useRef, useState } from "react";
 import { ViewerContext } from "./App";
@@ -19,59 +19,166 @@ import {
   IconPlayerPlayFilled,
 } from "@tabler/icons-react";
 
-/** Download, decompress, and deserialize a file, which should be serialized
- * via msgpack and compressed via gzip. Also takes a hook for status updates. */
-async function deserializeGzippedMsgpackFile<T>(
+// Chunked recording format; see `viser/infra/_recording.py`.
+const RECORDING_MAGIC = "VISERREC";
+const INDEX_MAGIC = "VISERIDX";
+const BLOB_EXT_TYPE = 1;
+
+/** Offset, length, and whether the record is zlib-compressed. */
+type RecordLocation = [number, number, boolean];
+
+interface RecordingIndex {
+  version: number;
+  durationSeconds: number;
+  loopStartIndex: number | null;
+  numMessages: number;
+  /** Record location, start time, index of the first message, and number of
+   * messages of each chunk. */
+  chunks: [number, number, boolean, number, number, number][];
+  blobs: RecordLocation[];
+}
+
+/** Legacy recordings: gzipped msgpack of all messages. */
+interface SerializedMessages {
+  loopStartIndex: number | null;
+  durationSeconds: number;
+  messages: [number, Message][];
+}
+
+/** A recording, with messages that are decoded on demand. */
+interface Recording {
+  loopStartIndex: number | null;
+  durationSeconds: number;
+  numMessages: number;
+  /** Returns the time and contents of a message. */
+  getMessage(index: number): [number, Message];
+}
+
+/** Download a file. Also takes a hook for status updates. */
+async function downloadFile(
   fileUrl: string,
   setStatus: (status: { downloaded: number; total: number }) => void,
-): Promise<T> {
+): Promise<Uint8Array> {
   const response = await fetch(fileUrl);
   if (!response.ok) {
     throw new Error(`Failed to fetch the file: ${response.statusText}`);
   }
-  return new Promise<T>((resolve) => {
-    const gzipTotalLength = parseInt(response.headers.get("Content-Length")!);
-    if (typeof DecompressionStream === "undefined") {
-      // Implementation without DecompressionStream.
-      console.log("DecompressionStream is unavailable. Using fallback.");
-      setStatus({ downloaded: 0.1 * gzipTotalLength, total: gzipTotalLength });
-      response.arrayBuffer().then((buffer) => {
-        setStatus({
-          downloaded: 0.8 * gzipTotalLength,
-          total: gzipTotalLength,
-        });
-        decompress(new Uint8Array(buffer), (error, result) => {
-          setStatus({
-            downloaded: 1.0 * gzipTotalLength,
-            total: gzipTotalLength,
-          });
-          resolve(decode(result) as T);
-        });
-      });
-    } else {
-      // Stream: fetch -> gzip -> msgpack.
-      let gzipReceived = 0;
-      const progressStream = // Count number of (compressed) bytes.
-        new TransformStream({
-          transform(chunk, controller) {
-            gzipReceived += chunk.length;
-            setStatus({ downloaded: gzipReceived, total: gzipTotalLength });
-            controller.enqueue(chunk);
-          },
-        });
-      decodeAsync(
-        response
-          .body!.pipeThrough(progressStream)
-          .pipeThrough(new DecompressionStream("gzip")),
-      ).then((val) => resolve(val as T));
-    }
+  const totalLength = parseInt(response.headers.get("Content-Length")!);
+  const reader = response.body!.getReader();
+  const parts: Uint8Array[] = [];
+  let received = 0;
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    parts.push(value);
+    received += value.length;
+    setStatus({ downloaded: received, total: totalLength });
+  }
+  const bytes = new Uint8Array(received);
+  let offset = 0;
+  for (const part of parts) {
+    bytes.set(part, offset);
+    offset += part.length;
+  }
+  return bytes;
+}
+
+/** Read a chunked recording. Chunks are decoded as playback reaches them, and
+ * large fields are read from the shared blobs as their messages are decoded. */
+function chunkedRecording(bytes: Uint8Array): Recording {
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  const footerMagic = new TextDecoder().decode(bytes.subarray(-8));
+  if (footerMagic !== INDEX_MAGIC) {
+    throw new Error("Recording is truncated: missing index.");
+  }
+  const indexOffset = Number(view.getBigUint64(bytes.length - 16, true));
+  const index = decode(
+    bytes.subarray(indexOffset, bytes.length - 16),
+  ) as RecordingIndex;
+
+  const readRecord = (offset: number, length: number, compressed: boolean) => {
+    const data = bytes.subarray(offset, offset + length);
+    return compressed ? unzlibSync(data) : data;
+  };
+  const extensionCodec = new ExtensionCodec();
+  extensionCodec.register({
+    type: BLOB_EXT_TYPE,
+    encode: () => null,
+    decode: (data: Uint8Array) => {
+      const blobIndex = new DataView(
+        data.buffer,
+        data.byteOffset,
+        data.byteLength,
+      ).getUint32(0, true);
+      return readRecord(...index.blobs[blobIndex]);
+    },
   });
+
+  /** Index of the chunk that contains a message. */
+  const chunkOf = (messageIndex: number) => {
+    let lo = 0;
+    let hi = index.chunks.length - 1;
+    while (lo < hi) {
+      const mid = (lo + hi + 1) >> 1;
+      if (index.chunks[mid][4] <= messageIndex) lo = mid;
+      else hi = mid - 1;
+    }
+    return lo;
+  };
+
+  // Playback moves forward, or jumps back to the loop start. We keep the
+  // chunk we're reading and the one that the loop starts in.
+  const loopStartChunk =
+    index.loopStartIndex === null ? -1 : chunkOf(index.loopStartIndex);
+  const decodedChunks = new Map<number, [number, Message][]>();
+
+  return {
+    loopStartIndex: index.loopStartIndex,
+    durationSeconds: index.durationSeconds,
+    numMessages: index.numMessages,
+    getMessage: (messageIndex: number) => {
+      const chunkIndex = chunkOf(messageIndex);
+      let chunk = decodedChunks.get(chunkIndex);
+      if (chunk === undefined) {
+        const [offset, length, compressed] = index.chunks[chunkIndex];
+        chunk = decode(readRecord(offset, length, compressed), {
+          extensionCodec,
+        }) as [number, Message][];
+        decodedChunks.forEach((_, key) => {
+          if (key !== loopStartChunk) decodedChunks.delete(key);
+        });
+        decodedChunks.set(chunkIndex, chunk);
+      }
+      return chunk[messageIndex - index.chunks[chunkIndex][4]];
+    },
+  };
 }
 
-interface SerializedMessages {
-  loopStartIndex: number | null;
-  durationSeconds: number;
-  messages: [number, Message][];
+/** Download and deserialize a recording: either chunked, or gzipped msgpack
+ * from older versions of viser. Also takes a hook for status updates. */
+async function deserializeRecording(
+  fileUrl: string,
+  setStatus: (status: { downloaded: number; total: number }) => void,
+): Promise<Recording> {
+  const bytes = await downloadFile(fileUrl, setStatus);
+  if (new TextDecoder().decode(bytes.subarray(0, 8)) === RECORDING_MAGIC) {
+    return chunkedRecording(bytes);
+  }
+  return new Promise<Recording>((resolve, reject) => {
+    decompress(bytes, (error, result) => {
+      if (error !== null) {
+        reject(error);
+        return;
+      }
+      const recording = decode(result) as SerializedMessages;
+      resolve({
+        loopStartIndex: recording.loopStartIndex,
+        durationSeconds: recording.durationSeconds,
+        numMessages: recording.messages.length,
+        getMessage: (messageIndex: number) => recording.messages[messageIndex],
+      });
+    });
+  });
 }
 
 export function PlaybackFromFile({ fileUrl }: { fileUrl: string }) {
@@ -82,16 +189,14 @@ export function PlaybackFromFile({ fileUrl }: { fileUrl: string }) {
   const [status, setStatus] = useState({ downloaded: 0.0, total: 0.0 });
   const [playbackSpeed, setPlaybackSpeed] = useState("1x");
   const [paused, setPaused] = useState(false);
-  const [recording, setRecording] = useState<SerializedMessages | null>(null);
+  const [recording, setRecording] = useState<Recording | null>(null);
 
   const [currentTime, setCurrentTime] = useState(0.0);
 
   const theme = useMantineTheme();
 
   useEffect(() => {
-    deserializeGzippedMsgpackFile<SerializedMessages>(fileUrl, setStatus).then(
-      setRecording,
-    );
+    deserializeRecording(fileUrl, setStatus).then(setRecording);
   }, []);
 
   const playbackMutable = useRef({ currentTime: 0.0, currentIndex: 0 });
@@ -105,11 +210,11 @@ export function PlaybackFromFile({ fileUrl }: { fileUrl: string }) {
     // We want to get of a slice of all message _until_ the current time.
     for (
       ;
-      mutable.currentIndex < recording.messages.length &&
-      recording.messages[mutable.currentIndex][0] <= mutable.currentTime;
+      mutable.currentIndex < recording.numMessages &&
+      recording.getMessage(mutable.currentIndex)[0] <= mutable.currentTime;
       mutable.currentIndex++
     ) {
-      const message = recording.messages[mutable.currentIndex][1];
+      const message = recording.getMessage(mutable.currentIndex)[1];
       messageQueueRef.current.push(message);
     }
 
@@ -118,7 +223,7 @@ export function PlaybackFromFile({ fileUrl }: { fileUrl: string }) {
       recording.loopStartIndex !== null
     ) {
       mutable.currentIndex = recording.loopStartIndex!;
-      mutable.currentTime = recording.messages[recording.loopStartIndex!][0];
+      mutable.currentTime = recording.getMessage(recording.loopStartIndex!)[0];
     }
     setCurrentTime(mutable.currentTime);
   }, [recording]);
@@ -135,7 +240,7 @@ export function PlaybackFromFile({ fileUrl }: { fileUrl: string }) {
 
         updatePlayback();
         if (
-          playbackMutable.current.currentIndex === recording.messages.length &&
+          playbackMutable.current.currentIndex === recording.numMessages &&
           recording.loopStartIndex === null
         ) {
           clearInterval(interval);
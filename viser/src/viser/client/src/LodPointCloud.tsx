@@ -0,0 +1,315 @@
+/** Level-of-detail point clouds.
+ *
+ * The server builds an octree over the points; every node owns a random
+ * subset of the points in its cube, so drawing a node together with its
+ * ancestors gives a uniformly subsampled view of the cube. We receive the
+ * hierarchy and the root node up front, then pick the nodes to draw each
+ * frame: nodes are refined, in order of decreasing screen-space error, while
+ * they are in the view frustum, their point spacing projects to more than
+ * `errorThreshold` pixels, and the point budget allows. Points of missing
+ * nodes are requested from the server, a few at a time.
+ */
+
+import React from "react";
+import * as THREE from "three";
+import { useFrame } from "@react-three/fiber";
+import { ViewerContext } from "./App";
+import { PointCloudMaterial } from "./ThreeAssets";
+import {
+  LodPointCloudChunkMessage,
+  LodPointCloudMessage,
+} from "./WebsocketMessages";
+
+/** Maximum number of octree nodes requested but not received yet. */
+const MAX_PENDING_REQUESTS = 8;
+/** Requests without a response after this long are sent again. */
+const REQUEST_TIMEOUT_MS = 5000;
+
+export type LodHierarchy = {
+  centers: Float32Array;
+  halfSizes: Float32Array;
+  errors: Float32Array;
+  numPoints: Uint32Array;
+  children: number[][];
+};
+
+/** Client-side state of a level-of-detail point cloud. Lives outside of React
+ * state, like skinned mesh poses: chunks arrive from the message handler and
+ * are picked up by the render loop. */
+export type LodPointCloudState = {
+  hierarchy: LodHierarchy;
+  chunks: Map<number, { points: Float32Array; colors: Float32Array }>;
+  /** Node index => time at which it was requested. */
+  pending: Map<number, number>;
+};
+
+function typedArrayFromBytes<T>(
+  bytes: Uint8Array,
+  TypedArray: new (buffer: ArrayBuffer) => T,
+): T {
+  return new TypedArray(
+    bytes.buffer.slice(bytes.byteOffset, bytes.byteOffset + bytes.byteLength),
+  );
+}
+
+/** Decode int16 positions (relative to the node cube) and uint8 colors. */
+function decodeChunk(
+  hierarchy: LodHierarchy,
+  node: number,
+  pointBytes: Uint8Array,
+  colorBytes: Uint8Array,
+) {
+  const quantized = typedArrayFromBytes(pointBytes, Int16Array);
+  const scale = hierarchy.halfSizes[node] / 32767.0;
+  const points = new Float32Array(quantized.length);
+  for (let i = 0; i < quantized.length; i++) {
+    points[i] = hierarchy.centers[node * 3 + (i % 3)] + quantized[i] * scale;
+  }
+  const colors = new Float32Array(colorBytes.length);
+  for (let i = 0; i < colorBytes.length; i++)
+    colors[i] = colorBytes[i] / 255.0;
+  return { points: points, colors: colors };
+}
+
+/** Build the client-side state from the hierarchy message, including the
+ * root node points that it carries. */
+export function lodPointCloudStateFromMessage(
+  message: LodPointCloudMessage,
+): LodPointCloudState {
+  const parents = typedArrayFromBytes(message.parents, Int32Array);
+  const children: number[][] = [];
+  for (let i = 0; i < parents.length; i++) {
+    children.push([]);
+    if (parents[i] >= 0) children[parents[i]].push(i);
+  }
+  const hierarchy: LodHierarchy = {
+    centers: typedArrayFromBytes(message.centers, Float32Array),
+    halfSizes: typedArrayFromBytes(message.half_sizes, Float32Array),
+    errors: typedArrayFromBytes(message.errors, Float32Array),
+    numPoints: typedArrayFromBytes(message.num_points, Uint32Array),
+    children: children,
+  };
+  const chunks: LodPointCloudState["chunks"] = new Map();
+  chunks.set(
+    0,
+    decodeChunk(hierarchy, 0, message.root_points, message.root_colors),
+  );
+  return { hierarchy: hierarchy, chunks: chunks, pending: new Map() };
+}
+
+/** Store the points of an octree node received from the server. */
+export function addLodPointCloudChunk(
+  state: LodPointCloudState,
+  message: LodPointCloudChunkMessage,
+) {
+  state.pending.delete(message.node);
+  state.chunks.set(
+    message.node,
+    decodeChunk(state.hierarchy, message.node, message.points, message.colors),
+  );
+}
+
+export const LodPointCloud = React.forwardRef<
+  THREE.Group,
+  {
+    name: string;
+    state: LodPointCloudState;
+    pointSize: number;
+    pointBallNorm: number;
+    errorThreshold: number;
+    pointBudget: number;
+  }
+>(function LodPointCloud(props, ref) {
+  const viewer = React.useContext(ViewerContext)!;
+  const groupRef = React.useRef<THREE.Group>(null);
+  React.useImperativeHandle(ref, () => groupRef.current!);
+
+  const [material] = React.useState(
+    () => new PointCloudMaterial({ vertexColors: true }),
+  );
+  material.uniforms.scale.value = 10.0;
+  material.uniforms.point_ball_norm.value = props.pointBallNorm;
+
+  // Drawable objects of loaded nodes, and the last frame each was drawn in.
+  const objects = React.useRef(new Map<number, THREE.Points>());
+  const lastDrawn = React.useRef(new Map<number, number>());
+  const frameCount = React.useRef(0);
+
+  React.useEffect(() => {
+    return () => {
+      objects.current.forEach((points) => points.geometry.dispose());
+      objects.current.clear();
+      material.dispose();
+    };
+  }, [material]);
+
+  const [scratch] = React.useState(() => ({
+    matrix: new THREE.Matrix4(),
+    inverse: new THREE.Matrix4(),
+    frustum: new THREE.Frustum(),
+    box: new THREE.Box3(),
+    cameraPosition: new THREE.Vector3(),
+    center: new THREE.Vector3(),
+    rendererSize: new THREE.Vector2(),
+  }));
+
+  useFrame((state) => {
+    const group = groupRef.current;
+    if (group === null) return;
+    const camera = state.camera as THREE.PerspectiveCamera;
+    const { hierarchy, chunks, pending } = props.state;
+    frameCount.current += 1;
+
+    // Match point scale to behavior of THREE.PointsMaterial().
+    const heightPx =
+      state.gl.getSize(scratch.rendererSize).height * state.gl.getPixelRatio();
+    const tanHalfFov = Math.tan(((camera.fov / 180.0) * Math.PI) / 2.0);
+    material.uniforms.scale.value = (props.pointSize / tanHalfFov) * heightPx;
+
+    // Frustum and camera position in the local frame of the point cloud.
+    group.updateWorldMatrix(true, false);
+    scratch.matrix
+      .multiplyMatrices(camera.projectionMatrix, camera.matrixWorldInverse)
+      .multiply(group.matrixWorld);
+    scratch.frustum.setFromProjectionMatrix(scratch.matrix);
+    scratch.inverse.copy(group.matrixWorld).invert();
+    scratch.cameraPosition
+      .setFromMatrixPosition(camera.matrixWorld)
+      .applyMatrix4(scratch.inverse);
+
+    // Projected point spacing of a node, in pixels.
+    const pixelsPerUnit = heightPx / (2.0 * tanHalfFov);
+    const screenSpaceError = (node: number) => {
+      scratch.center.fromArray(hierarchy.centers, node * 3);
+      const distance = Math.max(
+        scratch.center.distanceTo(scratch.cameraPosition) -
+          hierarchy.halfSizes[node] * Math.sqrt(3.0),
+        1e-6,
+      );
+      return (hierarchy.errors[node] / distance) * pixelsPerUnit;
+    };
+
+    // Select nodes, largest screen-space error first.
+    const selected: number[] = [];
+    const candidates = [{ node: 0, error: screenSpaceError(0) }];
+    let numPoints = 0;
+    while (candidates.length > 0) {
+      let best = 0;
+      for (let i = 1; i < candidates.length; i++) {
+        if (candidates[i].error > candidates[best].error) best = i;
+      }
+      const { node, error } = candidates.splice(best, 1)[0];
+
+      const center = hierarchy.centers.subarray(node * 3, node * 3 + 3);
+      const halfSize = hierarchy.halfSizes[node];
+      scratch.box.min.set(
+        center[0] - halfSize,
+        center[1] - halfSize,
+        center[2] - halfSize,
+      );
+      scratch.box.max.set(
+        center[0] + halfSize,
+        center[1] + halfSize,
+        center[2] + halfSize,
+      );
+      if (node !== 0 && !scratch.frustum.intersectsBox(scratch.box)) continue;
+      if (
+        node !== 0 &&
+        numPoints + hierarchy.numPoints[node] > props.pointBudget
+      )
+        continue;
+
+      selected.push(node);
+      numPoints += hierarchy.numPoints[node];
+      if (error > props.errorThreshold) {
+        for (const child of hierarchy.children[node]) {
+          candidates.push({ node: child, error: screenSpaceError(child) });
+        }
+      }
+    }
+
+    // Draw selected nodes that are loaded, and request the others.
+    const now = performance.now();
+    pending.forEach((time, node) => {
+      if (now - time > REQUEST_TIMEOUT_MS) pending.delete(node);
+    });
+    const requests: number[] = [];
+    const drawn = new Set<number>();
+    for (const node of selected) {
+      const chunk = chunks.get(node);
+      if (chunk === undefined) {
+        if (
+          !pending.has(node) &&
+          pending.size + requests.length < MAX_PENDING_REQUESTS
+        )
+          requests.push(node);
+        continue;
+      }
+      let points = objects.current.get(node);
+      if (points === undefined) {
+        const geometry = new THREE.BufferGeometry();
+        geometry.setAttribute(
+          "position",
+          new THREE.Float32BufferAttribute(chunk.points, 3),
+        );
+        geometry.setAttribute(
+          "color",
+          new THREE.Float32BufferAttribute(chunk.colors, 3),
+        );
+        scratch.center.fromArray(hierarchy.centers, node * 3);
+        geometry.boundingSphere = new THREE.Sphere(
+          scratch.center.clone(),
+          hierarchy.halfSizes[node] * Math.sqrt(3.0),
+        );
+        points = new THREE.Points(geometry, material);
+        objects.current.set(node, points);
+        group.add(points);
+      }
+      points.visible = true;
+      drawn.add(node);
+      lastDrawn.current.set(node, frameCount.current);
+    }
+    objects.current.forEach((points, node) => {
+      if (!drawn.has(node)) points.visible = false;
+    });
+    if (requests.length > 0) {
+      requests.forEach((node) => pending.set(node, now));
+      viewer.sendMessageRef.current({
+        type: "LodPointCloudRequestMessage",
+        name: props.name,
+        nodes: requests,
+      });
+    }
+
+    // Evict the least recently drawn nodes when holding more than twice the
+    // point budget. The root node is always kept. Recordings carry every node
+    // and there is no server to request evicted nodes from again, so during
+    // playback only the GPU buffers are freed and the chunk data is kept.
+    const keepChunks = viewer.messageSource === "file_playback";
+    const held: Map<number, unknown> = keepChunks ? objects.current : chunks;
+    let numLoaded = 0;
+    held.forEach((_, node) => (numLoaded += hierarchy.numPoints[node]));
+    if (numLoaded > 2 * props.pointBudget) {
+      const evictable = Array.from(held.keys())
+        .filter((node) => node !== 0 && !drawn.has(node))
+        .sort(
+          (a, b) =>
+            (lastDrawn.current.get(a) ?? 0) - (lastDrawn.current.get(b) ?? 0),
+        );
+      for (const node of evictable) {
+        if (numLoaded <= props.pointBudget) break;
+        numLoaded -= hierarchy.numPoints[node];
+        if (!keepChunks) chunks.delete(node);
+        lastDrawn.current.delete(node);
+        const points = objects.current.get(node);
+        if (points !== undefined) {
+          group.remove(points);
+          points.geometry.dispose();
+          objects.current.delete(node);
+        }
+      }
+    }
+  });
+
+  return <group ref={groupRef} />;
+});
@@ -17,6 +17,7 @@ import {
   PointCloud,
 } from "./ThreeAssets";
 import {
+  CompactPointCloudMessage,
   FileTransferPart,
   FileTransferStart,
   Message,
@@ -30,6 +31,61 @@ import { Paper, Progress } from "@mantine/core";
 import { IconCheck } from "@tabler/icons-react";
 import { computeT_threeworld_world } from "./WorldTransformUtils";
 import { SplatObject } from "./Splatting/GaussianSplats";
+import {
+  LodPointCloud,
+  addLodPointCloudChunk,
+  lodPointCloudStateFromMessage,
+} from "./LodPointCloud";
+
+/** Decode the int16 positions of a compact point cloud message. **/
+function pointsFromCompactMessage(message: CompactPointCloudMessage) {
+  const quantized = new Int16Array(
+    message.points.buffer.slice(
+      message.points.byteOffset,
+      message.points.byteOffset + message.points.byteLength,
+    ),
+  );
+  const points = new Float32Array(quantized.length);
+  for (let i = 0; i < quantized.length; i++) {
+    const axis = i % 3;
+    points[i] = message.center[axis] + quantized[i] * message.scale[axis];
+  }
+  return points;
+}
+
+/** Decode the colors of a compact point cloud message to floats in [0, 1]. **/
+function colorsFromCompactMessage(message: CompactPointCloudMessage) {
+  const numPoints = message.points.byteLength / 6;
+  const colors = new Float32Array(numPoints * 3);
+  if (message.color_encoding === "uniform") {
+    for (let i = 0; i < colors.length; i++)
+      colors[i] = message.colors[i % 3] / 255.0;
+  } else if (message.color_encoding === "palette") {
+    const palette = message.palette!;
+    for (let i = 0; i < numPoints; i++) {
+      const index = message.colors[i] * 3;
+      colors[i * 3] = palette[index] / 255.0;
+      colors[i * 3 + 1] = palette[index + 1] / 255.0;
+      colors[i * 3 + 2] = palette[index + 2] / 255.0;
+    }
+  } else if (message.color_encoding === "rgb565") {
+    const packed = new Uint16Array(
+      message.colors.buffer.slice(
+        message.colors.byteOffset,
+        message.colors.byteOffset + message.colors.byteLength,
+      ),
+    );
+    for (let i = 0; i < numPoints; i++) {
+      colors[i * 3] = (packed[i] >> 11) / 31.0;
+      colors[i * 3 + 1] = ((packed[i] >> 5) & 0x3f) / 63.0;
+      colors[i * 3 + 2] = (packed[i] & 0x1f) / 31.0;
+    }
+  } else {
+    for (let i = 0; i < colors.length; i++)
+      colors[i] = message.colors[i] / 255.0;
+  }
+  return colors;
+}
 
 /** Convert raw RGB color buffers to linear color buffers. **/
 function threeColorBufferFromUint8Buffer(colors: ArrayBuffer) {
@@ -313,6 +369,59 @@ function useMessageHandler() {
         return;
       }
 
+      // Add a point cloud with quantized positions and compact colors.
+      case "CompactPointCloudMessage": {
+        const points = pointsFromCompactMessage(message);
+        const colors = colorsFromCompactMessage(message);
+        addSceneNodeMakeParents(
+          new SceneNode<THREE.Points>(message.name, (ref) => (
+            <PointCloud
+              ref={ref}
+              pointSize={message.point_size}
+              pointBallNorm={message.point_ball_norm}
+              points={points}
+              colors={colors}
+            />
+          )),
+        );
+        return;
+      }
+
+      // Add a level-of-detail point cloud. Octree nodes beyond the root are
+      // requested by the <LodPointCloud /> render loop.
+      case "LodPointCloudMessage": {
+        const state = lodPointCloudStateFromMessage(message);
+        viewer.lodPointCloudState.current[message.name] = state;
+        addSceneNodeMakeParents(
+          new SceneNode<THREE.Group>(
+            message.name,
+            (ref) => (
+              <LodPointCloud
+                ref={ref}
+                name={message.name}
+                state={state}
+                pointSize={message.point_size}
+                pointBallNorm={message.point_ball_norm}
+                errorThreshold={message.error_threshold}
+                pointBudget={message.point_budget}
+              />
+            ),
+            () => {
+              if (viewer.lodPointCloudState.current[message.name] === state)
+                delete viewer.lodPointCloudState.current[message.name];
+            },
+          ),
+        );
+        return;
+      }
+
+      // Points of an octree node of a level-of-detail point cloud.
+      case "LodPointCloudChunkMessage": {
+        const state = viewer.lodPointCloudState.current[message.name];
+        if (state !== undefined) addLodPointCloudChunk(state, message);
+        return;
+      }
+
       case "GuiModalMessage": {
         addModal(message);
         return;
@@ -47,7 +47,7 @@ type AllPossibleThreeJSMaterials =
 const originGeom = new THREE.SphereGeometry(1.0);
 const originMaterial = new THREE.MeshBasicMaterial({ color: 0xecec00 });
 
-const PointCloudMaterial = /* @__PURE__ */ shaderMaterial(
+export const PointCloudMaterial = /* @__PURE__ */ shaderMaterial(
   { scale: 1.0, point_ball_norm: 0.0 },
   `
   varying vec3 vPosition;
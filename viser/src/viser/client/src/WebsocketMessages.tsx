@@ -194,6 +194,82 @@ export interface PointCloudMessage {
   point_size: number;
   point_ball_norm: number;
 }
+/** Point cloud message with quantized positions and compact colors.
+ *
+ * Positions are int16, relative to the center of the cloud's bounding box:
+ * `point = center + points * scale`. Colors depend on `color_encoding`: a single
+ * RGB triplet (`uniform`), per-point RGB (`rgb`), per-point uint8 indices into
+ * `palette` (`palette`), or per-point uint16 RGB565 (`rgb565`).
+ *
+ * Sent instead of `PointCloudMessage` to clients with `client_api_version >= 2`;
+ * older clients receive the decoded `PointCloudMessage`.
+ *
+ * (automatically generated)
+ */
+export interface CompactPointCloudMessage {
+  type: "CompactPointCloudMessage";
+  name: string;
+  points: Uint8Array;
+  center: [number, number, number];
+  scale: [number, number, number];
+  color_encoding: "uniform" | "rgb" | "palette" | "rgb565";
+  colors: Uint8Array;
+  palette: Uint8Array | null;
+  point_size: number;
+  point_ball_norm: number;
+}
+/** Point cloud drawn with octree level-of-detail.
+ *
+ * Carries the octree hierarchy (see `PointCloudOctree`) and the points of the
+ * root node. The client draws the nodes that are in view and whose point
+ * spacing projects to more than `error_threshold` pixels, up to
+ * `point_budget` points, and requests the points of other nodes with
+ * `LodPointCloudRequestMessage`.
+ *
+ * Sent to clients with `client_api_version >= 3`; older clients receive the
+ * root node as a `PointCloudMessage`.
+ *
+ * (automatically generated)
+ */
+export interface LodPointCloudMessage {
+  type: "LodPointCloudMessage";
+  name: string;
+  centers: Uint8Array;
+  half_sizes: Uint8Array;
+  parents: Uint8Array;
+  errors: Uint8Array;
+  num_points: Uint8Array;
+  root_points: Uint8Array;
+  root_colors: Uint8Array;
+  point_size: number;
+  point_ball_norm: number;
+  error_threshold: number;
+  point_budget: number;
+}
+/** Points of one octree node of a level-of-detail point cloud.
+ *
+ * Positions are int16 within the node"s cube:
+ * `point = centers[node] + points * half_sizes[node] / 32767`.
+ *
+ * (automatically generated)
+ */
+export interface LodPointCloudChunkMessage {
+  type: "LodPointCloudChunkMessage";
+  name: string;
+  node: number;
+  points: Uint8Array;
+  colors: Uint8Array;
+}
+/** Message from client->server requesting octree nodes of a level-of-detail
+ * point cloud.
+ *
+ * (automatically generated)
+ */
+export interface LodPointCloudRequestMessage {
+  type: "LodPointCloudRequestMessage";
+  name: string;
+  nodes: number[];
+}
 /** Message for a bone of a skinned mesh.
  *
  * (automatically generated)
@@ -993,6 +1069,10 @@ export type Message =
   | LabelMessage
   | Gui3DMessage
   | PointCloudMessage
+  | CompactPointCloudMessage
+  | LodPointCloudMessage
+  | LodPointCloudChunkMessage
+  | LodPointCloudRequestMessage
   | MeshBoneMessage
   | MeshMessage
   | SkinnedMeshMessage
@@ -2,6 +2,11 @@ import { encode, decode } from "@msgpack/msgpack";
 import { Message } from "./WebsocketMessages";
 import AwaitLock from "await-lock";
 
+/** Highest server API version this client can decode. Version 2 adds compact
+ * messages, like `CompactPointCloudMessage`. Version 3 adds level-of-detail
+ * point clouds. */
+const CLIENT_API_VERSION = 3;
+
 export type WsWorkerIncoming =
   | { type: "send"; message: Message }
   | { type: "set_server"; server: string }
@@ -42,7 +47,9 @@ function collectArrayBuffers(obj: any, buffers: Set<ArrayBuffer>) {
 
   const tryConnect = () => {
     if (ws !== null) ws.close();
-    ws = new WebSocket(server!);
+    const url = new URL(server!);
+    url.searchParams.set("client_api_version", CLIENT_API_VERSION.toString());
+    ws = new WebSocket(url.toString());
 
     // Timeout is necessary when we're connecting to an SSH/tunneled port.
     const retryTimeout = setTimeout(() => {
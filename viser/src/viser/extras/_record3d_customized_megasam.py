@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import dataclasses
+import functools
 import os
 import json
 from pathlib import Path
-from typing import Tuple, cast
+from typing import List, Literal, Optional, Sequence, Tuple
 
 import imageio.v3 as iio
 import liblzfse
@@ -15,6 +16,218 @@ import skimage.transform
 from scipy.spatial.transform import Rotation
 from scipy.spatial import cKDTree
 
+PointCloud = Tuple[
+    onpt.NDArray[onp.float32],
+    onpt.NDArray[onp.uint8],
+    onpt.NDArray[onp.float32],
+    onpt.NDArray[onp.uint8],
+]
+"""Foreground points, foreground colors, background points, background colors."""
+
+
+@functools.lru_cache(maxsize=8)
+def _pixel_rays_cached(
+    K: Tuple[float, ...], height: int, width: int, downsample_factor: int
+) -> onpt.NDArray[onp.float32]:
+    grid = (
+        np.stack(np.meshgrid(np.arange(width), np.arange(height)), 2) + 0.5
+    ) * downsample_factor
+    homo_grid = np.concatenate([grid, np.ones((height, width, 1))], axis=2)
+    rays = (homo_grid @ np.linalg.inv(np.array(K).reshape(3, 3)).T).astype(np.float32)
+    rays.flags.writeable = False
+    return rays
+
+
+def pixel_rays(
+    K: onpt.NDArray, height: int, width: int, downsample_factor: int = 1
+) -> onpt.NDArray[onp.float32]:
+    """Camera-frame rays `K^-1 [u, v, 1]` through the pixel centers of a
+    (height, width) image sampled every `downsample_factor` pixels. Cached per
+    intrinsics and shape; the returned array is read-only."""
+    return _pixel_rays_cached(
+        tuple(float(k) for k in np.asarray(K).ravel()), height, width, downsample_factor
+    )
+
+
+def _hashed_keep(
+    num_pixels: int, seeds: onpt.NDArray[onp.int64], factor: int
+) -> onpt.NDArray[onp.bool_]:
+    """Keeps ~1/factor of the pixels of each frame, with a pattern that is
+    deterministic but differs between frames (seeds), so that subsampled
+    background points from many frames do not stack up on the same pixels."""
+    h = np.arange(num_pixels, dtype=np.uint32)[None, :] * np.uint32(0x9E3779B1)
+    h = h ^ (np.asarray(seeds, dtype=np.uint32)[:, None] * np.uint32(0x85EBCA77))
+    h ^= h >> np.uint32(16)
+    h *= np.uint32(0x45D9F3B)
+    h ^= h >> np.uint32(16)
+    return h % np.uint32(factor) == 0
+
+
+def _match_shape(
+    maps: onpt.NDArray, full_shape: Tuple[int, int], downsample_factor: int
+) -> onpt.NDArray:
+    """Samples [B, H, W] per-pixel maps like the RGB frames are sampled, i.e.
+    `[:, ::downsample_factor, ::downsample_factor]` of `full_shape`. Strided
+    slicing when the maps are already at the RGB resolution; nearest-neighbor
+    resizing otherwise."""
+    if maps.shape[1:3] == tuple(full_shape):
+        return maps[:, ::downsample_factor, ::downsample_factor]
+    out_shape = (
+        -(-full_shape[0] // downsample_factor),
+        -(-full_shape[1] // downsample_factor),
+    )
+    return np.stack(
+        [
+            skimage.transform.resize(m, out_shape, order=0, preserve_range=True).astype(
+                m.dtype
+            )
+            for m in maps
+        ]
+    )
+
+
+def unproject(
+    K: onpt.NDArray[onp.float32],
+    T_world_cameras: onpt.NDArray[onp.float32],
+    rgbs: onpt.NDArray[onp.uint8],
+    depths: onpt.NDArray[onp.float32],
+    masks: onpt.NDArray[onp.bool_],
+    confs: onpt.NDArray[onp.float32],
+    init_confs: onpt.NDArray[onp.float32],
+    seeds: onpt.NDArray[onp.int64],
+    conf_threshold: float,
+    foreground_conf_threshold: float,
+    downsample_factor: int = 1,
+    bg_downsample_factor: int = 1,
+) -> List[PointCloud]:
+    """Unprojects a batch of B frames sharing the intrinsics `K`.
+
+    `rgbs` are [B, H, W, 3]; `depths`, `masks`, `confs` and `init_confs` are
+    [B, H', W'] and are resampled to the RGB grid if needed. Foreground points
+    are the masked pixels above `foreground_conf_threshold` (on `init_confs`),
+    background points the unmasked pixels above `conf_threshold` (on `confs`),
+    subsampled by `bg_downsample_factor` with a hash of the pixel and seed.
+    """
+    full_shape = rgbs.shape[1:3]
+    rgbs = rgbs[:, ::downsample_factor, ::downsample_factor]
+    batch, height, width = rgbs.shape[:3]
+    depths = _match_shape(depths, full_shape, downsample_factor)
+    masks = _match_shape(masks, full_shape, downsample_factor)
+    fg_masks = masks & (
+        _match_shape(init_confs, full_shape, downsample_factor)
+        > foreground_conf_threshold
+    )
+    bg_masks = ~masks & (
+        _match_shape(confs, full_shape, downsample_factor) > conf_threshold
+    )
+    if bg_downsample_factor > 1:
+        bg_masks &= _hashed_keep(height * width, seeds, bg_downsample_factor).reshape(
+            batch, height, width
+        )
+
+    # World points of every pixel: R (ray * depth) + t, as one batched matmul.
+    rays = pixel_rays(K, height, width, downsample_factor)
+    points = (rays[None] * depths[..., None]).reshape(batch, -1, 3)
+    points = np.matmul(points, T_world_cameras[:, :3, :3].transpose(0, 2, 1))
+    points = (points + T_world_cameras[:, None, :3, 3]).astype(np.float32)
+    points = points.reshape(batch, height, width, 3)
+
+    return [
+        (
+            points[b][fg_masks[b]],
+            rgbs[b][fg_masks[b]],
+            points[b][bg_masks[b]],
+            rgbs[b][bg_masks[b]],
+        )
+        for b in range(batch)
+    ]
+
+
+class VoxelFusion:
+    """Fuses point clouds into one point per occupied voxel.
+
+    Points are hashed to integer voxel coordinates packed in an int64 key;
+    each voxel keeps the centroid and the mean color of the points that fell
+    in it. Points can be added incrementally: they are buffered and merged
+    into the grid once the buffer outgrows it, so memory stays proportional
+    to the number of occupied voxels and merges are amortized.
+    """
+
+    _BITS = 21
+    _OFFSET = 1 << (_BITS - 1)
+
+    def __init__(self, voxel_size: float) -> None:
+        assert voxel_size > 0.0
+        self.voxel_size = voxel_size
+        self.num_points = 0
+        self._keys = np.zeros((0,), dtype=np.int64)
+        self._counts = np.zeros((0,), dtype=np.int64)
+        self._position_sums = np.zeros((0, 3), dtype=np.float64)
+        self._color_sums = np.zeros((0, 3), dtype=np.float64)
+        self._pending: List[Tuple[onpt.NDArray, onpt.NDArray, onpt.NDArray]] = []
+        self._num_pending = 0
+
+    def _hash(self, points: onpt.NDArray[onp.float32]) -> onpt.NDArray[onp.int64]:
+        coords = np.floor(points / self.voxel_size).astype(np.int64) + self._OFFSET
+        assert coords.size == 0 or (
+            coords.min() >= 0 and coords.max() < (1 << self._BITS)
+        ), "Scene too large for the voxel size."
+        return (
+            (coords[:, 0] << (2 * self._BITS))
+            | (coords[:, 1] << self._BITS)
+            | coords[:, 2]
+        )
+
+    def _merge(self) -> None:
+        if self._num_pending == 0:
+            return
+        keys, positions, colors = zip(*self._pending)
+        self._pending = []
+        self._num_pending = 0
+        self._keys, inverse = np.unique(
+            np.concatenate([self._keys, *keys]), return_inverse=True
+        )
+        num_voxels = len(self._keys)
+        counts = np.ones(len(inverse) - len(self._counts), dtype=np.int64)
+        self._counts = np.bincount(
+            inverse, np.concatenate([self._counts, counts]), num_voxels
+        ).astype(np.int64)
+        position_sums = np.concatenate([self._position_sums, *positions])
+        color_sums = np.concatenate([self._color_sums, *colors])
+        self._position_sums = np.stack(
+            [np.bincount(inverse, position_sums[:, i], num_voxels) for i in range(3)], 1
+        )
+        self._color_sums = np.stack(
+            [np.bincount(inverse, color_sums[:, i], num_voxels) for i in range(3)], 1
+        )
+
+    def add(
+        self, points: onpt.NDArray[onp.float32], colors: onpt.NDArray[onp.uint8]
+    ) -> None:
+        """Adds [N, 3] points with their [N, 3] uint8 colors."""
+        if len(points) == 0:
+            return
+        self.num_points += len(points)
+        self._pending.append((self._hash(points), points, colors))
+        self._num_pending += len(points)
+        if self._num_pending >= max(len(self._keys), 1 << 22):
+            self._merge()
+
+    def num_voxels(self) -> int:
+        self._merge()
+        return len(self._keys)
+
+    def get_point_cloud(
+        self,
+    ) -> Tuple[onpt.NDArray[onp.float32], onpt.NDArray[onp.uint8]]:
+        """Voxel centroids and mean colors."""
+        self._merge()
+        counts = np.maximum(self._counts, 1)[:, None]
+        points = (self._position_sums / counts).astype(np.float32)
+        colors = np.round(self._color_sums / counts).astype(np.uint8)
+        return points, colors
+
+
 class Record3dLoader_Customized_Megasam:
     """Helper for loading frames for Record3D captures directly from a NPZ file."""
 
@@ -48,51 +261,133 @@ class Record3dLoader_Customized_Megasam:
     def num_frames(self) -> int:
         return len(self.images)
 
-    def get_frame(self, index: int) -> Record3dFrame:
-        # Read the depth for the given frame
-        depth = self.depths[index]
-        depth = depth.astype(np.float32)
+    def _frame_maps(
+        self, indices: Sequence[int]
+    ) -> Tuple[onpt.NDArray, onpt.NDArray, onpt.NDArray, onpt.NDArray, onpt.NDArray]:
+        """RGB, depth, mask, confidence and initial confidence of a batch of
+        frames, with the defaults used for missing arrays."""
+        indices = np.asarray(indices)
+
+        # Read the depth for the given frames
+        depth = self.depths[indices].astype(np.float32)
 
         # Check if conf file exists, otherwise initialize with ones
         if len(self.confidences) == 0:
             conf = np.ones_like(depth, dtype=np.float32)
         else:
-            conf = self.confidences[index]
-            conf = np.clip(conf, 0.0001, 99999)
+            conf = np.clip(self.confidences[indices], 0.0001, 99999)
 
-        # Check if init conf file exists, otherwise initialize with ones
+        # Check if init conf file exists, otherwise use conf
         if len(self.init_conf_data) == 0:
             init_conf = conf
         else:
-            init_conf = self.init_conf_data[index]
-            init_conf = np.clip(init_conf, 0.0001, 99999)
-        
-        # Check if mask exists, otherwise initialize with zeros
-        if len(self.masks) == 0:
-            mask = np.ones_like(depth, dtype=bool)
-        else:
-            mask = self.masks[index] > 0  # Assuming mask is a binary image
+            init_conf = np.clip(self.init_conf_data[indices], 0.0001, 99999)
 
-        if self.no_mask:
-            mask = np.ones_like(mask).astype(np.bool_)
+        # Check if mask exists, otherwise initialize with ones
+        if len(self.masks) == 0 or self.no_mask:
+            mask = np.ones(depth.shape, dtype=np.bool_)
+        else:
+            mask = self.masks[indices] > 0  # Assuming mask is a binary image
 
-        # Read RGB image
-        rgb = self.images[index]
+        # Read RGB images
+        rgb = self.images[indices]
         if rgb.shape[-1] == 4:
             rgb = rgb[..., :3]
 
+        return rgb, depth, mask, conf, init_conf
+
+    def get_frame(self, index: int) -> Record3dFrame:
+        rgb, depth, mask, conf, init_conf = self._frame_maps([index])
         return Record3dFrame(
             K=self.K[index],
-            rgb=rgb,
-            depth=depth,
-            mask=mask,
-            conf=conf,
-            init_conf=init_conf,
+            rgb=rgb[0],
+            depth=depth[0],
+            mask=mask[0],
+            conf=conf[0],
+            init_conf=init_conf[0],
             T_world_camera=self.T_world_cameras[index],
             conf_threshold=self.conf_threshold,
             foreground_conf_threshold=self.foreground_conf_threshold,
+            index=index,
         )
 
+    def get_point_clouds(
+        self,
+        indices: Optional[Sequence[int]] = None,
+        downsample_factor: int = 1,
+        bg_downsample_factor: int = 1,
+        batch_size: int = 32,
+    ) -> List[PointCloud]:
+        """Point clouds of many frames, unprojected `batch_size` frames at a
+        time. Same output as `get_frame(i).get_point_cloud(...)` for each
+        index (all frames by default)."""
+        if indices is None:
+            indices = range(self.num_frames())
+        indices = list(indices)
+        out: List[PointCloud] = []
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start : start + batch_size]
+            rgb, depth, mask, conf, init_conf = self._frame_maps(batch)
+            out.extend(
+                unproject(
+                    self.K[batch[0]],
+                    self.T_world_cameras[batch],
+                    rgb,
+                    depth,
+                    mask,
+                    conf,
+                    init_conf,
+                    np.asarray(batch),
+                    self.conf_threshold,
+                    self.foreground_conf_threshold,
+                    downsample_factor,
+                    bg_downsample_factor,
+                )
+            )
+        return out
+
+    def get_fused_background(
+        self,
+        voxel_size: float,
+        indices: Optional[Sequence[int]] = None,
+        downsample_factor: int = 1,
+        bg_downsample_factor: int = 1,
+        min_conf: float = 0.0,
+        conf_source: Literal["conf", "init_conf"] = "conf",
+        batch_size: int = 32,
+    ) -> Tuple[onpt.NDArray[onp.float32], onpt.NDArray[onp.uint8]]:
+        """Background points of many frames (all by default), fused into one
+        point per `voxel_size` voxel with averaged colors.
+
+        Background pixels must also have `conf_source` above `min_conf`, on
+        top of the loader's `conf_threshold`.
+        """
+        if indices is None:
+            indices = range(self.num_frames())
+        indices = list(indices)
+        fusion = VoxelFusion(voxel_size)
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start : start + batch_size]
+            rgb, depth, mask, conf, init_conf = self._frame_maps(batch)
+            if conf_source == "init_conf":
+                conf = init_conf
+            for _, _, bg_points, bg_colors in unproject(
+                self.K[batch[0]],
+                self.T_world_cameras[batch],
+                rgb,
+                depth,
+                mask,
+                conf,
+                init_conf,
+                np.asarray(batch),
+                max(self.conf_threshold, min_conf),
+                self.foreground_conf_threshold,
+                downsample_factor,
+                bg_downsample_factor,
+            ):
+                fusion.add(bg_points, bg_colors)
+        return fusion.get_point_cloud()
+
 
 @dataclasses.dataclass
 class Record3dFrame:
@@ -107,57 +402,22 @@ class Record3dFrame:
     T_world_camera: onpt.NDArray[onp.float32]
     conf_threshold: float = 1.0
     foreground_conf_threshold: float = 0.1
+    index: int = 0
 
     def get_point_cloud(
         self, downsample_factor: int = 1, bg_downsample_factor: int = 1,
-    ) -> Tuple[onpt.NDArray[onp.float32], onpt.NDArray[onp.uint8], onpt.NDArray[onp.float32], onpt.NDArray[onp.uint8]]:
-        rgb = self.rgb[::downsample_factor, ::downsample_factor]
-        depth = skimage.transform.resize(self.depth, rgb.shape[:2], order=0)
-        mask = cast(
-            onpt.NDArray[onp.bool_],
-            skimage.transform.resize(self.mask, rgb.shape[:2], order=0),
-        )
-        assert depth.shape == rgb.shape[:2]
-
-        K = self.K
-        T_world_camera = self.T_world_camera
-
-        img_wh = rgb.shape[:2][::-1]
-
-        grid = (
-            np.stack(np.meshgrid(np.arange(img_wh[0]), np.arange(img_wh[1])), 2) + 0.5
-        )
-        grid = grid * downsample_factor
-        conf_mask = self.conf > self.conf_threshold
-        if self.init_conf is not None:
-            fg_conf_mask = self.init_conf > self.foreground_conf_threshold
-        else:
-            fg_conf_mask = self.conf > self.foreground_conf_threshold
-        # reshape the conf mask to the shape of the depth
-        conf_mask = skimage.transform.resize(conf_mask, depth.shape, order=0)
-        fg_conf_mask = skimage.transform.resize(fg_conf_mask, depth.shape, order=0)
-
-        # Foreground points
-        homo_grid = np.pad(grid[fg_conf_mask & mask], ((0, 0), (0, 1)), constant_values=1)
-        local_dirs = np.einsum("ij,bj->bi", np.linalg.inv(K), homo_grid)
-        dirs = np.einsum("ij,bj->bi", T_world_camera[:3, :3], local_dirs)
-        points = (T_world_camera[:3, 3] + dirs * depth[fg_conf_mask & mask, None]).astype(np.float32)
-        point_colors = rgb[fg_conf_mask & mask]
-
-        # Background points
-        bg_homo_grid = np.pad(grid[conf_mask & ~mask], ((0, 0), (0, 1)), constant_values=1)
-        bg_local_dirs = np.einsum("ij,bj->bi", np.linalg.inv(K), bg_homo_grid)
-        bg_dirs = np.einsum("ij,bj->bi", T_world_camera[:3, :3], bg_local_dirs)
-        bg_points = (T_world_camera[:3, 3] + bg_dirs * depth[conf_mask & ~mask, None]).astype(np.float32)
-        bg_point_colors = rgb[conf_mask & ~mask]
-
-        if bg_downsample_factor > 1 and bg_points.shape[0] > 0:
-            indices = np.random.choice(
-                bg_points.shape[0],
-                size=bg_points.shape[0] // bg_downsample_factor,
-                replace=False
-            )
-            bg_points = bg_points[indices]
-            bg_point_colors = bg_point_colors[indices]
-
-        return points, point_colors, bg_points, bg_point_colors
+    ) -> PointCloud:
+        return unproject(
+            self.K,
+            self.T_world_camera[None],
+            self.rgb[None],
+            self.depth[None],
+            self.mask[None],
+            self.conf[None],
+            self.init_conf[None],
+            np.array([self.index]),
+            self.conf_threshold,
+            self.foreground_conf_threshold,
+            downsample_factor,
+            bg_downsample_factor,
+        )[0]
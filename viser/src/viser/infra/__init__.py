@@ -12,6 +12,8 @@ you're building a web-based application from scratch.
 """
 
 from ._infra import ClientId as ClientId
+from ._infra import ClientSendMetrics as ClientSendMetrics
+from ._infra import HeadlessMessageHandler as HeadlessMessageHandler
 from ._infra import WebsockClientConnection as WebsockClientConnection
 from ._infra import WebsockMessageHandler as WebsockMessageHandler
 from ._infra import WebsockServer as WebsockServer
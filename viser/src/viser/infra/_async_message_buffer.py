@@ -3,8 +3,10 @@ from __future__ import annotations
 import asyncio
 import dataclasses
 import threading
+import warnings
 from asyncio.events import AbstractEventLoop
-from typing import AsyncGenerator, Dict, List, Sequence
+from concurrent.futures import Executor
+from typing import AsyncGenerator, Dict, List, Optional, Sequence, Set, Tuple
 
 from ._messages import Message
 
@@ -13,7 +15,11 @@ from ._messages import Message
 class AsyncMessageBuffer:
     """Async iterable for keeping a persistent buffer of messages.
 
-    Uses heuristics on message names to automatically cull out redundant messages."""
+    Uses heuristics on message names to automatically cull out redundant messages.
+    Persistent buffers are also compacted: messages made obsolete by a later one,
+    for example the messages of a scene node that was removed, are dropped (see
+    `Message.purged_keys()`). If `max_persistent_nbytes` is set, the oldest large
+    messages are dropped to keep `buffered_nbytes` under it."""
 
     event_loop: AbstractEventLoop
     persistent_messages: bool
@@ -31,6 +37,22 @@ class AsyncMessageBuffer:
     window_duration_sec: float = 1.0 / 60.0
     done: bool = False
 
+    max_persistent_nbytes: Optional[int] = None
+    """Budget for `buffered_nbytes` in persistent buffers. None for no limit."""
+    buffered_nbytes: int = 0
+    """Approximate size of the messages in a persistent buffer."""
+    nbytes_from_id: Dict[int, int] = dataclasses.field(default_factory=dict)
+    ids_from_purge_key: Dict[str, Set[int]] = dataclasses.field(default_factory=dict)
+    warned_over_budget: bool = False
+
+    serialized_from_id: Dict[int, Dict[int, asyncio.Future[bytes]]] = dataclasses.field(
+        default_factory=dict
+    )
+    """Serialized persistent messages, by message ID and client API version.
+    Shared between clients that send the same message, and dropped once every
+    client has sent it. Only accessed from the event loop."""
+    last_sent_id_from_client: Dict[int, int] = dataclasses.field(default_factory=dict)
+
     def push(self, message: Message) -> None:
         """Push a new message to our buffer, and remove old redundant ones."""
 
@@ -39,6 +61,14 @@ class AsyncMessageBuffer:
         # Add message to buffer.
         redundancy_key = message.redundancy_key()
         with self.buffer_lock:
+            # Drop messages made obsolete by this one.
+            purged_keys = message.purged_keys() if self.persistent_messages else None
+            if purged_keys is not None:
+                for purge_key in tuple(self.ids_from_purge_key.keys()):
+                    if purged_keys(purge_key):
+                        for old_message_id in tuple(self.ids_from_purge_key[purge_key]):
+                            self._remove(old_message_id)
+
             new_message_id = self.message_counter
             self.message_from_id[new_message_id] = message
             self.message_counter += 1
@@ -49,13 +79,67 @@ class AsyncMessageBuffer:
                 redundancy_key is not None
                 and redundancy_key in self.id_from_redundancy_key
             ):
-                old_message_id = self.id_from_redundancy_key.pop(redundancy_key)
-                self.message_from_id.pop(old_message_id)
+                self._remove(self.id_from_redundancy_key[redundancy_key])
             self.id_from_redundancy_key[redundancy_key] = new_message_id
 
+            if self.persistent_messages:
+                self._track(new_message_id, message)
+
         # Pulse message event to notify consumers that a new message is available.
         self.event_loop.call_soon_threadsafe(self.message_event.set)
 
+    def _track(self, message_id: int, message: Message) -> None:
+        """Account for a new message in a persistent buffer, and enforce the byte
+        budget. Called with `buffer_lock` held."""
+        purge_key = message.purge_key()
+        if purge_key is not None:
+            self.ids_from_purge_key.setdefault(purge_key, set()).add(message_id)
+
+        nbytes = message.buffered_nbytes()
+        if nbytes == 0:
+            return
+        self.nbytes_from_id[message_id] = nbytes
+        self.buffered_nbytes += nbytes
+
+        if (
+            self.max_persistent_nbytes is None
+            or self.buffered_nbytes <= self.max_persistent_nbytes
+        ):
+            return
+        if not self.warned_over_budget:
+            self.warned_over_budget = True
+            warnings.warn(
+                f"[viser] Persistent messages exceed {self.max_persistent_nbytes}"
+                " bytes; dropping the oldest ones. Clients that connect from now on"
+                " may see an incomplete scene."
+            )
+        # Dicts are ordered by insertion, so the oldest messages come first. The
+        # newest message is kept even if it exceeds the budget on its own.
+        for old_message_id in tuple(self.nbytes_from_id.keys()):
+            if (
+                self.buffered_nbytes <= self.max_persistent_nbytes
+                or old_message_id == message_id
+            ):
+                break
+            self._remove(old_message_id)
+
+    def _remove(self, message_id: int) -> None:
+        """Remove a message from the buffer. Called with `buffer_lock` held."""
+        message = self.message_from_id.pop(message_id, None)
+        if message is None:
+            return
+        redundancy_key = message.redundancy_key()
+        if self.id_from_redundancy_key.get(redundancy_key, None) == message_id:
+            self.id_from_redundancy_key.pop(redundancy_key)
+
+        purge_key = message.purge_key()
+        if purge_key in self.ids_from_purge_key:
+            ids = self.ids_from_purge_key[purge_key]
+            ids.discard(message_id)
+            if len(ids) == 0:
+                self.ids_from_purge_key.pop(purge_key)
+        self.buffered_nbytes -= self.nbytes_from_id.pop(message_id, 0)
+
     def flush(self) -> None:
         """Flush the message buffer; signals to yield a message window immediately."""
         self.event_loop.call_soon_threadsafe(self.flush_event.set)
@@ -70,50 +154,96 @@ class AsyncMessageBuffer:
         # Pulse flush event to skip any windowing delay.
         self.event_loop.call_soon_threadsafe(self.flush_event.set)
 
+    def serialize(
+        self,
+        message_id: int,
+        message: Message,
+        client_api_version: int,
+        thread_executor: Executor,
+    ) -> asyncio.Future[bytes]:
+        """Serialize a message from a window on a thread executor, so large messages
+        don't block the event loop. For persistent buffers, the result is shared
+        with other clients that send the same message."""
+
+        def serialize() -> bytes:
+            return message.for_client_api_version(client_api_version).serialize()
+
+        if not self.persistent_messages:
+            return self.event_loop.run_in_executor(thread_executor, serialize)
+
+        serialized_from_version = self.serialized_from_id.setdefault(message_id, {})
+        if client_api_version not in serialized_from_version:
+            serialized_from_version[client_api_version] = (
+                self.event_loop.run_in_executor(thread_executor, serialize)
+            )
+        return serialized_from_version[client_api_version]
+
+    def _drop_sent_serializations(self) -> None:
+        """Drop serialized messages that every client has sent."""
+        if len(self.serialized_from_id) == 0:
+            return
+        min_sent_id = min(self.last_sent_id_from_client.values(), default=None)
+        for message_id in tuple(self.serialized_from_id.keys()):
+            if min_sent_id is None or message_id <= min_sent_id:
+                self.serialized_from_id.pop(message_id)
+
     async def window_generator(
         self, client_id: int
-    ) -> AsyncGenerator[Sequence[Message], None]:
-        """Async iterator over messages. Loops infinitely, and waits when no messages
-        are available."""
+    ) -> AsyncGenerator[Sequence[Tuple[int, Message]], None]:
+        """Async iterator over windows of (message ID, message) pairs. Loops
+        infinitely, and waits when no messages are available."""
 
         last_sent_id = -1
         flush_wait = asyncio.create_task(self.flush_event.wait())
-        while not self.done:
-            window: List[Message] = []
-            most_recent_message_id = self.message_counter - 1
-            while (
-                last_sent_id < most_recent_message_id
-                and len(window) < self.max_window_size
-            ):
-                last_sent_id += 1
+        try:
+            while not self.done:
+                # The previous window has been handled by the consumer.
                 if self.persistent_messages:
-                    message = self.message_from_id.get(last_sent_id, None)
+                    self.last_sent_id_from_client[client_id] = last_sent_id
+                    self._drop_sent_serializations()
+
+                window: List[Tuple[int, Message]] = []
+                most_recent_message_id = self.message_counter - 1
+                while (
+                    last_sent_id < most_recent_message_id
+                    and len(window) < self.max_window_size
+                ):
+                    last_sent_id += 1
+                    if self.persistent_messages:
+                        message = self.message_from_id.get(last_sent_id, None)
+                    else:
+                        # If we're not persisting messages, remove them from the buffer.
+                        with self.buffer_lock:
+                            message = self.message_from_id.pop(last_sent_id, None)
+                            if message is not None:
+                                redundancy_key = message.redundancy_key()
+                                self.id_from_redundancy_key.pop(redundancy_key, None)
+
+                    if (
+                        message is not None
+                        and message.excluded_self_client != client_id
+                    ):
+                        window.append((last_sent_id, message))
+
+                if len(window) > 0:
+                    # Yield a window!
+                    yield window
                 else:
-                    # If we're not persisting messages, remove them from the buffer.
-                    with self.buffer_lock:
-                        message = self.message_from_id.pop(last_sent_id, None)
-                        if message is not None:
-                            redundancy_key = message.redundancy_key()
-                            self.id_from_redundancy_key.pop(redundancy_key, None)
-
-                if message is not None and message.excluded_self_client != client_id:
-                    window.append(message)
-
-            if len(window) > 0:
-                # Yield a window!
-                yield window
-            else:
-                # Wait for a new message to come in.
-                await self.message_event.wait()
-                self.message_event.clear()
-
-            # Add a delay if either (a) we failed to yield or (b) there's currently no messages to send.
-            most_recent_message_id = self.message_counter - 1
-            if len(window) == 0 or most_recent_message_id == last_sent_id:
-                done, pending = await asyncio.wait(
-                    [flush_wait], timeout=self.window_duration_sec
-                )
-                del pending
-                if flush_wait in done and not self.done:
-                    self.flush_event.clear()
-                    flush_wait = asyncio.create_task(self.flush_event.wait())
+                    # Wait for a new message to come in.
+                    await self.message_event.wait()
+                    self.message_event.clear()
+
+                # Add a delay if either (a) we failed to yield or (b) there's currently no messages to send.
+                most_recent_message_id = self.message_counter - 1
+                if len(window) == 0 or most_recent_message_id == last_sent_id:
+                    done, pending = await asyncio.wait(
+                        [flush_wait], timeout=self.window_duration_sec
+                    )
+                    del pending
+                    if flush_wait in done and not self.done:
+                        self.flush_event.clear()
+                        flush_wait = asyncio.create_task(self.flush_event.wait())
+        finally:
+            flush_wait.cancel()
+            self.last_sent_id_from_client.pop(client_id, None)
+            self._drop_sent_serializations()
@@ -2,19 +2,22 @@ from __future__ import annotations
 
 import abc
 import asyncio
+import collections
 import contextlib
 import dataclasses
 import gzip
 import http
+import io
 import mimetypes
 import queue
 import threading
+import time
 from asyncio.events import AbstractEventLoop
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Callable, Generator, NewType, TypeVar
+from typing import Any, BinaryIO, Callable, Generator, NewType, TypeVar, cast
+from urllib.parse import parse_qs, urlparse
 
-import msgspec
 import rich
 import websockets.connection
 import websockets.datastructures
@@ -25,6 +28,89 @@ from websockets.legacy.server import WebSocketServerProtocol
 
 from ._async_message_buffer import AsyncMessageBuffer
 from ._messages import Message
+from ._recording import RecordingWriter
+
+
+@dataclasses.dataclass
+class ClientSendMetrics:
+    """Outgoing traffic of a connected client."""
+
+    queued_bytes: int = 0
+    """Serialized bytes waiting to be written to the websocket."""
+    peak_queued_bytes: int = 0
+    """Largest value of `queued_bytes` so far."""
+    sent_bytes: int = 0
+    """Total serialized bytes written to the websocket."""
+    sent_windows: int = 0
+    """Number of websocket messages sent. Each carries one or more messages."""
+    throttled_seconds: float = 0.0
+    """Time spent waiting for the client to catch up, during which messages
+    stay in their buffers, where redundant ones are culled."""
+
+
+_FRAGMENT_BYTES = 1024 * 1024
+
+
+class _ClientSendQueue:
+    """Outgoing websocket payloads of one client, with byte-based backpressure.
+
+    Producers wait in `put()` while the queue holds more than `max_queued_bytes`,
+    so a slow client stops pulling windows from its message buffers instead of
+    holding up other clients. A single payload larger than the limit is still
+    sent, once the queue is empty."""
+
+    def __init__(
+        self, websocket: WebSocketServerProtocol, max_queued_bytes: int
+    ) -> None:
+        self._websocket = websocket
+        self._max_queued_bytes = max_queued_bytes
+        self._payloads: collections.deque[bytes] = collections.deque()
+        self._changed = asyncio.Condition()
+        self.metrics = ClientSendMetrics()
+
+    def _has_room(self, num_bytes: int) -> bool:
+        return (
+            self.metrics.queued_bytes == 0
+            or self.metrics.queued_bytes + num_bytes <= self._max_queued_bytes
+        )
+
+    async def put(self, payload: bytes) -> None:
+        """Queue a payload, waiting first if the client is too far behind."""
+        async with self._changed:
+            if not self._has_room(len(payload)):
+                start_time = time.monotonic()
+                await self._changed.wait_for(lambda: self._has_room(len(payload)))
+                self.metrics.throttled_seconds += time.monotonic() - start_time
+            self._payloads.append(payload)
+            self.metrics.queued_bytes += len(payload)
+            self.metrics.peak_queued_bytes = max(
+                self.metrics.peak_queued_bytes, self.metrics.queued_bytes
+            )
+            self._changed.notify_all()
+
+    async def run(self) -> None:
+        """Write queued payloads to the websocket. Runs until the connection
+        closes."""
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self._payloads) > 0)
+                payload = self._payloads[0]
+            if len(payload) > _FRAGMENT_BYTES:
+                # Sending large payloads in fragments lets other clients' sends
+                # and incoming messages through in between.
+                view = memoryview(payload)
+                await self._websocket.send(
+                    view[i : i + _FRAGMENT_BYTES]
+                    for i in range(0, len(payload), _FRAGMENT_BYTES)
+                )
+            else:
+                await self._websocket.send(payload)
+            async with self._changed:
+                self._payloads.popleft()
+                self.metrics.queued_bytes -= len(payload)
+                self.metrics.sent_bytes += len(payload)
+                self.metrics.sent_windows += 1
+                self._changed.notify_all()
 
 
 @dataclasses.dataclass
@@ -33,6 +119,7 @@ class _ClientHandleState:
     # message_buffer: asyncio.Queue
     message_buffer: AsyncMessageBuffer
     event_loop: AbstractEventLoop
+    send_queue: _ClientSendQueue
 
 
 ClientId = NewType("ClientId", int)
@@ -42,16 +129,25 @@ TMessage = TypeVar("TMessage", bound=Message)
 class RecordHandle:
     """**Experimental.**
 
-    Handle for recording outgoing messages. Useful for logging + debugging."""
+    Handle for recording outgoing messages. Useful for logging + debugging.
+
+    Messages are written in compressed chunks as they are recorded (see
+    `RecordingWriter`): straight to disk if the recording was started with a
+    path, otherwise to memory."""
 
     def __init__(
-        self, handler: WebsockMessageHandler, filter: Callable[[Message], bool]
+        self,
+        handler: WebsockMessageHandler,
+        filter: Callable[[Message], bool],
+        path: Path | None = None,
     ):
         self._handler = handler
         self._filter = filter
         self._loop_start_index: int | None = None
         self._time: float = 0.0
-        self._messages: list[tuple[float, dict[str, Any]]] = []
+        self._path = path
+        self._file: BinaryIO = io.BytesIO() if path is None else path.open("wb")
+        self._writer = RecordingWriter(self._file)
 
     def _insert_message(self, message: Message) -> None:
         """Insert a message into the recorded file."""
@@ -59,7 +155,8 @@ class RecordHandle:
         # Exclude GUI messages. This is hacky.
         if not self._filter(message):
             return
-        self._messages.append((self._time, message.as_serializable_dict()))
+        for recorded in message.for_recording():
+            self._writer.insert(self._time, recorded)
 
     def insert_sleep(self, duration: float) -> None:
         """Insert a sleep into the recorded file."""
@@ -69,21 +166,26 @@ class RecordHandle:
         """Mark the start of the loop. Messages sent after this point will be
         looped. Should only be called once."""
         assert self._loop_start_index is None, "Loop start already set."
-        self._loop_start_index = len(self._messages)
+        self._loop_start_index = self._writer.num_messages()
+
+    def end(self) -> None:
+        """End the recording, and finish writing it."""
+        self._handler._record_handle = None
+        self._writer.close(self._time, self._loop_start_index)
+        if self._path is not None:
+            self._file.close()
 
     def end_and_serialize(self) -> bytes:
         """End the recording and serialize contents. Returns the recording as
-        bytes, which should generally be written to a file."""
-        packed_bytes = msgspec.msgpack.encode(
-            {
-                "loopStartIndex": self._loop_start_index,
-                "durationSeconds": self._time,
-                "messages": self._messages,
-            }
-        )
-        assert isinstance(packed_bytes, bytes)
-        self._handler._record_handle = None
-        return gzip.compress(packed_bytes, compresslevel=9)
+        bytes, which should generally be written to a file.
+
+        For recordings started with a path, prefer `end()`: the file already
+        holds the recording."""
+        self.end()
+        if self._path is not None:
+            return self._path.read_bytes()
+        assert isinstance(self._file, io.BytesIO)
+        return self._file.getvalue()
 
 
 class WebsockMessageHandler:
@@ -101,11 +203,14 @@ class WebsockMessageHandler:
         # Set to None if not recording.
         self._record_handle: RecordHandle | None = None
 
-    def start_recording(self, filter: Callable[[Message], bool]) -> RecordHandle:
+    def start_recording(
+        self, filter: Callable[[Message], bool], path: Path | None = None
+    ) -> RecordHandle:
         """Start recording messages that are sent. Sent messages will be
-        serialized and can be used for playback."""
+        serialized and can be used for playback. If `path` is set, they are
+        streamed to that file instead of kept in memory."""
         assert self._record_handle is None, "Already recording."
-        self._record_handle = RecordHandle(self, filter)
+        self._record_handle = RecordHandle(self, filter, path)
         return self._record_handle
 
     def register_handler(
@@ -208,6 +313,32 @@ class WebsockClientConnection(WebsockMessageHandler):
         """Send a message to a specific client."""
         self._state.message_buffer.push(message)
 
+    def get_send_metrics(self) -> ClientSendMetrics:
+        """Returns a snapshot of outgoing traffic to this client."""
+        return dataclasses.replace(self._state.send_queue.metrics)
+
+
+class HeadlessMessageHandler(WebsockMessageHandler):
+    """Message handler that isn't connected to any clients: no server is started,
+    and sent messages are dropped. Useful for recording messages with
+    `start_recording()`, for example in batch jobs."""
+
+    def __init__(self, thread_executor: ThreadPoolExecutor | None = None) -> None:
+        super().__init__(
+            thread_executor=ThreadPoolExecutor(max_workers=4)
+            if thread_executor is None
+            else thread_executor
+        )
+
+    @override
+    def unsafe_send_message(self, message: Message) -> None:
+        """Drop a message. Recorded messages were already recorded by
+        `queue_message()`."""
+        del message
+
+    def flush(self) -> None:
+        """No-op: there is no outgoing buffer to flush."""
+
 
 class WebsockServer(WebsockMessageHandler):
     """Websocket server abstraction. Communicates asynchronously with client
@@ -227,7 +358,20 @@ class WebsockServer(WebsockMessageHandler):
         http_server_root: Path to root for HTTP server.
         verbose: Toggle for print messages.
         client_api_version: Flag for backwards compatibility. 0 sends individual
-            messages. 1 sends windowed messages.
+            messages. 1 sends windowed messages. 2 sends windowed messages, and
+            lets messages use compact encodings (see
+            `Message.for_client_api_version()`). 3 adds level-of-detail point
+            clouds. Clients request an API version
+            with a `client_api_version` query parameter on the websocket URL
+            (default 1); each connection uses the lower of the two versions.
+        max_queued_bytes_per_client: Serialized bytes that can wait to be sent to
+            a client before we stop pulling messages for it. Messages are
+            serialized on the thread executor, and a slow client only holds up
+            its own messages.
+        max_persistent_bytes: Approximate budget for broadcasted messages kept for
+            clients that connect later. When exceeded, the oldest large messages are
+            dropped. None for no limit. Messages made obsolete by a later one, like
+            those of a removed scene node, are always dropped.
     """
 
     def __init__(
@@ -237,7 +381,9 @@ class WebsockServer(WebsockMessageHandler):
         message_class: type[Message] = Message,
         http_server_root: Path | None = None,
         verbose: bool = True,
-        client_api_version: Literal[0, 1] = 0,
+        client_api_version: Literal[0, 1, 2, 3] = 0,
+        max_queued_bytes_per_client: int = 32 * 1024 * 1024,
+        max_persistent_bytes: int | None = None,
     ):
         super().__init__(thread_executor=ThreadPoolExecutor(max_workers=32))
 
@@ -250,7 +396,9 @@ class WebsockServer(WebsockMessageHandler):
         self._message_class = message_class
         self._http_server_root = http_server_root
         self._verbose = verbose
-        self._client_api_version: Literal[0, 1] = client_api_version
+        self._client_api_version: Literal[0, 1, 2, 3] = client_api_version
+        self._max_queued_bytes_per_client = max_queued_bytes_per_client
+        self._max_persistent_bytes = max_persistent_bytes
         self._shutdown_event = threading.Event()
         self._ws_server: websockets.WebSocketServer | None = None
 
@@ -310,6 +458,19 @@ class WebsockServer(WebsockMessageHandler):
         messages will immediately be sent. (by default they are windowed)"""
         self._client_state_from_id[client_id].message_buffer.flush()
 
+    def get_persistent_buffer_size(self) -> tuple[int, int]:
+        """Returns the number of broadcasted messages kept for clients that connect
+        later, and their approximate size in bytes."""
+        buffer = self._broadcast_buffer
+        with buffer.buffer_lock:
+            return len(buffer.message_from_id), buffer.buffered_nbytes
+
+    def get_client_send_metrics(self, client_id: int) -> ClientSendMetrics:
+        """Returns a snapshot of outgoing traffic to a particular client."""
+        return dataclasses.replace(
+            self._client_state_from_id[client_id].send_queue.metrics
+        )
+
     def _background_worker(self, ready_sem: threading.Semaphore) -> None:
         host = self._host
         port = self._port
@@ -320,7 +481,9 @@ class WebsockServer(WebsockMessageHandler):
         event_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(event_loop)
         self._broadcast_buffer = AsyncMessageBuffer(
-            event_loop, persistent_messages=True
+            event_loop,
+            persistent_messages=True,
+            max_persistent_nbytes=self._max_persistent_bytes,
         )
 
         count_lock = asyncio.Lock()
@@ -343,12 +506,17 @@ class WebsockServer(WebsockMessageHandler):
                     f"[bold](viser)[/bold] Connection opened ({client_id},"
                     f" {total_connections} total),"
                     f" {len(self._broadcast_buffer.message_from_id)} persistent"
-                    " messages"
+                    f" messages ({self._broadcast_buffer.buffered_nbytes / 1e6:.1f} MB)"
                 )
 
+            client_api_version = _negotiate_client_api_version(
+                websocket.path, self._client_api_version
+            )
+
             client_state = _ClientHandleState(
                 AsyncMessageBuffer(event_loop, persistent_messages=False),
                 event_loop,
+                _ClientSendQueue(websocket, self._max_queued_bytes_per_client),
             )
             client_connection = WebsockClientConnection(
                 client_id, self._thread_executor, client_state
@@ -373,28 +541,41 @@ class WebsockServer(WebsockMessageHandler):
             for cb in self._client_connect_cb:
                 cb(client_connection)
 
-            try:
-                # For each client: infinite loop over producers (which send messages)
-                # and consumers (which receive messages).
-                await asyncio.gather(
+            # For each client: infinite loop over producers (which serialize
+            # messages), a sender (which sends them), and consumers (which receive
+            # messages).
+            tasks = [
+                asyncio.ensure_future(coro)
+                for coro in (
                     _message_producer(
-                        websocket,
+                        client_state.send_queue,
                         client_state.message_buffer,
                         client_id,
-                        self._client_api_version,
+                        client_api_version,
+                        self._thread_executor,
                     ),
                     _message_producer(
-                        websocket,
+                        client_state.send_queue,
                         self._broadcast_buffer,
                         client_id,
-                        self._client_api_version,
+                        client_api_version,
+                        self._thread_executor,
                     ),
+                    client_state.send_queue.run(),
                     _message_consumer(websocket, handle_incoming, message_class),
                 )
+            ]
+            try:
+                await asyncio.gather(*tasks)
             except (
                 websockets.exceptions.ConnectionClosedOK,
                 websockets.exceptions.ConnectionClosedError,
             ):
+                # Stop the producers, which may be waiting for new messages or for
+                # room in the send queue.
+                for task in tasks:
+                    task.cancel()
+
                 # We use a sentinel value to signal that the client producer thread
                 # should exit.
                 #
@@ -413,7 +594,9 @@ class WebsockServer(WebsockMessageHandler):
                 if self._verbose:
                     rich.print(
                         f"[bold](viser)[/bold] Connection closed ({client_id},"
-                        f" {total_connections} total)"
+                        f" {total_connections} total),"
+                        f" {client_state.send_queue.metrics.sent_bytes / 1e6:.1f} MB"
+                        " sent"
                     )
 
         # Host client on the same port as the websocket.
@@ -496,29 +679,65 @@ class WebsockServer(WebsockMessageHandler):
         rich.print("[bold](viser)[/bold] Server stopped")
 
 
+def _negotiate_client_api_version(
+    path: str, server_api_version: Literal[0, 1, 2, 3]
+) -> Literal[0, 1, 2, 3]:
+    """Lower of the server API version and the one requested in the websocket URL.
+    Clients that don't request a version are assumed to speak version 1."""
+    requested = parse_qs(urlparse(path).query).get("client_api_version", ["1"])[0]
+    try:
+        requested_version = int(requested)
+    except ValueError:
+        requested_version = 1
+    return cast(Literal[0, 1, 2, 3], max(0, min(server_api_version, requested_version)))
+
+
+def _msgpack_array_header(length: int) -> bytes:
+    """Header of a msgpack array; followed by the serialized elements."""
+    if length < 16:
+        return bytes([0x90 | length])
+    elif length < 2**16:
+        return b"\xdc" + length.to_bytes(2, "big")
+    else:
+        return b"\xdd" + length.to_bytes(4, "big")
+
+
 async def _message_producer(
-    websocket: WebSocketServerProtocol,
+    send_queue: _ClientSendQueue,
     buffer: AsyncMessageBuffer,
     client_id: int,
-    client_api_version: Literal[0, 1],
+    client_api_version: Literal[0, 1, 2, 3],
+    thread_executor: ThreadPoolExecutor,
 ) -> None:
-    """Infinite loop to broadcast windows of messages from a buffer."""
+    """Infinite loop to serialize windows of messages from a buffer, and queue them
+    for sending."""
     window_generator = buffer.window_generator(client_id)
-    while not buffer.done:
-        outgoing = await window_generator.__anext__()
-        if client_api_version == 1:
-            serialized = msgspec.msgpack.encode(
-                tuple(message.as_serializable_dict() for message in outgoing)
-            )
-            assert isinstance(serialized, bytes)
-            await websocket.send(serialized)
-        elif client_api_version == 0:
-            for msg in outgoing:
-                serialized = msgspec.msgpack.encode(msg.as_serializable_dict())
-                assert isinstance(serialized, bytes)
-                await websocket.send(serialized)
-        else:
-            assert_never(client_api_version)
+    try:
+        while not buffer.done:
+            outgoing = await window_generator.__anext__()
+
+            # Messages are serialized on the thread executor. Results can be
+            # shared with other clients, so we shield them from cancellation.
+            futures = [
+                buffer.serialize(
+                    message_id, message, client_api_version, thread_executor
+                )
+                for message_id, message in outgoing
+            ]
+            serialized = [await asyncio.shield(future) for future in futures]
+            if client_api_version in (1, 2, 3):
+                # A msgpack array of messages is its header followed by the
+                # serialized messages.
+                await send_queue.put(
+                    b"".join([_msgpack_array_header(len(serialized))] + serialized)
+                )
+            elif client_api_version == 0:
+                for payload in serialized:
+                    await send_queue.put(payload)
+            else:
+                assert_never(client_api_version)
+    finally:
+        await window_generator.aclose()
 
 
 async def _message_consumer(
@@ -5,8 +5,19 @@ from __future__ import annotations
 
 import abc
 import functools
+import threading
 import warnings
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Type, TypeVar, cast
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Type,
+    TypeVar,
+    cast,
+)
 
 import msgspec
 import numpy as onp
@@ -18,6 +29,35 @@ else:
     ClientId = Any
 
 
+class DeferredBytes:
+    """Value for a `bytes` message field that is computed when the message is first
+    serialized, instead of when it's created. Servers serialize messages on their
+    thread executor (see `AsyncMessageBuffer.serialize()`), so expensive encodes,
+    like those of images, don't run on the thread that queued the message. The
+    result is computed once, and shared by every client and recording."""
+
+    def __init__(self, compute: Callable[[], bytes], nbytes: int) -> None:
+        self._lock = threading.Lock()
+        self._compute: Optional[Callable[[], bytes]] = compute
+        self._value: Optional[bytes] = None
+        self._nbytes = nbytes
+
+    def nbytes(self) -> int:
+        """Size of the bytes once computed, and the estimate passed in before."""
+        return self._nbytes
+
+    def get(self) -> bytes:
+        """Compute the bytes if needed, and return them."""
+        with self._lock:
+            if self._value is None:
+                assert self._compute is not None
+                self._value = self._compute()
+                # Release the inputs of the computation.
+                self._compute = None
+                self._nbytes = len(self._value)
+            return self._value
+
+
 def _prepare_for_deserialization(value: Any, annotation: Type) -> Any:
     # If annotated as a float but we got an integer, cast to float. These
     # are both `number` in Javascript.
@@ -46,6 +86,9 @@ def _prepare_for_deserialization(value: Any, annotation: Type) -> Any:
 
 def _prepare_for_serialization(value: Any, annotation: object) -> Any:
     """Prepare any special types for serialization."""
+    if isinstance(value, DeferredBytes):
+        return value.get()
+
     if annotation is Any:
         annotation = type(value)
 
@@ -94,6 +137,21 @@ def _prepare_for_serialization(value: Any, annotation: object) -> Any:
     return value
 
 
+def payload_nbytes(message: Message) -> int:
+    """Approximate size of a message: the sum of its array and bytes fields."""
+    nbytes = 0
+    for key, value in vars(message).items():
+        if key.startswith("_"):
+            continue
+        if isinstance(value, onp.ndarray):
+            nbytes += value.nbytes
+        elif isinstance(value, (bytes, bytearray)):
+            nbytes += len(value)
+        elif isinstance(value, DeferredBytes):
+            nbytes += value.nbytes()
+    return nbytes
+
+
 T = TypeVar("T", bound="Message")
 
 
@@ -110,15 +168,43 @@ class Message(abc.ABC):
     send synchronization information to other clients."""
 
     def as_serializable_dict(self) -> Dict[str, Any]:
-        """Convert a Python Message object into bytes."""
+        """Convert a Python Message object into bytes. Attributes with a leading
+        underscore are server-side only, and are not serialized."""
         message_type = type(self)
         hints = get_type_hints_cached(message_type)
         out = {
-            k: _prepare_for_serialization(v, hints[k]) for k, v in vars(self).items()
+            k: _prepare_for_serialization(v, hints[k])
+            for k, v in vars(self).items()
+            if not k.startswith("_")
         }
         out["type"] = message_type.__name__
         return out
 
+    def serialize(self) -> bytes:
+        """Convert a Python Message object into msgpack bytes."""
+        serialized = msgspec.msgpack.encode(self.as_serializable_dict())
+        assert isinstance(serialized, bytes)
+        return serialized
+
+    def for_client_api_version(self, client_api_version: int) -> Message:
+        """Returns the form of this message understood by a client speaking
+        `client_api_version`. Messages introduced by newer API versions override
+        this to fall back to an older equivalent."""
+        del client_api_version
+        return self
+
+    def for_recording(self) -> List[Message]:
+        """Returns the messages to record in place of this one. Recordings are
+        played back without a server, so messages whose content clients
+        normally request later override this to include that content."""
+        return [self]
+
+    def buffered_nbytes(self) -> int:
+        """Approximate memory kept alive by this message while it is held in a
+        persistent buffer. Messages that reference server-side data override this
+        to count it."""
+        return payload_nbytes(self)
+
     @classmethod
     def _from_serializable_dict(cls, mapping: Dict[str, Any]) -> Dict[str, Any]:
         """Convert a dict message back into a Python Message object."""
@@ -169,6 +255,18 @@ class Message(abc.ABC):
 
         return _get_subclasses(cls)
 
+    def purge_key(self) -> Optional[str]:
+        """Returns the key of the entity this message belongs to, for example a scene
+        node name, or None. Persistent buffers drop messages whose key is matched by
+        `purged_keys()` of a later message."""
+        return None
+
+    def purged_keys(self) -> Optional[Callable[[str], bool]]:
+        """Returns a predicate over purge keys if this message makes earlier messages
+        obsolete, for example because it removes what they created. None for most
+        messages."""
+        return None
+
     @abc.abstractmethod
     def redundancy_key(self) -> str:
         """Returns a unique key for this message, used for detecting redundant
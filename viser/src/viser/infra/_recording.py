@@ -0,0 +1,199 @@
+"""Chunked, seekable recordings of outgoing messages.
+
+A recording file is laid out as:
+
+- A header: `RECORDING_MAGIC`, then the format version as a little-endian uint32.
+- Records, each zlib-compressed unless compression doesn't help:
+    - Chunks: msgpack arrays of `[time, message]` pairs, where `message` is the
+      serialized message dictionary.
+    - Blobs: large `bytes` fields of messages (arrays, images, ...), stored once
+      per distinct content. Messages refer to them with a msgpack extension of
+      type `BLOB_EXT_TYPE`, whose data is the blob index as a uint32.
+- An index, as an uncompressed msgpack map. See `RecordingWriter.close()`.
+- A footer: the byte offset of the index as a uint64, then `INDEX_MAGIC`.
+
+Chunks and blobs are written as messages come in, so memory use stays bounded
+and finishing a recording only writes the last chunk and the index. The index
+gives the time and message range of each chunk, for playback to seek without
+decoding everything before it."""
+
+from __future__ import annotations
+
+import hashlib
+import struct
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, BinaryIO
+
+import msgspec
+
+from ._messages import Message, payload_nbytes
+
+RECORDING_MAGIC = b"VISERREC"
+INDEX_MAGIC = b"VISERIDX"
+FORMAT_VERSION = 1
+BLOB_EXT_TYPE = 1
+
+_COMPRESSION_SAMPLE_BYTES = 64 * 1024
+
+
+class RecordingWriter:
+    """Writes messages to a recording file incrementally.
+
+    Serialization, deduplication, and compression run on a background thread,
+    in the order messages were inserted.
+
+    Args:
+        file: Binary file to write to. Must be seekable for `tell()`.
+        chunk_bytes: Approximate uncompressed size of message chunks. Recording
+            waits while more than `max_pending_chunks` of them are being written.
+        compress_level: zlib compression level. Low levels are much faster and
+            lose little: most of a recording is float arrays and encoded images.
+        blob_min_bytes: `bytes` fields at least this large are stored as blobs,
+            deduplicated by content hash.
+    """
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        chunk_bytes: int = 4 * 1024 * 1024,
+        compress_level: int = 1,
+        blob_min_bytes: int = 16 * 1024,
+        max_pending_chunks: int = 8,
+    ) -> None:
+        self._file = file
+        self._chunk_bytes = chunk_bytes
+        self._compress_level = compress_level
+        self._blob_min_bytes = blob_min_bytes
+
+        self._lock = threading.Lock()
+        self._pending: list[tuple[float, Message]] = []
+        self._pending_bytes = 0
+        self._num_messages = 0
+        self._futures: list[Future[None]] = []
+        self._max_pending_chunks = max_pending_chunks
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        # Only accessed from the background thread.
+        self._chunks: list[tuple[int, int, bool, float, int, int]] = []
+        self._blobs: list[tuple[int, int, bool]] = []
+        self._blob_from_hash: dict[bytes, int] = {}
+
+        self._file.write(RECORDING_MAGIC + struct.pack("<I", FORMAT_VERSION))
+
+    def num_messages(self) -> int:
+        """Number of messages inserted so far."""
+        return self._num_messages
+
+    def insert(self, time: float, message: Message) -> None:
+        """Append a message, sent at `time` seconds into the recording."""
+        with self._lock:
+            self._pending.append((time, message))
+            self._pending_bytes += payload_nbytes(message) + 64
+            self._num_messages += 1
+            if self._pending_bytes >= self._chunk_bytes:
+                self._flush()
+
+    def _flush(self) -> None:
+        """Hand pending messages to the background thread. Called with the lock
+        held."""
+        if len(self._pending) == 0:
+            return
+        start_index = self._num_messages - len(self._pending)
+        self._futures.append(
+            self._executor.submit(self._write_chunk, start_index, self._pending)
+        )
+        self._pending = []
+        self._pending_bytes = 0
+
+        # Surface errors early, don't hold on to finished futures, and bound the
+        # memory held by messages that are waiting to be written.
+        for future in [f for f in self._futures if f.done()]:
+            future.result()
+            self._futures.remove(future)
+        while len(self._futures) > self._max_pending_chunks:
+            self._futures.pop(0).result()
+
+    def _write_record(self, data: bytes | memoryview) -> tuple[int, int, bool]:
+        """Write a record, compressed if that helps. Returns (offset, length,
+        compressed)."""
+        offset = self._file.tell()
+
+        # Noisy data like float positions barely compresses; check a sample
+        # before spending time on all of it.
+        sample = data[:_COMPRESSION_SAMPLE_BYTES]
+        if len(zlib.compress(sample, self._compress_level)) < 0.9 * len(sample):
+            compressed = zlib.compress(data, self._compress_level)
+            if len(compressed) < 0.9 * len(data):
+                self._file.write(compressed)
+                return (offset, len(compressed), True)
+
+        self._file.write(data)
+        return (offset, len(data), False)
+
+    def _blob_ref(self, data: bytes | memoryview) -> msgspec.msgpack.Ext:
+        key = hashlib.blake2b(data, digest_size=16).digest() + struct.pack(
+            "<Q", len(data)
+        )
+        if key not in self._blob_from_hash:
+            self._blob_from_hash[key] = len(self._blobs)
+            self._blobs.append(self._write_record(data))
+        return msgspec.msgpack.Ext(
+            BLOB_EXT_TYPE, struct.pack("<I", self._blob_from_hash[key])
+        )
+
+    def _write_chunk(
+        self, start_index: int, messages: list[tuple[float, Message]]
+    ) -> None:
+        entries: list[tuple[float, dict[str, Any]]] = []
+        for time, message in messages:
+            serializable = message.as_serializable_dict()
+            for key, value in serializable.items():
+                if isinstance(value, memoryview):
+                    # Arrays are serialized as memoryviews of their data.
+                    value = value.cast("B")
+                if (
+                    isinstance(value, (bytes, memoryview))
+                    and len(value) >= self._blob_min_bytes
+                ):
+                    serializable[key] = self._blob_ref(value)
+            entries.append((time, serializable))
+        offset, length, compressed = self._write_record(msgspec.msgpack.encode(entries))
+        self._chunks.append(
+            (offset, length, compressed, messages[0][0], start_index, len(messages))
+        )
+
+    def close(self, duration_seconds: float, loop_start_index: int | None) -> None:
+        """Write remaining messages, the index, and the footer. The index is a map
+        with keys:
+
+        - `version`: format version.
+        - `durationSeconds`: duration of the recording.
+        - `loopStartIndex`: index of the first message of the looped part, or None.
+        - `numMessages`: total number of messages.
+        - `chunks`: `[offset, length, compressed, start time, index of the first
+          message, number of messages]` for each chunk, in order.
+        - `blobs`: `[offset, length, compressed]` for each blob.
+        """
+        with self._lock:
+            self._flush()
+        self._executor.shutdown(wait=True)
+        for future in self._futures:
+            future.result()
+
+        index_offset = self._file.tell()
+        self._file.write(
+            msgspec.msgpack.encode(
+                {
+                    "version": FORMAT_VERSION,
+                    "durationSeconds": duration_seconds,
+                    "loopStartIndex": loop_start_index,
+                    "numMessages": self._num_messages,
+                    "chunks": self._chunks,
+                    "blobs": self._blobs,
+                }
+            )
+        )
+        self._file.write(struct.pack("<Q", index_offset) + INDEX_MAGIC)
+        self._file.flush()
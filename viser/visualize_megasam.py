@@ -1,7 +1,14 @@
+from __future__ import annotations
+
 import time
 import sys
 import argparse
+import dataclasses
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Literal
 
 import numpy as onp
 import tyro
@@ -15,7 +22,171 @@ import matplotlib.cm as cm  # For colormap
 import os
 import cv2
 import numpy as np
-import argparse
+
+
+@dataclasses.dataclass
+class FrameData:
+    """Everything needed to add one timestep to the scene."""
+
+    points: onp.ndarray
+    colors: onp.ndarray
+    bg_points: onp.ndarray
+    bg_colors: onp.ndarray
+    fov: float
+    aspect: float
+    image: onp.ndarray
+    wxyz: onp.ndarray
+    position: onp.ndarray
+    frustum_color: tuple[float, float, float]
+
+
+class FrameStreamer:
+    """Streams the frames around the playback cursor to each connected client.
+
+    Frames are sent with the per-client scene API, so they never enter the
+    server's persistent broadcast buffer. Each client holds at most the
+    frames in `[cursor - window, cursor + window]`; frames leaving the
+    window are removed from the client. The server prepares frames up to
+    `prefetch` steps past the window on a thread pool and drops prepared
+    frames that fall out of range.
+    """
+
+    def __init__(
+        self,
+        server: viser.ViserServer,
+        num_frames: int,
+        load_frame: Callable[[int], FrameData],
+        add_frame: Callable[[viser.SceneApi, int, FrameData, bool], viser.FrameHandle],
+        window: int,
+        prefetch: int,
+        num_workers: int,
+    ) -> None:
+        self._num_frames = num_frames
+        self._load_frame = load_frame
+        self._add_frame = add_frame
+        self._window = window
+        self._prefetch = prefetch
+        self._executor = ThreadPoolExecutor(max_workers=num_workers)
+        self._prepared: dict[int, Future[FrameData]] = {}
+        self._clients: dict[int, viser.ClientHandle] = {}
+        self._sent: dict[int, dict[int, viser.FrameHandle]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._cursor = 0
+
+        @server.on_client_connect
+        def _(client: viser.ClientHandle) -> None:
+            with self._lock:
+                self._clients[client.client_id] = client
+            self._wake.set()
+
+        @server.on_client_disconnect
+        def _(client: viser.ClientHandle) -> None:
+            with self._lock:
+                self._clients.pop(client.client_id, None)
+
+        threading.Thread(target=self._run, daemon=True).start()
+        self._wake.set()
+
+    def set_cursor(self, timestep: int) -> None:
+        self._cursor = timestep
+        self._wake.set()
+
+    def _indices(self, cursor: int, ahead: int) -> list[int]:
+        """Frame indices around the cursor: the cursor first, then the frames
+        ahead of it (playback wraps around), then the frames behind it."""
+        offsets = list(range(ahead + 1)) + [-d for d in range(1, self._window + 1)]
+        out: list[int] = []
+        for offset in offsets:
+            i = (cursor + offset) % self._num_frames
+            if i not in out:
+                out.append(i)
+        return out
+
+    def _prepare(self, cursor: int) -> None:
+        wanted = self._indices(cursor, self._window + self._prefetch)
+        for i in list(self._prepared.keys()):
+            if i not in wanted:
+                self._prepared.pop(i).cancel()
+        for i in wanted:
+            if i not in self._prepared:
+                self._prepared[i] = self._executor.submit(self._load_frame, i)
+
+    def _run(self) -> None:
+        # This is the only streaming thread: errors are logged, and must never
+        # stop the loop.
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self._update(self._cursor)
+            except Exception:
+                print("[FrameStreamer] Error while streaming frames:")
+                traceback.print_exc()
+
+    def _client_failed(self, client: viser.ClientHandle) -> None:
+        """Forget what was sent to a client after a failed send. Frames are sent
+        again if it's still connected."""
+        self._sent.pop(client.client_id, None)
+        with self._lock:
+            connected = client.client_id in self._clients
+        if connected:
+            print(f"[FrameStreamer] Error while sending to client {client.client_id}:")
+            traceback.print_exc()
+
+    def _update(self, cursor: int) -> None:
+        self._prepare(cursor)
+        keep = self._indices(cursor, self._window)
+
+        with self._lock:
+            clients = list(self._clients.values())
+        for client_id in list(self._sent.keys()):
+            if client_id not in self._clients:
+                del self._sent[client_id]
+
+        # Evict frames outside of the window and show the cursor frame.
+        for client in clients:
+            sent = self._sent.setdefault(client.client_id, {})
+            try:
+                with client.atomic():
+                    for i in list(sent.keys()):
+                        if i not in keep:
+                            sent.pop(i).remove()
+                        else:
+                            sent[i].visible = i == cursor
+                client.flush()
+            except Exception:
+                self._client_failed(client)
+
+        # Send missing frames, nearest first. Stop early if the cursor
+        # moves; the next iteration picks up from the new cursor.
+        for i in keep:
+            if self._cursor != cursor:
+                break
+            missing = [
+                c
+                for c in clients
+                if c.client_id in self._sent and i not in self._sent[c.client_id]
+            ]
+            if len(missing) == 0:
+                continue
+            try:
+                data = self._prepared[i].result()
+            except Exception:
+                # Load it again next time it's needed.
+                self._prepared.pop(i, None)
+                print(f"[FrameStreamer] Failed to load frame {i}:")
+                traceback.print_exc()
+                continue
+            for client in missing:
+                try:
+                    self._sent[client.client_id][i] = self._add_frame(
+                        client.scene, i, data, i == cursor
+                    )
+                    client.flush()
+                except Exception:
+                    self._client_failed(client)
+
 
 def main(
     data: Path = "./demo_tmp/NULL.npz",
@@ -32,7 +203,34 @@ def main(
     bg_downsample_factor: int = 1,
     init_conf: bool = False,
     cam_thickness: float = 1.5,
+    point_precision: Literal["float32", "int16"] = "int16",
+    stream: bool = False,
+    stream_window: int = 8,
+    stream_prefetch: int = 16,
+    stream_workers: int = 2,
+    bg_voxel_size: float = 0.0,
+    bg_min_conf: float = 0.0,
+    bg_conf_source: Literal["conf", "init_conf"] = "conf",
+    bg_lod: bool = False,
 ) -> None:
+    """Visualize a MegaSaM reconstruction.
+
+    With `stream`, frames are prepared and sent lazily around the playback
+    cursor (`stream_window` frames on each side, `stream_prefetch` more
+    prepared ahead on `stream_workers` threads) instead of all up front.
+    "Show all frames" and "Record Scene" need every frame in the scene and
+    are disabled in this mode.
+
+    With `bg_voxel_size` > 0, the background points of all frames are fused
+    into one point per voxel of that size (colors averaged) instead of being
+    concatenated; fused pixels must also have `bg_conf_source` above
+    `bg_min_conf`.
+
+    With `bg_lod`, the background is sent as a level-of-detail point cloud:
+    the browser starts from a coarse subset and requests octree nodes by
+    view frustum and screen-space error, so multi-million point backgrounds
+    stay interactive.
+    """
     from pathlib import Path  # <-- Import Path here if not already imported
 
     data = np.load(data)
@@ -88,7 +286,9 @@ def main(
 
     # Add recording UI.
     with server.gui.add_folder("Recording"):
-        gui_record_scene = server.gui.add_button("Record Scene")
+        gui_record_scene = server.gui.add_button("Record Scene", disabled=stream)
+    if stream:
+        gui_show_all_frames.disabled = True
 
     # Frame step buttons.
     @gui_next_frame.on_click
@@ -111,7 +311,9 @@ def main(
     def _(_) -> None:
         nonlocal prev_timestep
         current_timestep = gui_timestep.value
-        if not gui_show_all_frames.value:
+        if streamer is not None:
+            streamer.set_cursor(current_timestep)
+        elif not gui_show_all_frames.value:
             with server.atomic():
                 frame_nodes[current_timestep].visible = True
                 frame_nodes[prev_timestep].visible = False
@@ -163,7 +365,11 @@ def main(
         # Save the original frame visibility state
         original_visibility = [frame_node.visible for frame_node in frame_nodes]
 
-        rec = server._start_scene_recording()
+        # Messages are streamed to the file while recording.
+        output_path = Path(f"./viser_result/recording_{str(data).split('/')[-1]}.viser")
+        # make sure the output directory exists
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        rec = server._start_scene_recording(output_path)
         rec.set_loop_start()
         
         # Determine sleep duration based on current FPS
@@ -191,13 +397,7 @@ def main(
                 frame_node.visible = False
         
         # Finish recording
-        bs = rec.end_and_serialize()
-        
-        # Save the recording to a file
-        output_path = Path(f"./viser_result/recording_{str(data).split('/')[-1]}.viser")
-        # make sure the output directory exists
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        output_path.write_bytes(bs)
+        rec.end()
         print(f"Recording saved to {output_path.resolve()}")
         
         # Restore the original frame visibility state
@@ -215,72 +415,136 @@ def main(
         position=(0, 0, 0),
         show_axes=False,
     )
-    frame_nodes: list[viser.FrameHandle] = []
-    bg_positions = []
-    bg_colors = []
-    for i in tqdm(range(num_frames)):
+    def load_frame(i: int, point_cloud: tuple | None = None) -> FrameData:
         frame = loader.get_frame(i)
-        position, color, bg_position, bg_color = frame.get_point_cloud(downsample_factor, bg_downsample_factor)
+        if point_cloud is None:
+            point_cloud = frame.get_point_cloud(downsample_factor, bg_downsample_factor)
+        position, color, bg_position, bg_color = point_cloud
 
-        bg_positions.append(bg_position)
-        bg_colors.append(bg_color)
+        # Compute color for frustum based on frame index.
+        norm_i = i / (num_frames - 1) if num_frames > 1 else 0  # Normalize index to [0, 1]
+        color_rgba = cm.viridis(norm_i)  # Get RGBA color from colormap
 
+        return FrameData(
+            points=position,
+            colors=color,
+            bg_points=bg_position,
+            bg_colors=bg_color,
+            fov=2 * onp.arctan2(frame.rgb.shape[0] / 2, frame.K[0, 0]),
+            aspect=frame.rgb.shape[1] / frame.rgb.shape[0],
+            image=frame.rgb[::downsample_factor, ::downsample_factor],
+            wxyz=tf.SO3.from_matrix(frame.T_world_camera[:3, :3]).wxyz,
+            position=frame.T_world_camera[:3, 3],
+            frustum_color=color_rgba[:3],  # Use RGB components
+        )
+
+    def add_frame(
+        scene: viser.SceneApi, i: int, data: FrameData, visible: bool
+    ) -> viser.FrameHandle:
         # Add base frame.
-        frame_nodes.append(server.scene.add_frame(f"/frames/t{i}", show_axes=False))
+        frame_node = scene.add_frame(f"/frames/t{i}", show_axes=False, visible=visible)
 
         # Place the point cloud in the frame.
-        server.scene.add_point_cloud(
+        scene.add_point_cloud(
             name=f"/frames/t{i}/point_cloud",
-            points=position,
-            colors=color,
+            points=data.points,
+            colors=data.colors,
             point_size=point_size,
             point_shape="rounded",
+            precision=point_precision,
         )
 
-        # Compute color for frustum based on frame index.
-        norm_i = i / (num_frames - 1) if num_frames > 1 else 0  # Normalize index to [0, 1]
-        color_rgba = cm.viridis(norm_i)  # Get RGBA color from colormap
-        color_rgb = color_rgba[:3]  # Use RGB components
-
         # Place the frustum with the computed color.
-        fov = 2 * onp.arctan2(frame.rgb.shape[0] / 2, frame.K[0, 0])
-        aspect = frame.rgb.shape[1] / frame.rgb.shape[0]
-        server.scene.add_camera_frustum(
+        scene.add_camera_frustum(
             f"/frames/t{i}/frustum",
-            fov=fov,
-            aspect=aspect,
+            fov=data.fov,
+            aspect=data.aspect,
             scale=camera_frustum_scale,
-            image=frame.rgb[::downsample_factor, ::downsample_factor],
-            wxyz=tf.SO3.from_matrix(frame.T_world_camera[:3, :3]).wxyz,
-            position=frame.T_world_camera[:3, 3],
-            color=color_rgb,  # Set the color for the frustum
+            image=data.image,
+            wxyz=data.wxyz,
+            position=data.position,
+            color=data.frustum_color,  # Set the color for the frustum
             thickness=cam_thickness,
         )
 
         # Add some axes. (Commented out to hide coordinate axes)
-        # server.scene.add_frame(
+        # scene.add_frame(
         #     f"/frames/t{i}/frustum/axes",
         #     axes_length=camera_frustum_scale * axes_scale * 10,
         #     axes_radius=camera_frustum_scale * axes_scale,
         # )
+        return frame_node
 
-    # Initialize frame visibility.
-    for i, frame_node in enumerate(frame_nodes):
-        if gui_show_all_frames.value:
-            frame_node.visible = (i % gui_stride.value == 0)
+    def add_background(point_clouds: list | None = None) -> None:
+        if bg_voxel_size > 0.0:
+            bg_positions, bg_colors = loader.get_fused_background(
+                bg_voxel_size,
+                range(num_frames),
+                downsample_factor,
+                bg_downsample_factor,
+                min_conf=bg_min_conf,
+                conf_source=bg_conf_source,
+            )
+            print(f"Fused background: {len(bg_positions)} voxels of {bg_voxel_size}")
         else:
-            frame_node.visible = i == gui_timestep.value
-
-    # Add background frame.
-    bg_positions = onp.concatenate(bg_positions, axis=0)
-    bg_colors = onp.concatenate(bg_colors, axis=0)
-    server.scene.add_point_cloud(
-        name=f"/frames/background",
-        points=bg_positions,
-        colors=bg_colors,
-        point_size=point_size,
-        point_shape="rounded",
-    )
+            if point_clouds is None:
+                point_clouds = loader.get_point_clouds(
+                    range(num_frames), downsample_factor, bg_downsample_factor
+                )
+            bg_positions = onp.concatenate([pc[2] for pc in point_clouds], axis=0)
+            bg_colors = onp.concatenate([pc[3] for pc in point_clouds], axis=0)
+        if bg_lod:
+            server.scene.add_point_cloud_lod(
+                name="/frames/background",
+                points=bg_positions,
+                colors=bg_colors,
+                point_size=point_size,
+                point_shape="rounded",
+            )
+            return
+        server.scene.add_point_cloud(
+            name=f"/frames/background",
+            points=bg_positions,
+            colors=bg_colors,
+            point_size=point_size,
+            point_shape="rounded",
+            precision=point_precision,
+        )
+
+    frame_nodes: list[viser.FrameHandle] = []
+    streamer: FrameStreamer | None = None
+    if stream:
+        streamer = FrameStreamer(
+            server,
+            num_frames,
+            load_frame,
+            add_frame,
+            window=stream_window,
+            prefetch=stream_prefetch,
+            num_workers=stream_workers,
+        )
+
+        # The background needs every frame; build it off the critical path
+        # and send it once when it is ready.
+        threading.Thread(target=add_background, daemon=True).start()
+    else:
+        # Unproject all frames in batched passes.
+        point_clouds = loader.get_point_clouds(
+            range(num_frames), downsample_factor, bg_downsample_factor
+        )
+        for i in tqdm(range(num_frames)):
+            frame_data = load_frame(i, point_clouds[i])
+            frame_nodes.append(add_frame(server.scene, i, frame_data, True))
+
+        # Initialize frame visibility.
+        for i, frame_node in enumerate(frame_nodes):
+            if gui_show_all_frames.value:
+                frame_node.visible = (i % gui_stride.value == 0)
+            else:
+                frame_node.visible = i == gui_timestep.value
+
+        # Add background frame.
+        add_background(point_clouds)
 
     # Playback update loop.
     prev_timestep = gui_timestep.value